@@ -1,7 +1,22 @@
+import asyncio
+import time
+_import_started = time.perf_counter()
 from fastapi import FastAPI
-from api.routers import keys, configs, sessions, statistics, settings, system
+from api.routers import keys, configs, sessions, statistics, settings, system, jobs, notifications, events, metrics, federation, health
 from fastapi.middleware.cors import CORSMiddleware
-app = FastAPI(title="OpenVPN Management API")
+from api.services.management import management_pool
+from api.services.rollups import traffic_rollups
+from api.services.session_archive import session_archive
+from api.services.address_pool import address_pools
+from api.services.serialization import FastJSONResponse
+from api.services.events import event_bus, on_sessions_opened, on_sessions_closed
+from api.services.expiry import expiry_scheduler
+from api.services.traffic_limits import traffic_limits
+from api.services.metrics import MetricsMiddleware, instrument_data_layer, registry
+from api.services.federation import federation as federation_client
+from api.services.workers import PrimaryForwardMiddleware, event_relay, metrics_export, worker_state, is_primary
+from api.services.warmup import warm_up, record as record_startup
+app = FastAPI(title="OpenVPN Management API", default_response_class=FastJSONResponse)
 
 
 app.add_middleware(
@@ -11,9 +26,50 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+# Снаружи метрик: переданный основному воркеру запрос учитывает он сам
+app.add_middleware(PrimaryForwardMiddleware)
+# Роутеры и сервисы уже импортировали functions.data.* — подменяем и их ссылки
+instrument_data_layer()
+management_pool.subscribe_closed(traffic_rollups.on_closed)
+management_pool.subscribe_opened(on_sessions_opened)
+management_pool.subscribe_closed(on_sessions_closed)
+
 app.include_router(keys.router, prefix="/keys", tags=["Keys"])
 app.include_router(configs.router, prefix="/configs", tags=["Configs"])
 app.include_router(sessions.router, prefix="/sessions", tags=["Sessions"])
 app.include_router(statistics.router, prefix="/statistics", tags=["Statistics"])
 app.include_router(settings.router, prefix="/settings", tags=["Settings"])
-app.include_router(system.router, prefix="/system", tags=["System"])
\ No newline at end of file
+app.include_router(system.router, prefix="/system", tags=["System"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
+app.include_router(notifications.router, prefix="/notifications", tags=["Notifications"])
+app.include_router(events.router, prefix="/events", tags=["Events"])
+app.include_router(metrics.router, tags=["Metrics"])
+app.include_router(federation.router, prefix="/federation", tags=["Federation"])
+app.include_router(health.router, prefix="/health", tags=["Health"])
+record_startup("import", time.perf_counter() - _import_started)
+
+@app.on_event("startup")
+async def start_background_services():
+    loop = asyncio.get_event_loop()
+    event_bus.attach(loop)
+    event_relay.start(event_bus, loop)
+    metrics_export.start(registry)
+    # Фоновые службы — по одной на хост: только в основном воркере
+    if is_primary():
+        management_pool.start()
+        session_archive.start()
+        traffic_rollups.start()
+        address_pools.start()
+        expiry_scheduler.start()
+        traffic_limits.start(management_pool)
+    await warm_up()
+    worker_state.mark_ready()
+
+@app.on_event("shutdown")
+async def stop_management_pool():
+    worker_state.draining = True
+    event_relay.stop()
+    metrics_export.stop()
+    await management_pool.stop()
+    await federation_client.close()
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Бенчмарк конкурентности: задержка дешёвых запросов под тяжёлой нагрузкой.
+
+Приложение поднимается поверх синтетического слоя данных (с задержкой
+каждого обращения к БД, как у сетевой базы) и опрашивается через ASGI
+в одном цикле событий. Сначала зонды — дешёвые запросы — идут одни,
+затем параллельно с ними тяжёлые клиенты гоняют пересборку статистики
+и сортировку ключей по трафику. Для каждого зонда печатаются p50/p95
+в обеих фазах: async-роуты поверх services/data_access должны
+остаться на месте, синхронные — ждать свободного потока пула FastAPI.
+
+    python -m api.benchmarks.concurrency --keys 10000 --threadpool 8 --heavy 16
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from api.benchmarks import fake_layer
+
+PROBES = (
+    ("GET /keys/{id} (async)", "/keys/%d"),
+    ("GET /configs/{id} (async)", "/configs/1"),
+    ("GET /jobs/ (sync)", "/jobs/"),
+)
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] if ordered else float("nan")
+
+
+async def _probe(client, path, deadline, timings):
+    i = 0
+    while time.monotonic() < deadline:
+        i += 1
+        started = time.perf_counter()
+        response = await client.get(path % (i % 100 + 1) if "%d" in path else path)
+        response.raise_for_status()
+        timings.append(time.perf_counter() - started)
+        await asyncio.sleep(0.005)
+
+
+async def _heavy(client, deadline, counter):
+    from api.services import changes
+
+    i = 0
+    while time.monotonic() < deadline:
+        i += 1
+        if i % 2:
+            changes.bump(changes.KEYS)
+            path = "/statistics/"
+        else:
+            changes.bump(changes.SESSIONS)
+            path = "/keys/?by=traffic&limit=100"
+        response = await client.get(path)
+        response.raise_for_status()
+        counter[0] += 1
+
+
+async def _phase(client, seconds, heavy):
+    deadline = time.monotonic() + seconds
+    timings = {name: [] for name, _ in PROBES}
+    counter = [0]
+    tasks = [_probe(client, path, deadline, timings[name]) for name, path in PROBES]
+    tasks += [_heavy(client, deadline, counter) for _ in range(heavy)]
+    await asyncio.gather(*tasks)
+    return {name: sorted(t) for name, t in timings.items()}, counter[0]
+
+
+async def run(args):
+    import httpx
+    from anyio.to_thread import current_default_thread_limiter
+    from api.app import app
+
+    current_default_thread_limiter().total_tokens = args.threadpool
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        # Прогрев кэшей
+        for _, path in PROBES:
+            await client.get(path % 1 if "%d" in path else path)
+        idle, _ = await _phase(client, args.seconds, 0)
+        loaded, heavy_done = await _phase(client, args.seconds, args.heavy)
+
+    print("threadpool %d, heavy clients %d, heavy requests done %d" % (args.threadpool, args.heavy, heavy_done))
+    print("%-28s %11s %11s %11s %11s %9s" % ("probe", "idle p50", "idle p95", "load p50", "load p95", "p95 x"))
+    for name, _ in PROBES:
+        a, b = idle[name], loaded[name]
+        print("%-28s %9.2fms %9.2fms %9.2fms %9.2fms %8.1fx" % (
+            name, _percentile(a, .5) * 1000, _percentile(a, .95) * 1000,
+            _percentile(b, .5) * 1000, _percentile(b, .95) * 1000,
+            _percentile(b, .95) / _percentile(a, .95),
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--sessions", type=int, default=5, help="Среднее число сессий на ключ")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Задержка обращения к БД, сек")
+    parser.add_argument("--threadpool", type=int, default=8, help="Потоков в пуле синхронных роутов")
+    parser.add_argument("--heavy", type=int, default=16, help="Одновременных тяжёлых клиентов")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Длительность каждой фазы")
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENVPN_API_DATA", tempfile.mkdtemp(prefix="openvpn-api-bench-"))
+    fake_layer.install(fake_layer.FakeDatabase(args.keys, 8, args.sessions, latency=args.db_latency))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,251 @@
+"""
+Бенчмарк эндпоинтов API на синтетическом слое данных.
+
+Для каждого размера базы (по умолчанию 1k/10k/100k ключей, ~20 сессий
+на ключ) приложение поднимается поверх benchmarks/fake_layer и каждый
+сценарий прогоняется через TestClient: перцентили задержки,
+пропускная способность (запросы подряд, в один поток) и пик выделенной
+памяти на запрос (tracemalloc, отдельным проходом). Сценарии «cold»
+перед каждым запросом сбрасывают версии таблиц и меряют пересборку
+кэшей. Массовые действия меряются до завершения фоновой задачи.
+
+Результаты сравниваются с сохранённым базовым прогоном:
+
+    python -m api.benchmarks.endpoints --keys 1000 10000 --save
+    python -m api.benchmarks.endpoints --keys 1000 10000 --strict
+
+Стартовые хуки приложения (опрос management, планировщики) не
+запускаются; POST /keys/batch не меряется — ключи создаются в пуле
+процессов, куда подменённый слой данных не попадает.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from api.benchmarks import fake_layer
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+BULK_SIZE = 1000
+JOB_TIMEOUT = 300.0
+HEADER = "%-40s %9s %9s %9s %9s %10s %8s" % ("case", "p50,ms", "p95,ms", "p99,ms", "rps", "alloc,KiB", "vs base")
+
+
+class Case:
+    """
+    Сценарий: method и path(db, i) — запрос номер i; body(db, i) — JSON.
+    cold — сбросить версии таблиц перед запросом, job — ждать фоновую задачу.
+    """
+
+    def __init__(self, name, method, path, body=None, cold=(), job=False, requests=None):
+        self.name = name
+        self.method = method
+        self.path = path if callable(path) else (lambda db, i, p=path: p)
+        self.body = body
+        self.cold = cold
+        self.job = job
+        self.requests = requests
+
+
+def _key_id(db, i):
+    # Ключи из середины таблицы, каждый запрос — другой
+    return (len(db.keys) // 2 + i) % len(db.keys) + 1
+
+
+def _bulk_ids(part):
+    # У каждого действия своя восьмая часть таблицы, у запроса — своя пачка в ней
+    def body(db, i):
+        size = max(1, min(BULK_SIZE, len(db.keys) // 64))
+        slots = max(1, len(db.keys) // 8 // size)
+        start = part * (len(db.keys) // 8) + i % slots * size
+        return {"ids": list(range(start + 1, start + size + 1))}
+    return body
+
+
+def _key_modes(db):
+    day = db.keys[1].created.date().isoformat()
+    config = db.configs[1]
+    return [
+        ("all", None), ("name", "key_%d" % (len(db.keys) // 2)), ("email", "user1@example.com"),
+        ("status", "true"), ("port", str(config.port)), ("config", "1"), ("protocol", config.protocol),
+        ("days", "30"), ("date", day), ("created", day), ("updated", day), ("expired", None),
+        ("expired_days", None), ("traffic", None), ("sessions", None), ("connected_time", None),
+        ("free_keys", None),
+    ]
+
+
+def build_cases(db):
+    from api.services.changes import KEYS, SESSIONS
+
+    cases = [
+        Case("GET /statistics/", "GET", "/statistics/"),
+        Case("GET /statistics/ cold", "GET", "/statistics/", cold=(KEYS,), requests=10),
+        Case("GET /statistics/traffic", "GET", "/statistics/traffic"),
+        Case("GET /configs/", "GET", "/configs/"),
+        Case("GET /configs/{id}/keys", "GET", "/configs/1/keys", requests=10),
+    ]
+    for by, value in _key_modes(db):
+        query = "/keys/?by=%s" % by + ("&value=%s" % value if value is not None else "")
+        cases.append(Case("GET /keys/ by=%s" % by, "GET", query, requests=10))
+        cases.append(Case("GET /keys/ by=%s limit=100" % by, "GET", query + "&limit=100"))
+    cases += [
+        Case("GET /keys/ stream", "GET", "/keys/?stream=true", requests=5),
+        Case("GET /keys/ cold", "GET", "/keys/?limit=100", cold=(KEYS,), requests=10),
+        Case("GET /keys/ by=traffic cold", "GET", "/keys/?by=traffic&limit=100", cold=(SESSIONS,), requests=5),
+        Case("GET /keys/{id}", "GET", lambda db, i: "/keys/%d" % _key_id(db, i)),
+        Case("GET /keys/{id}/sessions", "GET", lambda db, i: "/keys/%d/sessions" % _key_id(db, i)),
+        Case("GET /sessions/key/{id} limit=50", "GET", lambda db, i: "/sessions/key/%d?limit=50" % _key_id(db, i)),
+        Case("POST /keys/{id}/block", "POST", lambda db, i: "/keys/%d/block" % _key_id(db, i)),
+        Case("POST /keys/{id}/unblock", "POST", lambda db, i: "/keys/%d/unblock" % _key_id(db, i)),
+        Case("PUT /keys/{id}", "PUT", lambda db, i: "/keys/%d" % _key_id(db, i), body=lambda db, i: {"days": 30}),
+        Case("POST /keys/bulk/block", "POST", "/keys/bulk/block", body=_bulk_ids(0), job=True, requests=5),
+        Case("POST /keys/bulk/unblock", "POST", "/keys/bulk/unblock", body=_bulk_ids(0), job=True, requests=5),
+        Case("POST /keys/bulk/fix", "POST", "/keys/bulk/fix", body=_bulk_ids(1), job=True, requests=5),
+        Case("POST /keys/bulk/send_tg", "POST", "/keys/bulk/send_tg", body=_bulk_ids(2), requests=5),
+        Case("POST /keys/bulk/clear_traffic", "POST", "/keys/bulk/clear_traffic", body=_bulk_ids(3),
+             job=True, requests=5),
+        # Удаление — последним: дальше таблица уже другая
+        Case("POST /keys/bulk/delete", "POST", "/keys/bulk/delete", body=_bulk_ids(5), job=True, requests=5),
+    ]
+    return cases
+
+
+def _wait_job(response):
+    from api.services.jobs import job_manager
+
+    job = job_manager.get(response.json()["job_id"])
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while job.finished is None:
+        if time.monotonic() > deadline:
+            raise RuntimeError("job %s did not finish" % job.id)
+        time.sleep(0.001)
+
+
+def _request(client, db, case, i):
+    from api.services import changes
+
+    if case.cold:
+        changes.bump(*case.cold)
+    kwargs = {"json": case.body(db, i)} if case.body else {}
+    started = time.perf_counter()
+    response = client.request(case.method, case.path(db, i), **kwargs)
+    if response.status_code >= 400:
+        raise RuntimeError("%s -> %d: %s" % (case.name, response.status_code, response.text[:200]))
+    if case.job:
+        _wait_job(response)
+    return time.perf_counter() - started
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def measure(client, db, case, requests, alloc_requests, offset):
+    count = case.requests or requests
+    # Один прогрев: первый запрос строит кэши и не входит в замер
+    _request(client, db, case, offset)
+    gc.collect()
+    timings = sorted(_request(client, db, case, offset + 1 + i) for i in range(count))
+    peaks = []
+    for i in range(alloc_requests):
+        tracemalloc.start()
+        try:
+            _request(client, db, case, offset + 1 + count + i)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return {
+        "requests": count,
+        "p50": round(_percentile(timings, 0.50) * 1000, 3),
+        "p95": round(_percentile(timings, 0.95) * 1000, 3),
+        "p99": round(_percentile(timings, 0.99) * 1000, 3),
+        "rps": round(count / sum(timings), 1),
+        "alloc_kib": round(max(peaks) / 1024, 1) if peaks else None,
+    }
+
+
+def run_tier(app_client, keys, args):
+    db = fake_layer.use(fake_layer.FakeDatabase(keys, args.configs, args.sessions, args.seed))
+    from api.services import changes
+    changes.bump(*changes.TABLES)
+    print("\n== %d keys, %d configs, %d sessions" % (len(db.keys), len(db.configs), db.session_count))
+    print(HEADER)
+    results = {}
+    for case in build_cases(db):
+        if args.only and not any(part in case.name for part in args.only):
+            continue
+        # Смещение запросов: разные сценарии трогают разные ключи
+        offset = len(results) * (args.requests + args.alloc_requests + 1)
+        results[case.name] = measure(app_client, db, case, args.requests, args.alloc_requests, offset)
+        yield case.name, results[case.name]
+
+
+def _delta(current, base):
+    if not base:
+        return ""
+    p95 = base.get("p95")
+    return "%+.0f%%" % ((current["p95"] - p95) / p95 * 100) if p95 else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--keys", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--configs", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=20, help="Среднее число сессий на ключ")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=50, help="Запросов на сценарий (тяжёлые — меньше)")
+    parser.add_argument("--alloc-requests", type=int, default=3, help="Запросов под tracemalloc")
+    parser.add_argument("--only", nargs="+", help="Только сценарии, содержащие подстроку")
+    parser.add_argument("--baseline", default=BASELINE, help="Файл базового прогона")
+    parser.add_argument("--save", action="store_true", help="Записать результаты как базовый прогон")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Допустимый рост p95 (доля)")
+    parser.add_argument("--strict", action="store_true", help="Код возврата 1 при регрессиях")
+    args = parser.parse_args()
+
+    # Своё хранилище API (архивы, роллапы) — во временном каталоге
+    os.environ.setdefault("OPENVPN_API_DATA", tempfile.mkdtemp(prefix="openvpn-api-bench-"))
+    fake_layer.install()
+    from fastapi.testclient import TestClient
+    from api.app import app
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    # Без контекстного менеджера: стартовые хуки не выполняются
+    client = TestClient(app)
+    results = {}
+    regressions = []
+    for keys in args.keys:
+        tier = "%dk" % (keys // 1000) if keys >= 1000 else str(keys)
+        tier_results = results.setdefault(tier, {})
+        for name, r in run_tier(client, keys, args):
+            tier_results[name] = r
+            base = baseline.get(tier, {}).get(name)
+            print("%-40s %9.2f %9.2f %9.2f %9.1f %10s %8s" % (
+                name[:40], r["p50"], r["p95"], r["p99"], r["rps"],
+                "-" if r["alloc_kib"] is None else r["alloc_kib"], _delta(r, base),
+            ))
+            if base and base.get("p95") and r["p95"] > base["p95"] * (1 + args.threshold):
+                regressions.append("%s %s: p95 %.2f ms -> %.2f ms" % (tier, name, base["p95"], r["p95"]))
+
+    if args.save:
+        merged = dict(baseline)
+        merged.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(merged, f, indent=1, sort_keys=True)
+        print("\nbaseline saved: %s" % args.baseline)
+    if regressions:
+        print("\nregressions (p95 > +%d%%):" % (args.threshold * 100))
+        for line in regressions:
+            print("  " + line)
+        if args.strict:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Локальные заглушки SMTP и Telegram Bot API для проверки уведомлений.
+
+FakeSmtpServer — минимальный SMTP без TLS (EHLO, AUTH, MAIL, RCPT, DATA,
+RSET, NOOP, QUIT) на 127.0.0.1: принятые письма складываются в messages,
+число TCP-соединений — в connections. Настройки почты API указывают на
+него (mail_host=127.0.0.1, mail_port=server.port).
+
+FakeTelegram — HTTP/1.1 с keep-alive: отвечает ok=true на любой метод
+/bot<token>/<method>, запоминает вызовы и считает соединения. API
+направляется на него переменной OPENVPN_API_TELEGRAM_URL=server.url
+(или TelegramSession(url)).
+
+    smtp = FakeSmtpServer().start()
+    telegram = FakeTelegram().start()
+    ...
+    smtp.stop(); telegram.stop()
+"""
+import email
+import http.server
+import socketserver
+import threading
+from email import policy
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        server = self.server.owner
+        with server.lock:
+            server.connections += 1
+        self._reply("220 fake-smtp ready")
+        sender, recipients = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            verb = line.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self._reply("250-fake-smtp")
+                self._reply("250-AUTH PLAIN LOGIN")
+                self._reply("250 8BITMIME")
+            elif verb == "HELO":
+                self._reply("250 fake-smtp")
+            elif verb == "AUTH":
+                self._reply("235 authenticated")
+            elif verb == "MAIL":
+                sender, recipients = line[10:].strip("<> "), []
+                self._reply("250 ok")
+            elif verb == "RCPT":
+                recipients.append(line[8:].strip("<> "))
+                self._reply("250 ok")
+            elif verb == "DATA":
+                self._reply("354 end with .")
+                lines = []
+                while True:
+                    raw = self.rfile.readline()
+                    if not raw or raw in (b".\r\n", b".\n"):
+                        break
+                    lines.append(raw[1:] if raw.startswith(b"..") else raw)
+                message = email.message_from_bytes(b"".join(lines), policy=policy.default)
+                with server.lock:
+                    server.messages.append((sender, recipients, message))
+                self._reply("250 queued")
+            elif verb in ("RSET", "NOOP"):
+                self._reply("250 ok")
+            elif verb == "QUIT":
+                self._reply("221 bye")
+                return
+            else:
+                self._reply("502 not implemented")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSmtpServer:
+    def __init__(self, port=0):
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), _SmtpHandler)
+        self._server.owner = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-smtp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _TelegramHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        server = self.server.owner
+        with server.lock:
+            server.connections += 1
+
+    def do_POST(self):
+        server = self.server.owner
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        parts = self.path.strip("/").split("/")
+        token = parts[0][3:] if parts and parts[0].startswith("bot") else None
+        method = parts[1] if len(parts) > 1 else None
+        with server.lock:
+            server.calls.append((token, method, self.headers.get("Content-Type"), body))
+        payload = b'{"ok": true, "result": {}}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTelegram:
+    def __init__(self, port=0):
+        self.calls = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _TelegramHandler)
+        self._server.daemon_threads = True
+        self._server.owner = self
+        self.port = self._server.server_address[1]
+        self.url = "http://127.0.0.1:%d" % self.port
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
\ No newline at end of file
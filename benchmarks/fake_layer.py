@@ -0,0 +1,501 @@
+"""
+Синтетический слой данных бота для бенчмарков API.
+
+Роутеры и сервисы используют functions.data.*, functions.client,
+functions.list, functions.other и functions.server_control напрямую.
+install() регистрирует в sys.modules их замену поверх FakeDatabase —
+ключи, конфиги и сессии в памяти процесса, — поэтому приложение можно
+мерить без хоста OpenVPN, БД бота и systemctl. Вызывать до импорта
+api.app. functions.client, functions.list, functions.other и
+functions.server_control, как и настоящие, попадают в sys.modules только
+при импорте — бенчмарк старта (startup.py) видит, что API их не тянет.
+
+Сигнатуры повторяют вызовы из API; генерация сертификатов, отправка в
+Telegram/почту и systemctl ничего не делают, так что в замеры попадает
+только собственная работа API.
+"""
+import bisect
+import contextlib
+import importlib.abc
+import importlib.util
+import random
+import sys
+import time
+import types
+from datetime import datetime, timedelta
+
+PROTOCOLS = ("udp", "tcp")
+
+
+class FakeKey:
+    __slots__ = ("id", "name", "email", "days", "config_id", "status", "connected",
+                 "expired", "used_total", "free_key", "created", "updated")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+
+class FakeConfig:
+    __slots__ = ("id", "port", "protocol", "telnet_port", "address", "subnet", "status", "created", "updated")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+
+class _Column:
+    """Поле модели: на классе — для Model.select()/delete().where(Model.id > x / Model.id.in_(ids))"""
+
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __get__(self, obj, owner=None):
+        return self if obj is None else self.slot.__get__(obj, owner)
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+    def __gt__(self, value):
+        return _Where(after=value)
+
+    def in_(self, values):
+        return _Where(ids=set(values))
+
+
+class _Where:
+    """Условие по ID: after — id > after, ids — id IN ids"""
+
+    def __init__(self, after=None, ids=None):
+        self.after = after
+        self.ids = ids
+
+
+class _Select:
+    def __init__(self):
+        self.condition = _Where()
+        self.count = None
+
+    def where(self, condition):
+        self.condition = condition
+        return self
+
+    def order_by(self, *fields):
+        # Выборка и так идёт по возрастанию ID
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def __iter__(self):
+        return iter(_db.select_sessions(self.condition, self.count))
+
+
+class _Delete:
+    def __init__(self):
+        self.condition = _Where(ids=set())
+
+    def where(self, condition):
+        self.condition = condition
+        return self
+
+    def execute(self):
+        return _db.delete_sessions(self.condition.ids)
+
+
+class FakeSession:
+    __slots__ = ("_id", "key_id", "ip", "connected", "disconnected", "total_bytes", "total_connected_time", "_db")
+    _meta = types.SimpleNamespace(database=types.SimpleNamespace(atomic=contextlib.nullcontext))
+
+    def __init__(self, db, session_id, key_id, ip, connected, disconnected, total_bytes, total_connected_time):
+        self._db = db
+        self.id = session_id
+        self.key_id = key_id
+        self.ip = ip
+        self.connected = connected
+        self.disconnected = disconnected
+        self.total_bytes = total_bytes
+        self.total_connected_time = total_connected_time
+
+    def delete_instance(self):
+        self._db.delete_session(self)
+
+    @classmethod
+    def select(cls):
+        return _Select()
+
+    @classmethod
+    def delete(cls):
+        return _Delete()
+
+
+FakeSession.id = _Column(FakeSession._id)
+
+
+class FakeSettings:
+    def __init__(self):
+        self.bot_token = "0:fake"
+        self.bot_chat_id = "0"
+        self.telegraph_token = None
+        self.use_mail = False
+        self.mail_host = None
+        self.mail_port = None
+        self.mail_login = None
+        self.mail_password = None
+        self.subject = "Пожалуйста, ваша VPN конфигурация"
+        self.text = "1 ключ - 1 устройство"
+
+    def save(self):
+        pass
+
+
+class FakeDatabase:
+    """
+    Ключи, конфиги и сессии в памяти.
+
+    keys — число ключей, configs — число конфигов, sessions — среднее
+    число сессий на ключ (100k ключей * 20 = 2M сессий), latency —
+    задержка каждого обращения к слою данных, как у сетевой БД. Данные
+    детерминированы seed. Даты сессий берутся из небольшого пула, чтобы
+    миллионы сессий не держали миллионы объектов datetime.
+    """
+
+    def __init__(self, keys=1000, configs=8, sessions=20, seed=1, latency=0.0):
+        rnd = random.Random(seed)
+        self.latency = latency
+        now = datetime.now().replace(microsecond=0)
+        self.now = now
+        self.settings = FakeSettings()
+        self.mail_settings = {
+            "mail_create_key": True, "mail_expired_key": True,
+            "mail_week_before_expired": False, "mail_day_before_expired": False,
+        }
+        self.configs = {}
+        for i in range(1, configs + 1):
+            self.configs[i] = FakeConfig(
+                id=i, port=1194 + i, protocol=PROTOCOLS[i % 2], telnet_port=7505 + i,
+                address="203.0.113.1", subnet="10.%d.0.0" % i, status=True, created=now, updated=now,
+            )
+        self.keys = {}
+        self.by_name = {}
+        for i in range(1, keys + 1):
+            self._add_key(FakeKey(
+                id=i, name="key_%d" % i, email="user%d@example.com" % i if i % 3 else None,
+                days=(30, 90, 365)[i % 3], config_id=i % configs + 1, status=i % 7 != 0,
+                connected=i % 4 == 0, expired=now + timedelta(days=rnd.randint(-60, 365)),
+                used_total=0, free_key=i % 50 == 0,
+                created=now - timedelta(days=i % 120), updated=now - timedelta(days=i % 30),
+            ))
+
+        moments = [now - timedelta(minutes=15 * m) for m in range(4 * 24 * 90)]
+        self.sessions = {}
+        self.bytes_by_key = {}
+        self.bytes_by_config = dict.fromkeys(self.configs, 0)
+        self._session_ids = 0
+        self._session_index = None
+        self._session_order = None
+        for key in self.keys.values():
+            rows = []
+            for _ in range(rnd.randint(0, 2 * sessions)):
+                self._session_ids += 1
+                start = rnd.randrange(1, len(moments))
+                seconds = rnd.randint(60, 4 * 3600)
+                rows.append(FakeSession(
+                    self, self._session_ids, key.id, "198.51.100.%d" % (self._session_ids % 250 + 1),
+                    moments[start], moments[max(0, start - 1 - seconds // 900)],
+                    rnd.randint(10 ** 4, 10 ** 9), seconds,
+                ))
+            self.sessions[key.id] = rows
+            self._count(key, sum(s.total_bytes for s in rows))
+
+    @property
+    def session_count(self):
+        return self._session_ids
+
+    def _add_key(self, key):
+        self.keys[key.id] = key
+        self.by_name.setdefault(key.name, []).append(key)
+
+    def _count(self, key, delta):
+        self.bytes_by_key[key.id] = self.bytes_by_key.get(key.id, 0) + delta
+        if key.config_id in self.bytes_by_config:
+            self.bytes_by_config[key.config_id] += delta
+
+    def delete_session(self, session):
+        rows = self.sessions.get(session.key_id)
+        if rows and session in rows:
+            rows.remove(session)
+            key = self.keys.get(session.key_id)
+            if key is not None:
+                self._count(key, -(session.total_bytes or 0))
+
+    def _index(self):
+        # Индекс по ID строится только для компакции и роллапов, бенчмарки его не держат
+        if self._session_index is None:
+            self._session_index = {s.id: s for rows in self.sessions.values() for s in rows}
+            self._session_order = sorted(self._session_index)
+        return self._session_index
+
+    def add_session(self, key_id, connected, disconnected, total_bytes, total_connected_time, ip="198.51.100.1"):
+        """Сессия, записанная ботом после старта API"""
+        self._session_ids += 1
+        session = FakeSession(self, self._session_ids, key_id, ip, connected, disconnected,
+                              total_bytes, total_connected_time)
+        self.sessions.setdefault(key_id, []).append(session)
+        if self._session_index is not None:
+            self._session_index[session.id] = session
+            self._session_order.append(session.id)
+        key = self.keys.get(key_id)
+        if key is not None:
+            self._count(key, total_bytes or 0)
+        return session
+
+    def select_sessions(self, condition, count=None):
+        index = self._index()
+        if condition.ids is not None:
+            return [index[i] for i in sorted(condition.ids) if i in index][:count]
+        start = 0 if condition.after is None else bisect.bisect_right(self._session_order, condition.after)
+        rows = []
+        # Удалённые ID остаются в _session_order — пропускаются
+        for position in range(start, len(self._session_order)):
+            session_id = self._session_order[position]
+            if session_id in index:
+                rows.append(index[session_id])
+                if len(rows) == count:
+                    break
+        return rows
+
+    def delete_sessions(self, ids):
+        index = self._index()
+        deleted = 0
+        for session_id in ids:
+            session = index.pop(session_id, None)
+            if session is not None:
+                self.delete_session(session)
+                deleted += 1
+        return deleted
+
+    # functions.data.key
+
+    def get_keys_db(self):
+        return list(self.keys.values())
+
+    def get_key_by_id(self, key_id):
+        return self.keys.get(key_id)
+
+    def get_keys_by_name_db(self, name):
+        return list(self.by_name.get(name, []))
+
+    def get_keys_by_config_db(self, config_id):
+        return [k for k in self.keys.values() if k.config_id == config_id]
+
+    def edit_key_db(self, name, **fields):
+        for key in self.by_name.get(name, []):
+            for field, value in fields.items():
+                setattr(key, field, value)
+            key.updated = datetime.now()
+
+    # functions.data.configs
+
+    def get_configs_db(self):
+        return list(self.configs.values())
+
+    def get_config_by_id_db(self, config_id):
+        return self.configs.get(config_id)
+
+    def create_config_db(self, port, protocol, telnet_port, subnet, address):
+        config_id = max(self.configs, default=0) + 1
+        now = datetime.now()
+        self.configs[config_id] = FakeConfig(
+            id=config_id, port=port, protocol=protocol, telnet_port=telnet_port, address=address,
+            subnet=subnet, status=True, created=now, updated=now,
+        )
+        self.bytes_by_config[config_id] = 0
+
+    def delete_config_db(self, config_id):
+        self.configs.pop(config_id, None)
+        self.bytes_by_config.pop(config_id, None)
+
+    # functions.data.session
+
+    def get_session_db(self, key):
+        return list(self.sessions.get(key.id, ()))
+
+    def delete_session_db(self, key_id):
+        for session in list(self.sessions.get(key_id, ())):
+            self.delete_session(session)
+
+    def get_total_keys_bytes_db(self):
+        return sum(self.bytes_by_key.values())
+
+    def get_total_key_bytes_by_config_db(self, config_id):
+        return self.bytes_by_config.get(config_id, 0)
+
+    # functions.client
+
+    def create_key(self, name, days, amount, config_id, email=None):
+        now = datetime.now()
+        for _ in range(amount):
+            key_id = max(self.keys, default=0) + 1
+            self._add_key(FakeKey(
+                id=key_id, name=name, email=email, days=days, config_id=config_id, status=True,
+                connected=False, expired=now + timedelta(days=days), used_total=0, free_key=False,
+                created=now, updated=now,
+            ))
+            self.sessions[key_id] = []
+
+    def delete_key(self, key_id):
+        key = self.keys.pop(key_id, None)
+        if key is None:
+            return
+        self.by_name[key.name].remove(key)
+        self.delete_session_db(key_id)
+        self.sessions.pop(key_id, None)
+        self.bytes_by_key.pop(key_id, None)
+
+    def block_key(self, key):
+        key.status = False
+
+    def unblock_key(self, key):
+        key.status = True
+
+    def renew_key(self, key_id, days):
+        key = self.keys[key_id]
+        key.expired = max(key.expired or self.now, datetime.now()) + timedelta(days=days)
+
+    def recreate_key(self, key_id):
+        self.keys[key_id].updated = datetime.now()
+
+    def transfer_key(self, key_id, config_id):
+        key = self.keys[key_id]
+        total = self.bytes_by_key.get(key_id, 0)
+        self._count(key, -total)
+        key.config_id = config_id
+        self._count(key, total)
+
+
+def math_bytes(value):
+    value = float(value or 0)
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if value < 1024 or unit == "TB":
+            return "%.1f %s" % (value, unit)
+        value /= 1024
+
+
+def default_json(index, key):
+    return {
+        "#": index, "id": key.id, "name": key.name, "email": key.email, "days": key.days,
+        "config_id": key.config_id, "status": key.status, "connected": key.connected,
+        "expired": str(key.expired), "free_key": key.free_key,
+        "created": str(key.created), "updated": str(key.updated),
+    }
+
+
+_db = None
+_service_calls = []
+
+
+def use(db):
+    """Подменить набор данных (например, между прогонами 1k/10k/100k)"""
+    global _db
+    _db = db
+    return db
+
+
+def _proxy(name):
+    def call(*args, **kwargs):
+        if _db.latency:
+            # Ожидание ответа БД: поток спит, GIL свободен
+            time.sleep(_db.latency)
+        return getattr(_db, name)(*args, **kwargs)
+    call.__name__ = name
+    return call
+
+
+def _proxies(*names):
+    return {name: _proxy(name) for name in names}
+
+
+def _fill(module, attrs):
+    for value in attrs.values():
+        # Функции «принадлежат» модулю — как настоящие, для instrument_data_layer()
+        if isinstance(value, types.FunctionType):
+            value.__module__ = module.__name__
+    module.__dict__.update(attrs)
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__path__ = []
+    _fill(module, attrs)
+    sys.modules[name] = module
+    return module
+
+
+class _Deferred(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """Модули, которые создаются только при импорте"""
+
+    def __init__(self):
+        self.modules = {}
+
+    def find_spec(self, name, path=None, target=None):
+        if name in self.modules:
+            return importlib.util.spec_from_loader(name, self)
+        return None
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        _fill(module, self.modules[module.__name__])
+
+
+_deferred = _Deferred()
+
+
+def _defer(name, **attrs):
+    _deferred.modules[name] = attrs
+    if _deferred not in sys.meta_path:
+        sys.meta_path.insert(0, _deferred)
+
+
+def _service(action):
+    def call(config_id):
+        _service_calls.append((action, config_id))
+    return call
+
+
+def install(db=None):
+    """Зарегистрировать поддельные модули functions.*; вернуть набор данных"""
+    use(db or FakeDatabase())
+    _module("functions")
+    _module("functions.data")
+    _module("functions.data.key", **_proxies(
+        "get_keys_db", "get_key_by_id", "get_keys_by_name_db", "get_keys_by_config_db", "edit_key_db",
+    ))
+    _module("functions.data.configs", **_proxies(
+        "get_configs_db", "get_config_by_id_db", "create_config_db", "delete_config_db",
+    ))
+    _module("functions.data.session", **_proxies(
+        "get_session_db", "delete_session_db", "get_total_keys_bytes_db", "get_total_key_bytes_by_config_db",
+    ))
+    _module("functions.data.settings", get_settings_db=lambda: _db.settings)
+    _defer("functions.client", **_proxies(
+        "create_key", "delete_key", "block_key", "unblock_key", "renew_key", "recreate_key", "transfer_key",
+    ))
+    _defer("functions.list", KeysList=types.SimpleNamespace(
+        default_json=default_json,
+        list_by_criteria=lambda by, value: [],
+    ))
+    _defer("functions.other",
+           math_bytes=math_bytes,
+           key_to_tg=lambda key, settings=None: None,
+           key_to_email=lambda key, settings=None: None,
+           load_mail_settings=lambda: dict(_db.mail_settings),
+           save_mail_settings=lambda values: _db.mail_settings.update(values))
+    _defer("functions.server_control",
+           enable_config_db=_service("enable"),
+           disable_config_db=_service("disable"),
+           restart_config_db=_service("restart"))
+    return _db
\ No newline at end of file
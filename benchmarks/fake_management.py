@@ -0,0 +1,103 @@
+"""
+Поддельный management-интерфейс OpenVPN для локальных проверок.
+
+Отвечает на status 3 / kill / bytecount так же, как настоящий сервер,
+со сгенерированным списком клиентов.
+
+    python -m api.benchmarks.fake_management --port 7505 --clients 200
+"""
+import argparse
+import asyncio
+import time
+
+GREETING = ">INFO:OpenVPN Management Interface Version 3 -- type 'help' for more info"
+
+HEADER = "\t".join([
+    "HEADER", "CLIENT_LIST", "Common Name", "Real Address", "Virtual Address",
+    "Virtual IPv6 Address", "Bytes Received", "Bytes Sent", "Connected Since",
+    "Connected Since (time_t)", "Username", "Client ID", "Peer ID",
+])
+
+
+class FakeManagementServer:
+    def __init__(self, clients=10, prefix="key"):
+        now = int(time.time())
+        self.clients = {
+            "%s_%d" % (prefix, i): {
+                "real": "198.51.100.%d:%d" % (i % 250 + 1, 40000 + i),
+                "virtual": "10.8.%d.%d" % (i // 250, i % 250 + 2),
+                "rx": 1000 * i,
+                "tx": 2000 * i,
+                "since": now - 60 * i,
+                "cid": i,
+            }
+            for i in range(1, clients + 1)
+        }
+        self.bytecount = 0
+
+    def status(self):
+        lines = ["TITLE\tOpenVPN 2.5.0 fake", "TIME\t%s\t%d" % (time.ctime(), time.time()), HEADER]
+        for name, c in self.clients.items():
+            lines.append("\t".join(map(str, [
+                "CLIENT_LIST", name, c["real"], c["virtual"], "", c["rx"], c["tx"],
+                time.ctime(c["since"]), c["since"], "UNDEF", c["cid"], c["cid"],
+            ])))
+        lines.append("END")
+        return lines
+
+    async def _bytecount_loop(self, writer):
+        while self.bytecount and not writer.is_closing():
+            for c in self.clients.values():
+                c["rx"] += 1500
+                c["tx"] += 3000
+                writer.write((">BYTECOUNT_CLI:%d,%d,%d\n" % (c["cid"], c["rx"], c["tx"])).encode())
+            await writer.drain()
+            await asyncio.sleep(self.bytecount)
+
+    async def handle(self, reader, writer):
+        writer.write((GREETING + "\n").encode())
+        ticker = None
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                break
+            cmd, _, arg = raw.decode().strip().partition(" ")
+            if cmd == "status":
+                out = self.status()
+            elif cmd == "kill":
+                if self.clients.pop(arg, None) is not None:
+                    out = ["SUCCESS: common name '%s' found, 1 client(s) killed" % arg]
+                else:
+                    out = ["ERROR: common name '%s' not found" % arg]
+            elif cmd == "bytecount":
+                self.bytecount = int(arg or 0)
+                if self.bytecount and ticker is None:
+                    ticker = asyncio.ensure_future(self._bytecount_loop(writer))
+                out = ["SUCCESS: bytecount interval changed"]
+            elif cmd == "quit":
+                break
+            else:
+                out = ["ERROR: unknown command, enter 'help' for more options"]
+            writer.write(("\n".join(out) + "\n").encode())
+            await writer.drain()
+        if ticker is not None:
+            ticker.cancel()
+        writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7505)
+    parser.add_argument("--clients", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(FakeManagementServer(args.clients).serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
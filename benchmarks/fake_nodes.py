@@ -0,0 +1,106 @@
+"""
+Локальные узлы-заглушки для проверки режима федерации.
+
+Запускает N процессов API поверх синтетического слоя данных (у каждого
+свой seed, каталог данных и имя узла) на соседних портах и, если задан
+--register, регистрирует их в федерации указанного API. --latency
+задерживает ответы узлов — так видны таймауты и неполные ответы.
+
+    python -m api.benchmarks.fake_nodes --nodes 3 --keys 10000 \\
+        --register http://127.0.0.1:8000 --latency 0 0 5
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _wait_port(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def serve(args):
+    from api.benchmarks import fake_layer
+    fake_layer.install(fake_layer.FakeDatabase(args.keys, args.configs, args.sessions, args.seed))
+    import uvicorn
+    from api.app import app
+
+    async def delayed(scope, receive, send):
+        if scope["type"] == "http" and args.delay:
+            await asyncio.sleep(args.delay)
+        await app(scope, receive, send)
+
+    uvicorn.run(delayed, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def spawn(args):
+    import httpx
+
+    children = []
+    try:
+        for i in range(args.nodes):
+            port = args.base_port + i
+            name = "%s-%d" % (args.prefix, i + 1)
+            env = dict(os.environ)
+            env["OPENVPN_API_DATA"] = tempfile.mkdtemp(prefix="openvpn-api-%s-" % name)
+            env["OPENVPN_API_NODE_NAME"] = name
+            delay = args.latency[i] if args.latency and i < len(args.latency) else 0.0
+            children.append((name, port, subprocess.Popen([
+                sys.executable, "-m", "api.benchmarks.fake_nodes", "--serve", "--port", str(port),
+                "--keys", str(args.keys), "--configs", str(args.configs), "--sessions", str(args.sessions),
+                "--seed", str(i + 1), "--delay", str(delay),
+            ], env=env)))
+        for name, port, proc in children:
+            if not _wait_port(port):
+                raise RuntimeError("node %s did not start on port %d" % (name, port))
+            url = "http://127.0.0.1:%d" % port
+            print("%s  %s" % (name, url))
+            if args.register:
+                httpx.post(args.register.rstrip("/") + "/federation/nodes", json={"name": name, "url": url}).raise_for_status()
+        print("nodes are running, Ctrl+C to stop")
+        while all(proc.poll() is None for _, _, proc in children):
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for _, _, proc in children:
+            proc.terminate()
+        for _, _, proc in children:
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=8101)
+    parser.add_argument("--prefix", default="node")
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--configs", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=5, help="Среднее число сессий на ключ")
+    parser.add_argument("--register", help="API, в федерации которого зарегистрировать узлы")
+    parser.add_argument("--latency", type=float, nargs="+", help="Задержка ответов по узлам, сек")
+    # Внутренние: запуск одного узла
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--delay", type=float, default=0.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        spawn(args)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
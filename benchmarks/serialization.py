@@ -0,0 +1,89 @@
+"""
+Бенчмарк сериализации списков ключей, конфигов и сессий.
+
+Сравнивает прежний путь (from_orm + jsonable_encoder + json.dumps) с
+предсобранными сериализаторами и dumps() из services/serialization.
+
+    python -m api.benchmarks.serialization --rows 10000 100000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from fastapi.encoders import jsonable_encoder
+
+from api.models import ConfigOut, KeyOut, SessionOut
+from api.services.serialization import (
+    dumps, orjson, config_serializer, key_serializer, session_row_serializer,
+)
+
+
+def make_rows(kind, count):
+    now = datetime.now()
+    if kind == "key":
+        return [SimpleNamespace(
+            id=i, name="key_%d" % i, email="user%d@example.com" % i, days=30, config_id=i % 8 + 1,
+            status=bool(i % 5), connected=bool(i % 3), expired=now + timedelta(days=i % 60),
+            used_total=i * 4096, free_key=False, created=now, updated=now,
+        ) for i in range(1, count + 1)]
+    if kind == "config":
+        return [SimpleNamespace(
+            id=i, port=1194 + i, protocol="udp", telnet_port=7505 + i, address="203.0.113.1",
+            subnet="10.%d.0.0" % (i % 250), status=True, created=now, updated=now,
+        ) for i in range(1, count + 1)]
+    return [{
+        "id": i, "ip": "198.51.100.%d" % (i % 250 + 1), "connected": now - timedelta(hours=i % 48),
+        "disconnected": now, "total_bytes": i * 1024, "total_connected_time": i % 3600,
+    } for i in range(1, count + 1)]
+
+
+CASES = {
+    "key": (KeyOut, key_serializer),
+    "config": (ConfigOut, config_serializer),
+    "session": (SessionOut, session_row_serializer),
+}
+
+
+def baseline(model, rows):
+    items = [model.parse_obj(dict(r, key_id=0)) if isinstance(r, dict) else model.from_orm(r) for r in rows]
+    return json.dumps(jsonable_encoder(items)).encode("utf-8")
+
+
+def measure(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = len(fn())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-baseline", action="store_true", help="Не мерить прежний путь (он медленный)")
+    args = parser.parse_args()
+    print("encoder: %s" % ("orjson" if orjson is not None else "json"))
+    print("%-8s %8s %12s %12s %8s %10s" % ("kind", "rows", "baseline,ms", "fast,ms", "speedup", "bytes"))
+    for count in args.rows:
+        for kind, (model, serializer) in CASES.items():
+            rows = make_rows(kind, count)
+            fast, size = measure(lambda: dumps(serializer.dump_many(rows)), args.repeat)
+            slow = None
+            if not args.no_baseline:
+                slow, _ = measure(lambda: baseline(model, rows), args.repeat)
+            print("%-8s %8d %12s %12.1f %8s %10d" % (
+                kind, count,
+                "-" if slow is None else "%.1f" % (slow * 1000),
+                fast * 1000,
+                "-" if slow is None else "%.1fx" % (slow / fast),
+                size,
+            ))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Бенчмарк холодного старта: время импорта api.app и до первой готовности.
+
+Каждый прогон — свежий процесс: импорт api.app поверх синтетического
+слоя данных (или настоящих functions.* на хосте, --real), затем старт
+приложения и первый ответ 200 от /health/ready. Печатаются медианы,
+самые дорогие импорты api.app по -X importtime и тяжёлые подсистемы,
+загруженные ещё до первого запроса. Код выхода 1 — если медиана
+импорта больше --budget, медиана до готовности больше --ready-budget
+или подсистема из LAZY импортирована заранее: так регресс старта
+ловится до выкладки, а не после systemctl restart.
+
+    python -m api.benchmarks.startup --runs 5 --budget 1.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Должны загружаться при первом использовании (services/lazy.py), а не при импорте
+LAZY = (
+    "functions.client", "functions.server_control", "functions.other", "functions.list",
+    "smtplib", "httpx",
+)
+
+
+def child(args):
+    """Один прогон в свежем процессе; результат — строка JSON в stdout"""
+    os.environ.setdefault("OPENVPN_API_DATA", tempfile.mkdtemp(prefix="openvpn-api-bench-"))
+    if not args.real:
+        from api.benchmarks import fake_layer
+        fake_layer.install(fake_layer.FakeDatabase(args.keys, 8, 5))
+    started = time.perf_counter()
+    from api.app import app
+    imported = time.perf_counter() - started
+    eager = [name for name in LAZY if name in sys.modules]
+
+    from fastapi.testclient import TestClient
+    started = time.perf_counter()
+    with TestClient(app) as client:
+        status = client.get("/health/ready").status_code
+        ready = time.perf_counter() - started
+    print(json.dumps({"import": imported, "ready": ready, "status": status, "eager": eager}))
+
+
+def _import_tree(stderr):
+    """Прямые импорты api.app из вывода -X importtime: [(cumulative мкс, модуль)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, int(parts[1]), name.strip()))
+    for i, (depth, _, name) in enumerate(rows):
+        if name == "api.app":
+            children = []
+            j = i - 1
+            # Поддерево api.app — записи глубже, идущие прямо перед ним
+            while j >= 0 and rows[j][0] > depth:
+                if rows[j][0] == depth + 1:
+                    children.append((rows[j][1], rows[j][2]))
+                j -= 1
+            return sorted(children, reverse=True)
+    return []
+
+
+def run(args):
+    command = [sys.executable, "-X", "importtime", "-m", "api.benchmarks.startup", "--child", "--keys", str(args.keys)]
+    if args.real:
+        command.append("--real")
+    results = []
+    tree = []
+    for _ in range(args.runs):
+        env = dict(os.environ, OPENVPN_API_DATA=tempfile.mkdtemp(prefix="openvpn-api-bench-"))
+        proc = subprocess.run(command, capture_output=True, text=True, env=env)
+        if proc.returncode != 0:
+            print(proc.stderr[-2000:], file=sys.stderr)
+            return 1
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        tree = _import_tree(proc.stderr)
+
+    imported = statistics.median(r["import"] for r in results)
+    ready = statistics.median(r["ready"] for r in results)
+    eager = sorted({name for r in results for name in r["eager"]})
+    print("runs %d  import api.app %.0fms (budget %.0fms)  startup to ready %.0fms (budget %.0fms)" % (
+        args.runs, imported * 1000, args.budget * 1000, ready * 1000, args.ready_budget * 1000))
+    print("slowest imports of api.app (cumulative):")
+    for micros, name in tree[:args.top]:
+        print("  %8.1fms  %s" % (micros / 1000, name))
+
+    failures = []
+    if imported > args.budget:
+        failures.append("import time %.0fms is over budget %.0fms" % (imported * 1000, args.budget * 1000))
+    if ready > args.ready_budget:
+        failures.append("startup time %.0fms is over budget %.0fms" % (ready * 1000, args.ready_budget * 1000))
+    if any(r["status"] != 200 for r in results):
+        failures.append("/health/ready did not return 200")
+    if eager:
+        failures.append("imported before first use: " + ", ".join(eager))
+    for failure in failures:
+        print("FAIL: " + failure)
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--budget", type=float, default=1.0, help="Допустимая медиана импорта api.app, сек")
+    parser.add_argument("--ready-budget", type=float, default=2.0, help="Допустимая медиана старта до готовности, сек")
+    parser.add_argument("--top", type=int, default=10, help="Сколько самых дорогих импортов показать")
+    parser.add_argument("--real", action="store_true", help="Настоящие functions.* вместо синтетического слоя")
+    # Внутренний: один прогон
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+    else:
+        sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
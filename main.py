@@ -1,5 +1,5 @@
-import uvicorn
-from api.app import app
+from api.server import main
 
+# Параметры запуска — python main.py --help; разработка — python main.py --reload
 if __name__ == "__main__":
-    uvicorn.run("api.app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    main()
\ No newline at end of file
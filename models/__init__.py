@@ -1,4 +1,8 @@
 from .key import *
 from .config import *
 from .session import *
-from .settings import *
\ No newline at end of file
+from .settings import *
+from .job import *
+from .notification import *
+from .statistics import *
+from .federation import *
\ No newline at end of file
@@ -0,0 +1,13 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class NodeIn(BaseModel):
+    name: str
+    url: str = Field(..., description="Адрес API узла, например http://10.0.0.2:8000")
+    timeout: Optional[float] = Field(None, gt=0, description="Таймаут опроса узла, сек")
+
+class NodeOut(BaseModel):
+    name: str
+    url: str
+    timeout: Optional[float]
+    local: bool = False
\ No newline at end of file
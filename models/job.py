@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from typing import Optional, Dict, Any
+from datetime import datetime
+
+class JobOut(BaseModel):
+    id: str
+    action: str
+    status: str
+    total: int
+    done: int
+    failed: Dict[str, str]
+    progress: float
+    throughput: Optional[float]
+    error: Optional[str]
+    result: Optional[Any]
+    created: datetime
+    started: Optional[datetime]
+    finished: Optional[datetime]
\ No newline at end of file
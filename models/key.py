@@ -25,4 +25,21 @@ class MailBulkRequest(BaseModel):
     email: Optional[str] = None
 
 class ActionBulkRequest(BaseModel):
-    ids: List[int]
\ No newline at end of file
+    ids: List[int]
+
+class KeyOut(BaseModel):
+    id: int
+    name: str
+    email: Optional[str] = None
+    days: int
+    config_id: int
+    status: bool
+    connected: bool
+    expired: Optional[datetime] = None
+    used_total: Optional[int] = None
+    free_key: Optional[bool] = None
+    created: Optional[datetime] = None
+    updated: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
\ No newline at end of file
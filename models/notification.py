@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import Dict, Optional
+from datetime import datetime
+
+class NotificationOut(BaseModel):
+    id: str
+    channel: str
+    status: str
+    total: int
+    sent: int
+    failed: Dict[str, str]
+    attempts: int
+    created: datetime
+    finished: Optional[datetime]
\ No newline at end of file
@@ -14,4 +14,14 @@ class SessionOut(SessionBase):
     id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class LiveSessionOut(BaseModel):
+    config_id: int
+    common_name: str
+    real_address: Optional[str]
+    virtual_address: Optional[str]
+    bytes_received: int
+    bytes_sent: int
+    connected_since: Optional[datetime]
+    client_id: Optional[int]
\ No newline at end of file
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Optional
+
+class TrafficBucketOut(BaseModel):
+    bucket: datetime
+    bytes: int
+    seconds: int
+    sessions: int
+
+class TrafficLimitRequest(BaseModel):
+    limit: Optional[int] = Field(None, ge=0, description="Лимит в байтах; null или 0 — без лимита")
+
+class TrafficUsageOut(BaseModel):
+    key_id: int
+    used: int
+    limit: Optional[int]
+    remaining: Optional[int]
+    exceeded: bool
\ No newline at end of file
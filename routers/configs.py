@@ -1,18 +1,34 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Depends
 from typing import List, Optional
 from pydantic import BaseModel
 
 from functions.data.configs import (
     get_configs_db, get_config_by_id_db, create_config_db, delete_config_db,
 )
-from functions.server_control import (
-    disable_config_db, enable_config_db, restart_config_db
-)
 from functions.data.key import get_keys_by_config_db
-from functions.list import KeysList
+from api.services.changes import bump, CONFIGS, KEYS, SESSIONS
+from api.services.service_control import service_control, CONFIG_ACTIONS
+from api.services.serialization import config_serializer, FastJSONResponse
+from api.services.etag import Conditional, etag_headers
+from api.services.events import event_bus
+from api.services.data_access import data_access
+from api.services.traffic_limits import traffic_limits
+from api.services.address_pool import address_pools
+from api.models.statistics import TrafficLimitRequest
+from api.services.lazy import lazy
+
+KeysList = lazy("functions.list", "KeysList")
 
 router = APIRouter()
 
+# Статус конфигов меняется и в обход API (systemd), поэтому тег живёт не дольше TTL
+CONFIGS_TTL = 10.0
+configs_conditional = Conditional((CONFIGS,), CONFIGS_TTL)
+config_keys_conditional = Conditional((KEYS, CONFIGS), CONFIGS_TTL)
+
+class ConfigBatchRequest(BaseModel):
+    ids: List[int]
+
 class ConfigCreateRequest(BaseModel):
     port: int
     protocol: str
@@ -20,44 +36,21 @@ class ConfigCreateRequest(BaseModel):
     subnet: str
     telnet_port: Optional[int] = None
 
-@router.get("/", response_model=List[dict])
-def list_configs():
-    """Список всех конфигураций"""
-    configs = get_configs_db()
-    return [
-        {
-            "id": c.id,
-            "port": c.port,
-            "protocol": c.protocol,
-            "telnet_port": c.telnet_port,
-            "address": c.address,
-            "subnet": c.subnet,
-            "status": c.status,
-            "created": str(c.created),
-            "updated": str(c.updated)
-        }
-        for c in configs
-    ]
-
-@router.get("/{config_id}", response_model=dict)
-def get_config(config_id: int):
-    """Получить инфу о конфиге"""
-    c = get_config_by_id_db(config_id)
+@router.get("/", response_model=List[dict], response_class=FastJSONResponse)
+async def list_configs(tag: str = Depends(configs_conditional)):
+    """Список всех конфигураций (ETag / If-None-Match)"""
+    configs = await data_access.configs()
+    return config_serializer.response(configs, headers=etag_headers(tag))
+
+@router.get("/{config_id}", response_model=dict, response_class=FastJSONResponse)
+async def get_config(config_id: int):
+    """Получить инфу о конфиге и заполненность его пула адресов"""
+    c = await data_access.config(config_id)
     if not c:
         raise HTTPException(status_code=404, detail="Config not found")
-    return {
-        "id": c.id,
-        "port": c.port,
-        "protocol": c.protocol,
-        "telnet_port": c.telnet_port,
-        "address": c.address,
-        "subnet": c.subnet,
-        "status": c.status,
-        "created": str(c.created),
-        "updated": str(c.updated)
-    }
-
-@router.post("/", response_model=dict)
+    return FastJSONResponse(dict(config_serializer.dump(c), addresses=await data_access.address_usage(c)))
+
+@router.post("/", response_model=dict, response_class=FastJSONResponse)
 def create_config(data: ConfigCreateRequest):
     """Создать конфиг OpenVPN"""
     telnet_port = data.telnet_port if data.telnet_port else 9999  # либо рандом
@@ -68,45 +61,80 @@ def create_config(data: ConfigCreateRequest):
         subnet=data.subnet,
         address=data.address
     )
+    bump(CONFIGS)
     c = get_configs_db()[-1]
-    return {
-        "id": c.id,
-        "port": c.port,
-        "protocol": c.protocol,
-        "telnet_port": c.telnet_port,
-        "address": c.address,
-        "subnet": c.subnet,
-        "status": c.status,
-        "created": str(c.created),
-        "updated": str(c.updated)
-    }
+    event_bus.publish("config.created", config_id=c.id, port=c.port, protocol=c.protocol)
+    return config_serializer.response_one(c)
 
 @router.delete("/{config_id}")
 def delete_config(config_id: int):
     """Удалить конфиг"""
     delete_config_db(config_id)
+    bump(CONFIGS, KEYS, SESSIONS)
+    address_pools.drop(config_id)
+    event_bus.publish("config.deleted", config_id=config_id)
     return {"result": "deleted"}
 
+@router.put("/{config_id}/traffic_limit")
+def set_config_traffic_limit(config_id: int, data: TrafficLimitRequest):
+    """Лимит трафика по умолчанию для каждого ключа конфига (байты; null — снять)"""
+    if not get_config_by_id_db(config_id):
+        raise HTTPException(status_code=404, detail="Config not found")
+    limit = traffic_limits.set_limit("config", config_id, data.limit)
+    event_bus.publish("config.traffic_limit_set", config_id=config_id, limit=limit or None)
+    return {"config_id": config_id, "limit": limit or None}
+
+# enable -> config.enabled и т.д.
+CONFIG_EVENTS = {"enable": "config.enabled", "disable": "config.disabled", "restart": "config.restarted"}
+
+def _publish_action(config_id, action, result):
+    event_bus.publish(
+        CONFIG_EVENTS[action], config_id=config_id,
+        ok=result["ok"], error=result["error"], duration=result["duration"]
+    )
+
+async def _config_action(config_id, action):
+    result = await service_control.config(config_id, action)
+    bump(CONFIGS)
+    _publish_action(config_id, action, result)
+    if not result["ok"]:
+        status = 504 if result["timeout"] else 500
+        raise HTTPException(status_code=status, detail=result["error"])
+
+@router.post("/batch/{action}")
+async def configs_batch_action(action: str, data: ConfigBatchRequest):
+    """
+    Выполнить enable/disable/restart для нескольких конфигов параллельно.
+    В ответе — результат и длительность по каждому конфигу.
+    """
+    if action not in CONFIG_ACTIONS:
+        raise HTTPException(status_code=404, detail="Unknown action")
+    results = await service_control.configs(data.ids, action)
+    bump(CONFIGS)
+    for result in results:
+        _publish_action(result["config_id"], action, result)
+    return {"result": action, "results": results}
+
 @router.post("/{config_id}/disable")
-def disable_config(config_id: int):
+async def disable_config(config_id: int):
     """Отключить конфиг (systemctl stop ...)"""
-    disable_config_db(config_id)
+    await _config_action(config_id, "disable")
     return {"result": "disabled"}
 
 @router.post("/{config_id}/enable")
-def enable_config(config_id: int):
+async def enable_config(config_id: int):
     """Включить конфиг (systemctl start ...)"""
-    enable_config_db(config_id)
+    await _config_action(config_id, "enable")
     return {"result": "enabled"}
 
 @router.post("/{config_id}/restart")
-def restart_config(config_id: int):
+async def restart_config(config_id: int):
     """Перезапустить конфиг (systemctl restart ...)"""
-    restart_config_db(config_id)
+    await _config_action(config_id, "restart")
     return {"result": "restarted"}
 
 @router.get("/{config_id}/keys", response_model=List[dict])
-def config_keys(config_id: int):
-    """Ключи, относящиеся к конфигу"""
+def config_keys(config_id: int, tag: str = Depends(config_keys_conditional)):
+    """Ключи, относящиеся к конфигу (ETag / If-None-Match)"""
     keys = get_keys_by_config_db(config_id)
     return [KeysList.default_json(i + 1, k) for i, k in enumerate(keys)]
\ No newline at end of file
@@ -0,0 +1,78 @@
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from api.services.events import event_bus, TooManySubscribers
+
+router = APIRouter()
+
+
+def _types(types):
+    return [t.strip() for t in types.split(",") if t.strip()] if types else None
+
+
+def _last_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+@router.get("/stream")
+async def event_stream(
+    request: Request,
+    types: Optional[str] = Query(None, description="Типы через запятую: key, session.connected, config.restarted ..."),
+    config_id: Optional[int] = Query(None),
+    key_id: Optional[int] = Query(None),
+):
+    """
+    Поток событий (Server-Sent Events). После переподключения браузер
+    присылает Last-Event-ID — пропущенные события повторяются.
+    Событие resync — клиент отстал, состояние нужно перечитать.
+    """
+    try:
+        subscriber = event_bus.subscribe(_types(types), config_id, key_id)
+    except TooManySubscribers as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    last_id = _last_id(request.headers.get("last-event-id"))
+
+    async def body():
+        try:
+            yield b"retry: 3000\n\n"
+            async for event in event_bus.events(subscriber, last_id):
+                yield event.frame if event is not None else b": keepalive\n\n"
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@router.websocket("/ws")
+async def event_socket(
+    websocket: WebSocket,
+    types: Optional[str] = None,
+    config_id: Optional[int] = None,
+    key_id: Optional[int] = None,
+    last_id: Optional[int] = None,
+):
+    """Тот же поток событий через WebSocket: по JSON-сообщению на событие"""
+    try:
+        subscriber = event_bus.subscribe(_types(types), config_id, key_id)
+    except TooManySubscribers:
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+    try:
+        async for event in event_bus.events(subscriber, last_id):
+            await websocket.send_text(event.payload if event is not None else '{"type": "keepalive"}')
+    except WebSocketDisconnect:
+        pass
+    finally:
+        event_bus.unsubscribe(subscriber)
+
+@router.get("/stats")
+def event_stats():
+    """Число подписчиков и последний ID события"""
+    return event_bus.stats()
\ No newline at end of file
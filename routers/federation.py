@@ -0,0 +1,75 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import List, Optional
+
+from api.models.federation import NodeIn, NodeOut
+from api.services.federation import federation, node_registry, merge_items, merge_statistics, NodeNotFound
+
+router = APIRouter()
+
+
+def _names(nodes):
+    return [n.strip() for n in nodes.split(",") if n.strip()] if nodes else None
+
+
+NODES_QUERY = Query(None, description="Только эти узлы, через запятую")
+
+@router.get("/nodes", response_model=List[NodeOut])
+def list_nodes(request: Request):
+    """Свой узел и зарегистрированные соседние"""
+    return [n.to_dict() for n in federation.nodes(request.app)]
+
+@router.post("/nodes", response_model=NodeOut)
+def add_node(data: NodeIn):
+    """Зарегистрировать узел (или обновить адрес/таймаут)"""
+    if not data.url.startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail="url must start with http:// or https://")
+    return node_registry.add(data.name, data.url, data.timeout).to_dict()
+
+@router.delete("/nodes/{name}")
+def remove_node(name: str):
+    """Убрать узел из федерации"""
+    try:
+        node_registry.remove(name)
+    except NodeNotFound:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return {"result": "deleted"}
+
+@router.get("/statistics")
+async def federated_statistics(request: Request, nodes: Optional[str] = NODES_QUERY):
+    """Статистика всех узлов: суммы счётчиков и статистика каждого узла"""
+    return merge_statistics(await federation.gather(request.app, "/statistics/", names=_names(nodes)))
+
+@router.get("/keys")
+async def federated_keys(
+    request: Request,
+    by: Optional[str] = Query("all", description="Критерий, как в GET /keys/"),
+    value: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Не больше limit ключей с каждого узла"),
+    nodes: Optional[str] = NODES_QUERY,
+):
+    """Ключи всех узлов (у каждого — поле node)"""
+    params = {"by": by, "value": value, "limit": limit}
+    return merge_items(await federation.gather(request.app, "/keys/", params, _names(nodes)))
+
+@router.get("/configs")
+async def federated_configs(request: Request, nodes: Optional[str] = NODES_QUERY):
+    """Конфиги всех узлов"""
+    return merge_items(await federation.gather(request.app, "/configs/", names=_names(nodes)))
+
+@router.get("/sessions/live")
+async def federated_live_sessions(request: Request, nodes: Optional[str] = NODES_QUERY):
+    """Текущие подключения на всех узлах"""
+    return merge_items(await federation.gather(request.app, "/sessions/live", names=_names(nodes)))
+
+@router.get("/sessions/key/{key_id}")
+async def federated_key_sessions(
+    request: Request,
+    key_id: int,
+    node: str = Query(..., description="Узел ключа (ID ключей у узлов свои)"),
+    limit: Optional[int] = Query(None, ge=1, le=5000),
+):
+    """Сессии ключа с указанного узла"""
+    results = await federation.gather(request.app, "/sessions/key/%d" % key_id, {"limit": limit}, [node])
+    if not results:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return merge_items(results)
\ No newline at end of file
@@ -0,0 +1,38 @@
+import asyncio
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from api.services.data_access import data_access
+from api.services.workers import worker_state
+
+router = APIRouter()
+
+READY_TIMEOUT = 2.0
+
+
+@router.get("/live")
+async def liveness():
+    """
+    Процесс жив и цикл событий отвечает (без обращений к БД).
+    """
+    return worker_state.to_dict()
+
+
+@router.get("/ready")
+async def readiness():
+    """
+    Воркер готов принимать запросы: старт завершён, остановка не идёт,
+    БД бота отвечает. 503 — убрать воркер из балансировки.
+    """
+    problems = []
+    if not worker_state.ready:
+        problems.append("starting")
+    if worker_state.draining:
+        problems.append("draining")
+    try:
+        await asyncio.wait_for(data_access.settings(), READY_TIMEOUT)
+    except Exception as e:
+        problems.append("database: %s" % (str(e) or e.__class__.__name__))
+    body = dict(worker_state.to_dict(), problems=problems)
+    return JSONResponse(body, status_code=503 if problems else 200)
\ No newline at end of file
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, HTTPException
+from typing import List
+
+from api.models.job import JobOut
+from api.services.jobs import job_manager
+
+router = APIRouter()
+
+@router.get("/", response_model=List[JobOut])
+def list_jobs():
+    """Список фоновых задач"""
+    return [job.to_dict() for job in job_manager.list()]
+
+@router.get("/{job_id}", response_model=JobOut)
+def get_job(job_id: str):
+    """Прогресс задачи: обработано, ошибки по ID, скорость"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
\ No newline at end of file
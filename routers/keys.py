@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, Query, Body
+from fastapi import APIRouter, HTTPException, Query, Body, Depends
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 
 from api.models.key import (
@@ -7,21 +8,38 @@ from api.models.key import (
     KeyEditRequest, 
     TransferKeyRequest,
     KeyOut)
+from api.models.statistics import TrafficLimitRequest, TrafficUsageOut
 from functions.data.key import (
     get_key_by_id, get_keys_by_name_db, edit_key_db
 ) 
-from functions.list import KeysList
-from functions.client import (
-    create_key, delete_key, renew_key, recreate_key, block_key, unblock_key, transfer_key
+from api.services.changes import bump, KEYS, CONFIGS, SESSIONS
+from api.services.etag import Conditional, etag_headers
+from api.services.events import publish_key, key_config_id
+from api.services.expiry import expiry_scheduler
+from api.services.pagination import keyset_page
+from api.services.serialization import key_serializer, session_row_serializer, FastJSONResponse
+from api.services.key_index import key_index, INDEX_TTL
+from api.services.data_access import data_access
+from api.services.bulk import submit_bulk
+from api.services.jobs import JobQueueFull
+from api.services.notifications import dispatcher, NotificationQueueFull
+from api.services.traffic_limits import traffic_limits
+from api.services.key_batch import SYNC_LIMIT, batch_names, create_keys, submit_batch, key_rows
+from api.services.lazy import lazy
+from api.services.address_pool import address_pools, PoolExhausted
+
+KeysList = lazy("functions.list", "KeysList")
+create_key, delete_key, renew_key, recreate_key, block_key, unblock_key, transfer_key = lazy(
+    "functions.client", "create_key", "delete_key", "renew_key", "recreate_key", "block_key", "unblock_key", "transfer_key"
 )
-from functions.data.session import get_session_db, delete_session_db
-from functions.other import key_to_tg, key_to_email
-from functions.data.settings import get_settings_db
 
 router = APIRouter()
 
+# Список зависит от ключей, конфигов (порт/протокол) и сессий (сортировки по трафику)
+keys_conditional = Conditional((KEYS, CONFIGS, SESSIONS), INDEX_TTL)
 
-@router.get("/", response_model=List[KeyOut])
+
+@router.get("/", response_model=List[KeyOut], response_class=FastJSONResponse)
 def list_keys(
     by: Optional[str] = Query(
         "all",
@@ -35,6 +53,19 @@ def list_keys(
         None,
         description="Значение фильтра (например, имя, email, порт, id конфига, статус и т.д.)"
     ),
+    limit: Optional[int] = Query(
+        None, ge=1, le=5000,
+        description="Размер страницы; курсор следующей страницы — в заголовке X-Next-Cursor"
+    ),
+    after: Optional[str] = Query(
+        None,
+        description="Курсор из X-Next-Cursor предыдущей страницы"
+    ),
+    stream: bool = Query(
+        False,
+        description="Отдать ключи потоком NDJSON (для выгрузок)"
+    ),
+    tag: str = Depends(keys_conditional),
 ):
     """
     Получить список ключей с возможностью фильтрации.
@@ -55,6 +86,14 @@ def list_keys(
     - by=sessions — сортировка по количеству сессий
     - by=connected_time — сортировка по времени подключения
     - by=free_keys — только свободные ключи
+
+    **Пагинация:** limit=N — страница из N ключей, курсор следующей страницы
+    приходит в заголовке X-Next-Cursor и передаётся в after=... .
+    Курсор работает для любого критерия, включая сортировки.
+
+    **Выгрузка:** stream=true — ответ application/x-ndjson, по ключу на строку.
+
+    **Кэширование:** ответ с ETag; с If-None-Match — 304, если ключи не менялись.
     """
     def parse_value(criteria, value):
         if value is None:
@@ -74,38 +113,174 @@ def list_keys(
         return value
 
     parsed_value = parse_value(by, value)
-    keys = KeysList.list_by_criteria(by, parsed_value)
-    return keys
+    found = key_index.get().query(by, parsed_value)
+    if found is None:
+        keys, sort_key = KeysList.list_by_criteria(by, parsed_value), None
+    else:
+        keys, sort_key = found
+    try:
+        page, next_cursor = keyset_page(keys, [by, parsed_value], after, limit, sort_key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = etag_headers(tag)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if stream:
+        return StreamingResponse(
+            key_serializer.ndjson(page), media_type="application/x-ndjson", headers=headers
+        )
+    return key_serializer.response(page, headers=headers)
+
+
+# Массовые действия объявлены до /{key_id}/...: иначе /bulk/block попадёт в /{key_id}/block
+def _queue_bulk(action, ids):
+    try:
+        job = submit_bulk(action, ids)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"result": "queued", "job_id": job.id}
+
+
+@router.post("/bulk/block")
+def block_keys_bulk_api(data: ActionBulkRequest):
+    """
+    Заблокировать список ключей (bulk).
+    Выполняется в фоне, прогресс — GET /jobs/{job_id}.
+    """
+    return _queue_bulk("block", data.ids)
+
+
+@router.post("/bulk/unblock")
+def unblock_keys_bulk_api(data: ActionBulkRequest):
+    """
+    Разблокировать список ключей (bulk).
+    Выполняется в фоне, прогресс — GET /jobs/{job_id}.
+    """
+    return _queue_bulk("unblock", data.ids)
+
+
+@router.post("/bulk/send_tg")
+def send_keys_to_tg_bulk_api(data: ActionBulkRequest):
+    """
+    Отправить несколько ключей в Telegram (bulk).
+    Отправка идёт через очередь, статус — GET /notifications/{notification_id}.
+    """
+    return _queue_notification("tg", data.ids)
+
+
+@router.post("/bulk/send_mail")
+def send_keys_to_mail_bulk_api(data: ActionBulkRequest):
+    """
+    Отправить несколько ключей на почту (bulk).
+    Отправка идёт через очередь, статус — GET /notifications/{notification_id}.
+    """
+    return _queue_notification("mail", data.ids)
+
+
+@router.post("/bulk/delete")
+def delete_keys_bulk_api(data: ActionBulkRequest):
+    """
+    Удалить несколько ключей (bulk).
+    Выполняется в фоне, прогресс — GET /jobs/{job_id}.
+    """
+    return _queue_bulk("delete", data.ids)
+
+
+@router.post("/bulk/fix")
+def fix_keys_bulk_api(data: ActionBulkRequest):
+    """
+    Принудительно отключить несколько ключей (bulk).
+    Выполняется в фоне, прогресс — GET /jobs/{job_id}.
+    """
+    return _queue_bulk("fix", data.ids)
+
+
+@router.post("/bulk/clear_traffic")
+def clear_traffic_keys_bulk_api(data: ActionBulkRequest):
+    """
+    Очистить трафик (сессии) по нескольким ключам (bulk).
+    Выполняется в фоне, прогресс — GET /jobs/{job_id}.
+    """
+    return _queue_bulk("clear_traffic", data.ids)
 
 
 @router.get("/{key_id}", response_model=dict)
-def key_info(key_id: int):
+async def key_info(key_id: int):
     """
     Получить подробную информацию по ключу по его ID.
     """
-    key = get_key_by_id(key_id)
+    key = await data_access.key(key_id)
     if key is None:
         raise HTTPException(status_code=404, detail="Key not found")
     return KeysList.default_json(1, key)
 
 
+def _reserve_addresses(config_id, count):
+    """Резерв адресов под count ключей; 409, если в подсети конфига их не хватит"""
+    try:
+        return address_pools.reserve(config_id, count)
+    except PoolExhausted as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
 @router.post("/", response_model=dict)
 def create_key_api(data: KeyCreateRequest):
     """
     Создать новый ключ или несколько ключей.  
     В ответе — первый созданный ключ.
     """
-    create_key(data.name, data.days, data.amount, data.config_id, data.email)
-    keys = get_keys_by_name_db(data.name)
+    with _reserve_addresses(data.config_id, data.amount) as reservation:
+        # Ключи с тем же именем могли существовать и до запроса
+        existing = {k.id for k in get_keys_by_name_db(data.name)}
+        create_key(data.name, data.days, data.amount, data.config_id, data.email)
+        bump(KEYS)
+        keys = [
+            k for k in get_keys_by_name_db(data.name)
+            if k.id not in existing and k.config_id == data.config_id
+        ]
+        if not keys:
+            raise HTTPException(status_code=500, detail="Key was not created")
+        reservation.assign(keys)
+    for k in keys:
+        expiry_scheduler.schedule(k)
+        publish_key("key.created", k.id, k.config_id, name=k.name)
     return KeysList.default_json(1, keys[0])
 
 
+@router.post("/batch", response_model=dict)
+def create_keys_batch_api(data: KeyCreateRequest):
+    """
+    Создать пакет ключей: name_1 … name_N (для amount=1 — просто name).
+    Сертификаты генерируются параллельно в пуле процессов.
+    Небольшой пакет — ответ со всеми созданными ключами,
+    крупный — фоновая задача, прогресс в GET /jobs/{job_id}.
+    """
+    if data.amount < 1:
+        raise HTTPException(status_code=400, detail="amount must be positive")
+    names = batch_names(data.name, data.amount)
+    reservation = _reserve_addresses(data.config_id, len(names))
+    if len(names) > SYNC_LIMIT:
+        try:
+            job = submit_batch(names, data.days, data.config_id, data.email, reservation)
+        except JobQueueFull as e:
+            reservation.close()
+            raise HTTPException(status_code=429, detail=str(e))
+        return {"result": "queued", "job_id": job.id}
+    created, failures = create_keys(names, data.days, data.config_id, data.email, reservation=reservation)
+    return {"result": "created", "keys": key_rows(created), "failed": failures}
+
+
 @router.delete("/{key_id}")
 def delete_key_api(key_id: int):
     """
     Удалить ключ по его ID.
     """
+    config_id = key_config_id(key_id)
     delete_key(key_id)
+    bump(KEYS, SESSIONS)
+    expiry_scheduler.forget(key_id)
+    address_pools.release([key_id])
+    publish_key("key.deleted", key_id, config_id)
     return {"result": "deleted"}
 
 
@@ -120,6 +295,9 @@ def edit_key_api(key_id: int, data: KeyEditRequest):
     days = data.days if data.days is not None else key.days
     email = data.email if data.email is not None else key.email
     edit_key_db(name=key.name, days=days, email=email)
+    bump(KEYS)
+    expiry_scheduler.refresh(key_id)
+    publish_key("key.updated", key_id, key.config_id, days=days, email=email)
     return KeysList.default_json(1, get_key_by_id(key_id))
 
 
@@ -130,6 +308,8 @@ def block_key_api(key_id: int):
     """
     key = get_key_by_id(key_id)
     block_key(key)
+    bump(KEYS)
+    publish_key("key.blocked", key_id, key.config_id)
     return {"result": "blocked"}
 
 
@@ -140,6 +320,8 @@ def unblock_key_api(key_id: int):
     """
     key = get_key_by_id(key_id)
     unblock_key(key)
+    bump(KEYS)
+    publish_key("key.unblocked", key_id, key.config_id)
     return {"result": "unblocked"}
 
 
@@ -149,6 +331,9 @@ def recreate_key_api(key_id: int):
     Пересоздать ключ (по ID).
     """
     recreate_key(key_id)
+    bump(KEYS)
+    expiry_scheduler.refresh(key_id)
+    publish_key("key.recreated", key_id)
     return {"result": "recreated"}
 
 
@@ -158,6 +343,9 @@ def renew_key_api(key_id: int, days: int = Body(...)):
     Продлить ключ на N дней (по ID).
     """
     renew_key(key_id, days)
+    bump(KEYS)
+    expiry_scheduler.refresh(key_id)
+    publish_key("key.renewed", key_id, days=days)
     return {"result": "renewed"}
 
 
@@ -166,134 +354,99 @@ def transfer_key_api(key_id: int, data: TransferKeyRequest):
     """
     Перенести ключ на другой конфиг (по ID ключа и ID нового конфига).
     """
-    transfer_key(key_id, data.config_id)
+    from_config_id = key_config_id(key_id)
+    with _reserve_addresses(data.config_id, 0 if from_config_id == data.config_id else 1) as reservation:
+        transfer_key(key_id, data.config_id)
+        bump(KEYS)
+        reservation.assign([get_key_by_id(key_id)])
+    expiry_scheduler.refresh(key_id)
+    publish_key("key.transferred", key_id, data.config_id, from_config_id=from_config_id)
     return {"result": "transferred"}
 
 
-@router.get("/{key_id}/sessions", response_model=List[dict])
-def key_sessions_api(key_id: int):
-    """
-    Получить список сессий по ключу (по ID ключа).
-    """
-    sessions = get_session_db(get_key_by_id(key_id))
-    return [
-        {
-            "id": s.id,
-            "ip": s.ip,
-            "connected": s.connected,
-            "disconnected": s.disconnected,
-            "total_bytes": s.total_bytes,
-            "total_connected_time": s.total_connected_time
-        }
-        for s in sessions
-    ]
-
-
-@router.post("/{key_id}/send_tg")
-def send_key_to_tg_api(key_id: int):
+@router.get("/{key_id}/sessions", response_model=List[dict], response_class=FastJSONResponse)
+async def key_sessions_api(
+    key_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Размер страницы"),
+    after: Optional[str] = Query(None, description="Курсор из X-Next-Cursor"),
+    archive: bool = Query(True, description="Дочитывать архивные сессии"),
+):
     """
-    Отправить ключ в Telegram (по ID ключа, настройки берутся из settings).
+    Получить список сессий по ключу (по ID ключа), свежие первыми.
     """
-    key = get_key_by_id(key_id)
-    key_to_tg(key, get_settings_db())
-    return {"result": "sent"}
+    key = await data_access.key(key_id)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    try:
+        sessions, next_cursor = await data_access.session_page(key, limit, after, archive)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return session_row_serializer.response(sessions, headers=headers)
 
 
-@router.post("/{key_id}/send_mail")
-def send_key_to_mail_api(key_id: int):
+@router.get("/{key_id}/traffic", response_model=TrafficUsageOut)
+def key_traffic_api(key_id: int):
     """
-    Отправить ключ на почту (по ID ключа, настройки берутся из settings).
+    Трафик ключа с учётом лимита (по ID ключа).
     """
     key = get_key_by_id(key_id)
-    key_to_email(key, get_settings_db())
-    return {"result": "sent"}
+    if key is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    return traffic_limits.usage(key.id, key.config_id)
 
 
-@router.post("/{key_id}/fix")
-def fix_key_api(key_id: int):
+@router.put("/{key_id}/traffic_limit", response_model=TrafficUsageOut)
+def set_key_traffic_limit_api(key_id: int, data: TrafficLimitRequest):
     """
-    Принудительно отключить ключ (фиксировать статус connected=False).
+    Задать лимит трафика ключа в байтах (null — лимит конфига).
+    При превышении ключ блокируется и отключается.
     """
     key = get_key_by_id(key_id)
-    edit_key_db(name=key.name, connected=False)
-    return {"result": "fixed"}
-
-
-@router.post("/bulk/block")
-def block_keys_bulk_api(data: ActionBulkRequest):
-    """
-    Заблокировать список ключей (bulk).
-    """
-    for key_id in data.ids:
-        key = get_key_by_id(key_id)
-        if key:
-            block_key(key)
-    return {"result": "blocked_bulk"}
-
-
-@router.post("/bulk/unblock")
-def unblock_keys_bulk_api(data: ActionBulkRequest):
-    """
-    Разблокировать список ключей (bulk).
-    """
-    for key_id in data.ids:
-        key = get_key_by_id(key_id)
-        if key:
-            unblock_key(key)
-    return {"result": "unblocked_bulk"}
-
-
-@router.post("/bulk/send_tg")
-def send_keys_to_tg_bulk_api(data: ActionBulkRequest):
-    """
-    Отправить несколько ключей в Telegram (bulk).
-    """
-    for key_id in data.ids:
-        key = get_key_by_id(key_id)
-        if key:
-            key_to_tg(key, get_settings_db())
-    return {"result": "sent_bulk"}
+    if key is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    traffic_limits.set_limit("key", key.id, data.limit)
+    publish_key("key.traffic_limit_set", key.id, key.config_id, limit=data.limit or None)
+    return traffic_limits.usage(key.id, key.config_id)
 
 
-@router.post("/bulk/send_mail")
-def send_keys_to_mail_bulk_api(data: ActionBulkRequest):
-    """
-    Отправить несколько ключей на почту (bulk).
-    """
-    for key_id in data.ids:
-        key = get_key_by_id(key_id)
-        if key:
-            key_to_email(key, get_settings_db())
-    return {"result": "sent_bulk"}
+def _queue_notification(channel, ids):
+    try:
+        ticket = dispatcher.enqueue(channel, ids)
+    except NotificationQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"result": "queued", "notification_id": ticket.id}
 
 
-@router.post("/bulk/delete")
-def delete_keys_bulk_api(data: ActionBulkRequest):
+@router.post("/{key_id}/send_tg")
+def send_key_to_tg_api(key_id: int):
     """
-    Удалить несколько ключей (bulk).
+    Отправить ключ в Telegram (по ID ключа, настройки берутся из settings).
+    Отправка идёт через очередь, статус — GET /notifications/{notification_id}.
     """
-    for key_id in data.ids:
-        delete_key(key_id)
-    return {"result": "deleted_bulk"}
+    if get_key_by_id(key_id) is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    return _queue_notification("tg", [key_id])
 
 
-@router.post("/bulk/fix")
-def fix_keys_bulk_api(data: ActionBulkRequest):
+@router.post("/{key_id}/send_mail")
+def send_key_to_mail_api(key_id: int):
     """
-    Принудительно отключить несколько ключей (bulk).
+    Отправить ключ на почту (по ID ключа, настройки берутся из settings).
+    Отправка идёт через очередь, статус — GET /notifications/{notification_id}.
     """
-    for key_id in data.ids:
-        key = get_key_by_id(key_id)
-        if key:
-            edit_key_db(name=key.name, connected=False)
-    return {"result": "fixed_bulk"}
+    if get_key_by_id(key_id) is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    return _queue_notification("mail", [key_id])
 
 
-@router.post("/bulk/clear_traffic")
-def clear_traffic_keys_bulk_api(data: ActionBulkRequest):
+@router.post("/{key_id}/fix")
+def fix_key_api(key_id: int):
     """
-    Очистить трафик (сессии) по нескольким ключам (bulk).
+    Принудительно отключить ключ (фиксировать статус connected=False).
     """
-    for key_id in data.ids:
-        delete_session_db(key_id)
-    return {"result": "cleared_bulk"}
\ No newline at end of file
+    key = get_key_by_id(key_id)
+    edit_key_db(name=key.name, connected=False)
+    bump(KEYS)
+    publish_key("key.fixed", key_id, key.config_id)
+    return {"result": "fixed"}
\ No newline at end of file
@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from api.services.metrics import registry
+from api.services.workers import metrics_export
+
+router = APIRouter()
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в текстовом формате Prometheus (при нескольких воркерах — всех, с меткой worker)"""
+    # async: гистограммы снимаются в цикле событий, лимитер пула потоков — тоже
+    return Response(metrics_export.render(registry), media_type="text/plain; version=0.0.4; charset=utf-8")
\ No newline at end of file
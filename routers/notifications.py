@@ -0,0 +1,14 @@
+from fastapi import APIRouter, HTTPException
+
+from api.models.notification import NotificationOut
+from api.services.notifications import dispatcher
+
+router = APIRouter()
+
+@router.get("/{notification_id}", response_model=NotificationOut)
+def get_notification(notification_id: str):
+    """Статус заявки на отправку: отправлено, ошибки по ID ключей, попытки"""
+    ticket = dispatcher.get(notification_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    return ticket.to_dict()
\ No newline at end of file
@@ -1,28 +1,79 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+import asyncio
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional
 
-from functions.data.key import get_key_by_id
-from functions.data.session import get_session_db
+from api.models.session import LiveSessionOut
+from api.services.management import management_pool, ManagementError
+from api.services.session_archive import session_archive
+from api.services.data_access import data_access
+from api.services.jobs import job_manager, JobQueueFull
+from api.services.serialization import session_serializer, FastJSONResponse
+from api.services.changes import bump, KEYS, SESSIONS
 
 router = APIRouter()
 
-@router.get("/key/{key_id}", response_model=List[dict])
-def get_sessions_by_key(key_id: int):
+@router.get("/live", response_model=List[LiveSessionOut])
+async def live_sessions():
     """
-    Получить список сессий по ключу
+    Текущие подключения по всем конфигам (из management-интерфейса OpenVPN)
     """
-    key = get_key_by_id(key_id)
+    return management_pool.live()
+
+@router.get("/live/{config_id}", response_model=List[LiveSessionOut])
+async def live_sessions_by_config(config_id: int):
+    """
+    Текущие подключения к конфигу
+    """
+    if config_id not in management_pool.clients:
+        raise HTTPException(status_code=404, detail="Config not found")
+    return management_pool.live(config_id)
+
+@router.post("/live/{config_id}/kill/{common_name}")
+async def kill_live_session(config_id: int, common_name: str):
+    """
+    Отключить клиента конфига по имени (management-команда kill)
+    """
+    if config_id not in management_pool.clients:
+        raise HTTPException(status_code=404, detail="Config not found")
+    try:
+        await management_pool.kill(config_id, common_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ManagementError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except (OSError, asyncio.TimeoutError) as e:
+        raise HTTPException(status_code=502, detail=str(e) or "management interface unavailable")
+    bump(KEYS, SESSIONS)
+    return {"result": "killed"}
+
+@router.get("/key/{key_id}", response_model=List[dict], response_class=FastJSONResponse)
+async def get_sessions_by_key(
+    key_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Размер страницы"),
+    after: Optional[str] = Query(None, description="Курсор из X-Next-Cursor"),
+    archive: bool = Query(True, description="Дочитывать архивные сессии"),
+):
+    """
+    Получить список сессий по ключу (свежие первыми).
+    С limit — постранично, курсор следующей страницы в X-Next-Cursor.
+    """
+    key = await data_access.key(key_id)
     if not key:
         raise HTTPException(status_code=404, detail="Key not found")
-    sessions = get_session_db(key)
-    return [
-        {
-            "id": s.id,
-            "ip": s.ip,
-            "connected": str(s.connected),
-            "disconnected": str(s.disconnected),
-            "total_bytes": s.total_bytes,
-            "total_connected_time": s.total_connected_time
-        }
-        for s in sessions
-    ]
\ No newline at end of file
+    try:
+        sessions, next_cursor = await data_access.session_page(key, limit, after, archive)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return session_serializer.response(sessions, headers=headers)
+
+@router.post("/compact")
+def compact_sessions(days: Optional[int] = Query(None, ge=0, description="Старше скольких дней архивировать")):
+    """
+    Перенести старые сессии в архив (в фоне, прогресс — GET /jobs/{job_id})
+    """
+    try:
+        job = job_manager.submit("sessions.compact", 0, lambda job: session_archive.compact(job, days))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"result": "queued", "job_id": job.id}
\ No newline at end of file
@@ -2,9 +2,10 @@ from fastapi import APIRouter, HTTPException, Body
 from typing import Optional, Dict
 from pydantic import BaseModel
 
-from functions.data.settings import get_settings_db
-from functions.other import load_mail_settings, save_mail_settings
-import subprocess
+from api.services.settings_cache import (
+    get_settings as get_cached_settings, get_mail_notify, update_settings, update_mail_notify
+)
+from api.services.service_control import service_control, ServiceError
 
 router = APIRouter()
 
@@ -36,8 +37,8 @@ class MailNotifySettingsRequest(BaseModel):
 @router.get("/", response_model=Dict)
 def get_settings():
     """Получить все настройки бота и почты"""
-    s = get_settings_db()
-    mail_settings = load_mail_settings()
+    s = get_cached_settings()
+    mail_settings = get_mail_notify()
     return {
         "bot_token": s.bot_token,
         "bot_chat_id": s.bot_chat_id,
@@ -52,63 +53,41 @@ def get_settings():
 @router.put("/bot", response_model=Dict)
 def update_bot_settings(data: BotSettingsRequest):
     """Обновить настройки бота"""
-    s = get_settings_db()
-    if data.bot_token is not None:
-        s.bot_token = data.bot_token
-    if data.bot_chat_id is not None:
-        s.bot_chat_id = data.bot_chat_id
-    s.save()
+    s = update_settings(**data.dict(exclude_none=True))
     return {"result": "updated", "bot_token": s.bot_token, "bot_chat_id": s.bot_chat_id}
 
 @router.put("/mail", response_model=Dict)
 def update_mail_settings(data: MailSettingsRequest):
     """Обновить настройки почты"""
-    s = get_settings_db()
-    if data.use_mail is not None:
-        s.use_mail = data.use_mail
-    if data.mail_host is not None:
-        s.mail_host = data.mail_host
-    if data.mail_port is not None:
-        s.mail_port = data.mail_port
-    if data.mail_login is not None:
-        s.mail_login = data.mail_login
-    if data.mail_password is not None:
-        s.mail_password = data.mail_password
-    s.save()
+    update_settings(**data.dict(exclude_none=True))
     return {"result": "updated"}
 
 @router.put("/mail_notify", response_model=Dict)
 def update_mail_notify_settings(data: MailNotifySettingsRequest):
     """Обновить настройки оповещений по почте"""
-    mail_settings = load_mail_settings()
-    for field, value in data.dict(exclude_unset=True).items():
-        mail_settings[field] = value
-    save_mail_settings(mail_settings)
+    mail_settings = update_mail_notify(data.dict(exclude_unset=True))
     return {"result": "updated", "mail_notify": mail_settings}
 
+async def _bot(action):
+    try:
+        await service_control.systemctl(action, "openvpn-bot")
+    except ServiceError as e:
+        raise HTTPException(status_code=504 if e.result["timeout"] else 500, detail=str(e))
+
 @router.post("/bot/enable")
-def enable_bot():
+async def enable_bot():
     """Включить бота (systemctl start openvpn-bot)"""
-    try:
-        subprocess.check_output("systemctl start openvpn-bot", shell=True)
-        return {"result": "bot enabled"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    await _bot("start")
+    return {"result": "bot enabled"}
 
 @router.post("/bot/disable")
-def disable_bot():
+async def disable_bot():
     """Отключить бота (systemctl stop openvpn-bot)"""
-    try:
-        subprocess.check_output("systemctl stop openvpn-bot", shell=True)
-        return {"result": "bot disabled"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    await _bot("stop")
+    return {"result": "bot disabled"}
 
 @router.post("/bot/restart")
-def restart_bot():
+async def restart_bot():
     """Перезапустить бота (systemctl restart openvpn-bot)"""
-    try:
-        subprocess.check_output("systemctl restart openvpn-bot", shell=True)
-        return {"result": "bot restarted"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    await _bot("restart")
+    return {"result": "bot restarted"}
\ No newline at end of file
@@ -1,56 +1,45 @@
-from fastapi import APIRouter
-from typing import Dict
+from fastapi import APIRouter, HTTPException, Query, Depends
+from typing import Dict, List, Optional
+from datetime import datetime
 
-from functions.data.key import (
-    get_keys_db, get_keys_by_status_db, get_keys_by_connected_db,
-    get_expired_keys_db, get_not_expired_keys_db, get_keys_by_config_db,
-    get_keys_by_config_and_status_db, get_keys_by_config_and_connected_db,
-    get_expired_keys_by_config_db, get_not_expired_keys_by_config_db,
-)
-from functions.data.configs import get_configs_db
-from functions.data.session import (
-    get_total_keys_bytes_db, get_total_key_bytes_by_config_db
-)
-from functions.other import math_bytes
+from api.models.statistics import TrafficBucketOut
+from api.services.statistics import statistics_cache, SNAPSHOT_TTL
+from api.services.data_access import data_access
+from api.services.etag import Conditional
+from api.services.rollups import traffic_rollups, default_range, GRANULARITIES
+from api.services.jobs import job_manager, JobQueueFull
 
 router = APIRouter()
 
-@router.get("/", response_model=Dict)
-def statistics():
-    """Общая статистика по ключам и конфигам"""
-    total_keys = len(get_keys_db())
-    total_keys_blocked = len(get_keys_by_status_db(False))
-    total_keys_active = len(get_keys_by_status_db(True))
-    total_keys_connected = len(get_keys_by_connected_db())
-    total_keys_expired = len(get_expired_keys_db())
-    total_keys_not_expired = len(get_not_expired_keys_db())
-    total_configs = len(get_configs_db())
-    total_traffic = math_bytes(get_total_keys_bytes_db())
+statistics_conditional = Conditional(statistics_cache.tables, SNAPSHOT_TTL)
 
-    configs_stats = []
-    for config in get_configs_db():
-        configs_stats.append({
-            "id": config.id,
-            "port": config.port,
-            "protocol": config.protocol,
-            "address": config.address,
-            "keys_total": len(get_keys_by_config_db(config.id)),
-            "keys_active": len(get_keys_by_config_and_status_db(config.id, True)),
-            "keys_blocked": len(get_keys_by_config_and_status_db(config.id, False)),
-            "keys_connected": len(get_keys_by_config_and_connected_db(config.id, True)),
-            "keys_expired": len(get_expired_keys_by_config_db(config.id)),
-            "keys_not_expired": len(get_not_expired_keys_by_config_db(config.id)),
-            "traffic": math_bytes(get_total_key_bytes_by_config_db(config.id)),
-        })
+@router.get("/", response_model=Dict, dependencies=[Depends(statistics_conditional)])
+async def statistics():
+    """Общая статистика по ключам и конфигам (ETag / If-None-Match)"""
+    return await data_access.statistics()
 
-    return {
-        "total_keys": total_keys,
-        "active_keys": total_keys_active,
-        "blocked_keys": total_keys_blocked,
-        "connected_keys": total_keys_connected,
-        "expired_keys": total_keys_expired,
-        "not_expired_keys": total_keys_not_expired,
-        "total_configs": total_configs,
-        "total_traffic": total_traffic,
-        "configs": configs_stats
-    }
\ No newline at end of file
+@router.get("/traffic", response_model=List[TrafficBucketOut])
+def traffic(
+    from_: Optional[datetime] = Query(None, alias="from", description="Начало периода"),
+    to: Optional[datetime] = Query(None, description="Конец периода (не включительно)"),
+    granularity: str = Query("day", description="hour или day"),
+    config_id: Optional[int] = Query(None),
+    key_id: Optional[int] = Query(None),
+):
+    """
+    Трафик за период по часам или суткам (из роллапов).
+    Можно ограничить конфигом и/или ключом.
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be hour or day")
+    start, end = default_range(granularity)
+    return traffic_rollups.series(from_ or start, to or end, granularity, config_id, key_id)
+
+@router.post("/traffic/rebuild")
+def rebuild_traffic():
+    """Пересчитать роллапы трафика из истории сессий (в фоне)"""
+    try:
+        job = job_manager.submit("statistics.traffic.rebuild", 0, traffic_rollups.rebuild)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"result": "queued", "job_id": job.id}
\ No newline at end of file
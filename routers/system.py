@@ -1,41 +1,197 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.requests import ClientDisconnect
 from typing import Optional
-import subprocess
+
+from api.services.changes import bump, TABLES, SESSIONS
+from api.services.service_control import service_control, ServiceError
+from api.services.backup import backup_manager, backup_filename, BackupNotFound
+from api.services.jobs import job_manager, JobQueueFull
+from api.services.restore import RestoreUpload
 
 router = APIRouter()
 
+# Бэкап, восстановление и удаление OpenVPN могут идти долго
+SCRIPT_TIMEOUT = 1800.0
+
+
+def _service_error(e):
+    return HTTPException(status_code=504 if e.result["timeout"] else 500, detail=str(e))
+
 @router.post("/import_db")
-def import_db(link: str = Body(..., embed=True)):
+async def import_db(link: str = Body(..., embed=True)):
     """
     Восстановить базу данных из бэкапа по ссылке
     """
     try:
-        subprocess.check_output(f"bash bash/openvpn.sh --restore {link}", shell=True)
+        await service_control.run(["bash", "bash/openvpn.sh", "--restore", link], unit="openvpn.sh", timeout=SCRIPT_TIMEOUT)
+        bump(*TABLES)
         return {"result": "imported"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except ServiceError as e:
+        raise _service_error(e)
+
+def _multipart_parser(content_type, on_file_data):
+    """Потоковый разбор multipart: on_file_data(bytes) для содержимого поля file; функция -> найдено ли поле"""
+    try:
+        from python_multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:
+        from multipart.multipart import MultipartParser, parse_options_header
+
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Multipart boundary is missing")
+    state = {"field": b"", "value": b"", "headers": {}, "file": False, "found": False}
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"], state["value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        state["file"] = options.get(b"name") == b"file"
+        state["found"] = state["found"] or state["file"]
+
+    def on_part_data(data, start, end):
+        if state["file"]:
+            on_file_data(data[start:end])
+
+    def on_part_end():
+        state["file"] = False
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field,
+        "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    return parser, lambda: state["found"]
+
+async def _upload_chunks(request: Request):
+    """Куски тела запроса по мере поступления: файл из multipart (поле file) или само тело"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # Не request.form(): тот сначала складывает всю загрузку во временный файл
+        pending = []
+        parser, found = _multipart_parser(content_type, pending.append)
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if pending:
+                yield b"".join(pending)
+                pending.clear()
+        parser.finalize()
+        if pending:
+            yield b"".join(pending)
+        if not found():
+            raise HTTPException(status_code=400, detail="Form field 'file' is required")
+    else:
+        async for chunk in request.stream():
+            if chunk:
+                yield chunk
+
+@router.post("/restore")
+async def restore_db(request: Request):
+    """
+    Восстановить из загруженного бэкапа (multipart с полем file или тело запроса целиком,
+    в том числе chunked). Бэкап проверяется по мере загрузки; прогресс — GET /jobs/{job_id}.
+    Принимается архив openvpn.sh (он восстанавливается скриптом); нативный бэкап API
+    (/system/backup) отклоняется с ошибкой — применить его к базе бота нельзя
+    """
+    try:
+        upload = RestoreUpload(int(request.headers.get("content-length") or 0))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    try:
+        async for chunk in _upload_chunks(request):
+            if not await run_in_threadpool(upload.put, chunk):
+                break
+    except ClientDisconnect:
+        pass
+    finally:
+        await run_in_threadpool(upload.close)
+    job = upload.job
+    if job.status == "failed":
+        raise HTTPException(status_code=400, detail=job.error)
+    return {"result": "queued", "job_id": job.id}
 
 @router.post("/export_db")
-def export_db():
+async def export_db():
     """
     Создать резервную копию базы данных
     """
     try:
-        out = subprocess.check_output("bash bash/openvpn.sh --backup", shell=True)
-        return {"result": "exported", "output": out.decode("utf-8")}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        result = await service_control.run(["bash", "bash/openvpn.sh", "--backup"], unit="openvpn.sh", timeout=SCRIPT_TIMEOUT)
+        return {"result": "exported", "output": result["output"]}
+    except ServiceError as e:
+        raise _service_error(e)
+
+@router.get("/backup/stream")
+def stream_backup(since: Optional[str] = Query(None, description="ID бэкапа, от которого делать инкремент")):
+    """
+    Скачать бэкап потоком (gzip NDJSON), без буферизации на сервере.
+    С since=ID — только изменения после указанного бэкапа.
+    """
+    try:
+        backup_id, body = backup_manager.stream_response(since)
+    except BackupNotFound:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    return StreamingResponse(body, media_type="application/gzip", headers={
+        "Content-Disposition": 'attachment; filename="%s"' % backup_filename(backup_id),
+        "X-Backup-Id": backup_id,
+    })
+
+@router.post("/backup")
+def create_backup(since: Optional[str] = Query(None, description="ID бэкапа, от которого делать инкремент")):
+    """
+    Создать бэкап в фоне; прогресс — GET /jobs/{job_id}, файл — GET /system/backups/{backup_id}
+    """
+    try:
+        backup_id, since_ts = backup_manager.begin(since)
+    except BackupNotFound:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    try:
+        job = job_manager.submit("system.backup", 0, lambda job: backup_manager.write_file(backup_id, since_ts, job))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"result": "queued", "job_id": job.id, "backup_id": backup_id}
+
+@router.get("/backups")
+def list_backups():
+    """Список бэкапов: базовый (parent), время создания и завершения, размер"""
+    return backup_manager.list()
+
+@router.get("/backups/{backup_id}")
+def download_backup(backup_id: str):
+    """Скачать бэкап, созданный в фоне"""
+    try:
+        backup = backup_manager.get(backup_id)
+    except BackupNotFound:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    if not backup["path"]:
+        raise HTTPException(status_code=409, detail="Backup is not stored on the server")
+    return FileResponse(backup["path"], media_type="application/gzip", filename=backup_filename(backup_id))
 
 @router.post("/delete_openvpn")
-def delete_openvpn():
+async def delete_openvpn():
     """
     Удалить OpenVPN
     """
     try:
-        subprocess.check_output("python3 install.py -u", shell=True)
+        await service_control.run(["python3", "install.py", "-u"], unit="install.py", timeout=SCRIPT_TIMEOUT)
+        bump(*TABLES)
         return {"result": "openvpn deleted"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except ServiceError as e:
+        raise _service_error(e)
 
 @router.post("/update_script")
 def update_script():
@@ -53,18 +209,17 @@ def update_script():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/clear_statistics")
-def clear_statistics():
+async def clear_statistics():
     """
     Очистить статистику и перезапустить сервисы
     """
     try:
-        subprocess.check_output("systemctl stop openvpn@server", shell=True)
-        subprocess.check_output("systemctl stop openvpn-bot", shell=True)
-        subprocess.check_output("systemctl stop openvpn-botapi", shell=True)
-        subprocess.check_output("systemctl stop openvpn-api", shell=True)
+        for unit in ("openvpn@server", "openvpn-bot", "openvpn-botapi", "openvpn-api"):
+            await service_control.systemctl("stop", unit)
         # Остановить все дополнительные серверы по списку configs
         # Здесь должен быть вызов clear_stats_db(), если он реализован
         # subprocess.check_output("systemctl restart openvpn-bot; systemctl restart openvpn-botapi; systemctl restart openvpn-api; bash /etc/openvpn/startServer.sh", shell=True)
+        bump(SESSIONS)
         return {"result": "statistics cleared"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    except ServiceError as e:
+        raise _service_error(e)
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""
+Запуск API в продакшене: несколько воркеров на одном порту.
+
+    python -m api.server --host 0.0.0.0 --port 8666 --workers 4
+
+Супервизор открывает слушающий сокет и Unix-сокет основного воркера
+(services/workers.py) и форкает воркеров uvicorn; приложение каждый
+воркер импортирует сам, уже после fork. Упавший воркер запускается
+заново. Второстепенные воркеры ещё и обновляются плановно — после
+--max-requests запросов (со случайной добавкой до --max-requests-jitter,
+чтобы не все сразу) или через --max-age секунд: сменщик сначала
+поднимается и сообщает о готовности, и только потом старый воркер
+завершается, дождавшись текущих запросов (--graceful-timeout).
+Основной воркер держит фоновые службы и задачи в памяти, поэтому
+плановно не обновляется, а при SIGHUP сначала останавливается — две
+копии фоновых служб не работают одновременно.
+
+SIGHUP — поочерёдный перезапуск всех воркеров (например, после
+обновления кода), SIGTERM и SIGINT — мягкая остановка.
+--reload — режим разработки: один процесс с перезапуском по изменениям.
+"""
+import argparse
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import time
+
+import uvicorn
+
+logger = logging.getLogger("api.server")
+
+READY_TIMEOUT = 60.0
+# Воркер, упавший быстрее, запускается заново не сразу
+CRASH_WINDOW = 5.0
+CRASH_DELAY = 1.0
+
+
+class Worker:
+    __slots__ = ("index", "pid", "ready_fd", "started", "retiring")
+
+    def __init__(self, index, pid, ready_fd):
+        self.index = index
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.started = time.monotonic()
+        self.retiring = False
+
+
+class Supervisor:
+    def __init__(self, args):
+        self.args = args
+        self.config = uvicorn.Config(
+            "api.app:app", host=args.host, port=args.port, log_level=args.log_level,
+            timeout_graceful_shutdown=args.graceful_timeout, proxy_headers=True,
+        )
+        self.workers = {}
+        self._stopping = False
+        self._reload = False
+        self._sock = None
+        self._primary_sock = None
+        self._primary_sock_path = None
+
+    def _bind(self):
+        self._sock = self.config.bind_socket()
+        from api.services import changes
+        from api.services.workers import primary_socket
+        # Файл счётчиков и его метку создаёт супервизор — до воркеров
+        changes.epoch()
+        path = primary_socket()
+        if os.path.exists(path):
+            os.unlink(path)
+        self._primary_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._primary_sock.bind(path)
+        self._primary_sock_path = path
+        os.chmod(path, 0o600)
+        self._primary_sock.listen(self.config.backlog)
+        self._primary_sock.set_inheritable(True)
+
+    def spawn(self, index):
+        limit = None
+        if index and self.args.max_requests:
+            limit = self.args.max_requests + random.randint(0, self.args.max_requests_jitter)
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 1
+            try:
+                code = self._serve(index, write_fd, limit)
+            except BaseException:
+                logger.exception("worker %d failed", index)
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        worker = Worker(index, pid, read_fd)
+        self.workers[pid] = worker
+        logger.info("worker %d started (pid %d)", index, pid)
+        return worker
+
+    def _serve(self, index, ready_fd, limit):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        os.environ["OPENVPN_API_WORKER"] = str(index)
+        os.environ["OPENVPN_API_READY_FD"] = str(ready_fd)
+        sockets = [self._sock]
+        if index == 0:
+            sockets.append(self._primary_sock)
+        else:
+            self._primary_sock.close()
+        self.config.limit_max_requests = limit
+        uvicorn.Server(self.config).run(sockets=sockets)
+        return 0
+
+    def wait_ready(self, worker, timeout=READY_TIMEOUT):
+        """True, когда воркер закончил старт; False — не успел или завершился"""
+        ready, _, _ = select.select([worker.ready_fd], [], [], timeout)
+        ok = bool(ready) and os.read(worker.ready_fd, 1) == b"1"
+        os.close(worker.ready_fd)
+        worker.ready_fd = None
+        if not ok:
+            logger.warning("worker %d (pid %d) did not become ready", worker.index, worker.pid)
+        return ok
+
+    def _terminate(self, worker):
+        worker.retiring = True
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _wait_exit(self, worker, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.waitpid(worker.pid, os.WNOHANG)[0]:
+                self._forget(worker)
+                return
+            time.sleep(0.1)
+        os.kill(worker.pid, signal.SIGKILL)
+        os.waitpid(worker.pid, 0)
+        self._forget(worker)
+
+    def _forget(self, worker):
+        self.workers.pop(worker.pid, None)
+        if worker.ready_fd is not None:
+            os.close(worker.ready_fd)
+            worker.ready_fd = None
+
+    def replace(self, worker):
+        """Заменить воркер без простоя (основной — остановить, потом запустить)"""
+        if worker.index == 0:
+            self._terminate(worker)
+            self._wait_exit(worker, self.args.graceful_timeout + 5)
+            self.wait_ready(self.spawn(0))
+            return
+        if self.wait_ready(self.spawn(worker.index)):
+            self._terminate(worker)
+
+    def _reap(self, respawn=True):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.get(pid)
+            if worker is None:
+                continue
+            self._forget(worker)
+            if worker.retiring or self._stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            # Код 0 — uvicorn завершился сам после --max-requests
+            if code:
+                logger.warning("worker %d (pid %d) exited with %d", worker.index, pid, code)
+            if respawn:
+                if code and time.monotonic() - worker.started < CRASH_WINDOW:
+                    time.sleep(CRASH_DELAY)
+                self.spawn(worker.index)
+
+    def _signal(self, sig, frame):
+        if sig == signal.SIGHUP:
+            self._reload = True
+        else:
+            self._stopping = True
+
+    def run(self):
+        self._bind()
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self._signal)
+        logger.info("listening on http://%s:%d, %d workers", self.args.host, self.args.port, self.args.workers)
+        # Основной первым: второстепенные сразу передают ему изменения
+        self.wait_ready(self.spawn(0))
+        for worker in [self.spawn(i) for i in range(1, self.args.workers)]:
+            self.wait_ready(worker)
+        while not self._stopping:
+            self._reap()
+            if self._reload:
+                self._reload = False
+                logger.info("rolling restart")
+                for worker in sorted(self.workers.values(), key=lambda w: w.index):
+                    if not worker.retiring and not self._stopping:
+                        self.replace(worker)
+            elif self.args.max_age:
+                now = time.monotonic()
+                for worker in list(self.workers.values()):
+                    if worker.index and not worker.retiring and now - worker.started > self.args.max_age:
+                        self.replace(worker)
+            time.sleep(0.5)
+        self.shutdown()
+
+    def shutdown(self):
+        logger.info("stopping %d workers", len(self.workers))
+        for worker in list(self.workers.values()):
+            self._terminate(worker)
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap(respawn=False)
+            time.sleep(0.1)
+        for worker in list(self.workers.values()):
+            os.kill(worker.pid, signal.SIGKILL)
+            self._forget(worker)
+        self._primary_sock.close()
+        self._sock.close()
+        try:
+            os.unlink(self._primary_sock_path)
+        except OSError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("OPENVPN_API_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--max-requests", type=int, default=10000, help="Перезапуск воркера после N запросов (0 — нет)")
+    parser.add_argument("--max-requests-jitter", type=int, default=1000)
+    parser.add_argument("--max-age", type=float, default=0, help="Перезапуск воркера через N секунд (0 — нет)")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Ожидание текущих запросов при остановке, сек")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--reload", action="store_true", help="Разработка: один процесс, перезапуск по изменениям")
+    args = parser.parse_args()
+
+    if args.reload:
+        uvicorn.run("api.app:app", host=args.host, port=args.port, reload=True, log_level=args.log_level)
+        return
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [supervisor] %(message)s")
+    Supervisor(args).run()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,518 @@
+"""
+Пулы адресов клиентов по подсетям конфигов.
+
+Подсеть конфига ("10.8.0.0", "10.8.0.0/24" или "10.8.0.0 255.255.255.0";
+без маски — /24) хранится битовой картой: бит на адрес, /24 — 32 байта,
+/16 — 8 КБ. Сетевой адрес, широковещательный и первый хост (сервер)
+зарезервированы. Выдача и возврат адреса — O(1): освобождённые адреса
+лежат в стеке, новые берутся по курсору, а проход по карте нужен только
+при загрузке пула. Каждая операция пишет в SQLite только изменённые
+куски карты (CHUNK байт) и назначение ключа.
+
+Каждый ключ конфига держит один адрес. Создание и перенос ключей через
+API сначала резервируют адреса (reserve(): 409 вместо ключа без адреса,
+если подсеть заполнена), а после создания закрепляют их за ключами;
+удаление возвращает адрес сразу. Ключи, созданные или удалённые ботом
+в обход API, подхватываются сверкой с индексом ключей — в фоне при
+старте основного воркера и не реже RECONCILE_TTL при запросе
+заполненности. Индекс ключей берётся до блокировки пулов: его
+пересборка (полный проход по ключам) не задерживает выдачу адресов, а
+новый пул на пути запроса только создаётся, сверяет его следующая
+сверка. Если задан
+OPENVPN_API_CCD_DIR (шаблон каталога client-config-dir, можно с
+{config_id}), адрес закрепляется за клиентом файлом с ifconfig-push.
+
+Пулы меняет основной воркер, остальные перечитывают их из SQLite по
+счётчику изменений ADDRESSES.
+"""
+import ipaddress
+import logging
+import os
+import threading
+import time
+from array import array
+
+from functions.data.configs import get_config_by_id_db, get_configs_db
+
+from api.services import changes, storage
+from api.services.key_index import key_index
+from api.services.metrics import registry, Gauge
+from api.services.workers import is_primary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFIX = 24
+CHUNK = 256
+RECONCILE_TTL = 60.0
+CCD_DIR = os.environ.get("OPENVPN_API_CCD_DIR")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pools (
+    config_id INTEGER PRIMARY KEY,
+    network TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pool_chunks (
+    config_id INTEGER NOT NULL,
+    chunk INTEGER NOT NULL,
+    bits BLOB NOT NULL,
+    PRIMARY KEY (config_id, chunk)
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    key_id INTEGER PRIMARY KEY,
+    config_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+"""
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class Reservation:
+    """Адреса, занятые под ключи до их создания; неиспользованные возвращаются в close()"""
+
+    def __init__(self, pools, pool, offsets):
+        self.pools = pools
+        self.pool = pool
+        self.offsets = offsets
+
+    def assign(self, keys):
+        self.pools.assign(keys, self)
+
+    def close(self):
+        self.pools._cancel(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_subnet(subnet):
+    """Подсеть конфига в IPv4Network; маска — через "/" или пробел"""
+    text = str(subnet).strip().replace(" ", "/")
+    if "/" not in text:
+        text += "/%d" % DEFAULT_PREFIX
+    return ipaddress.IPv4Network(text, strict=False)
+
+
+class AddressPool:
+    """Битовая карта подсети одного конфига"""
+
+    def __init__(self, config_id, network, bits=None):
+        self.config_id = config_id
+        self.network = network
+        self.size = network.num_addresses
+        self.bits = bytearray((self.size + 7) // 8)
+        # Сетевой, сервер (первый хост) и широковещательный; /31 и /32 — без клиентов
+        self.reserved = (0, 1, self.size - 1) if self.size >= 4 else tuple(range(self.size))
+        self.capacity = self.size - len(set(self.reserved))
+        self.used = 0
+        self.free = array("I")
+        self.dirty = set()
+        if bits is not None:
+            self.bits[:len(bits)] = bits[:len(self.bits)]
+        for offset in self.reserved:
+            self._set(offset)
+        self.dirty.clear()
+        self._scan()
+
+    def _set(self, offset):
+        self.bits[offset >> 3] |= 1 << (offset & 7)
+        self.dirty.add((offset >> 3) // CHUNK)
+
+    def _clear(self, offset):
+        self.bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+        self.dirty.add((offset >> 3) // CHUNK)
+
+    def taken(self, offset):
+        return bool(self.bits[offset >> 3] & (1 << (offset & 7)))
+
+    def _scan(self):
+        """Курсор за последним занятым адресом, дыры до него — в стек свободных"""
+        reserved = set(self.reserved)
+        last = max((i for i in range(self.size) if i not in reserved and self.taken(i)), default=None)
+        self.cursor = 2 if last is None else last + 1
+        self.used = 0
+        self.free = array("I")
+        for offset in range(self.cursor - 1, -1, -1):
+            if offset in reserved:
+                continue
+            if self.taken(offset):
+                self.used += 1
+            else:
+                self.free.append(offset)
+
+    def allocate(self):
+        while self.free:
+            offset = self.free.pop()
+            # Адрес мог быть занят явно (take) уже после возврата в стек
+            if not self.taken(offset):
+                break
+        else:
+            if self.cursor >= self.size - 1:
+                raise PoolExhausted("Address pool of config %s (%s) is full" % (self.config_id, self.network))
+            offset = self.cursor
+            self.cursor += 1
+        self._set(offset)
+        self.used += 1
+        return offset
+
+    def release(self, offset):
+        if offset in self.reserved or not self.taken(offset):
+            return
+        self._clear(offset)
+        self.used -= 1
+        self.free.append(offset)
+
+    def address(self, offset):
+        return str(self.network.network_address + offset)
+
+    def chunk(self, index):
+        return bytes(self.bits[index * CHUNK:(index + 1) * CHUNK])
+
+    def usage(self):
+        return {
+            "network": str(self.network),
+            "capacity": self.capacity,
+            "used": self.used,
+            "free": self.capacity - self.used,
+            "utilization": round(self.used / self.capacity, 4) if self.capacity else 1.0,
+        }
+
+
+def _ccd_path(config_id, name):
+    if not CCD_DIR or "/" in name or name in ("", ".", ".."):
+        return None
+    return os.path.join(CCD_DIR.format(config_id=config_id), name)
+
+
+class AddressPools:
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.RLock()
+        self._pools = {}
+        self._by_key = {}
+        self._loaded = None
+        self._reconciled = {}
+        self._reservations = set()
+        self._thread = None
+
+    def _db(self):
+        if self._conn is None:
+            conn = storage.connect("address_pools")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _sync(self):
+        """Перечитать пулы из SQLite, если их менял другой процесс; под self._lock"""
+        version = changes.version(changes.ADDRESSES)[0]
+        if version == self._loaded:
+            return
+        db = self._db()
+        chunks = {}
+        for row in db.execute("SELECT config_id, chunk, bits FROM pool_chunks ORDER BY config_id, chunk"):
+            chunks.setdefault(row["config_id"], bytearray())
+            data = chunks[row["config_id"]]
+            start = row["chunk"] * CHUNK
+            if len(data) < start + len(row["bits"]):
+                data.extend(bytes(start + len(row["bits"]) - len(data)))
+            data[start:start + len(row["bits"])] = row["bits"]
+        self._pools = {
+            row["config_id"]: AddressPool(row["config_id"], ipaddress.IPv4Network(row["network"]), chunks.get(row["config_id"]))
+            for row in db.execute("SELECT config_id, network FROM pools")
+        }
+        self._by_key = {
+            row["key_id"]: (row["config_id"], row["offset"], row["name"])
+            for row in db.execute("SELECT key_id, config_id, offset, name FROM assignments")
+        }
+        self._loaded = version
+
+    def _save(self, pools, assigned=(), released=()):
+        """Изменённые куски карт и назначения — одной транзакцией; под self._lock"""
+        db = self._db()
+        with db:
+            for pool in pools:
+                for index in pool.dirty:
+                    db.execute(
+                        "INSERT INTO pool_chunks (config_id, chunk, bits) VALUES (?, ?, ?) "
+                        "ON CONFLICT (config_id, chunk) DO UPDATE SET bits = excluded.bits",
+                        (pool.config_id, index, pool.chunk(index))
+                    )
+                pool.dirty.clear()
+            db.executemany(
+                "INSERT INTO assignments (key_id, config_id, offset, name) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key_id) DO UPDATE SET config_id = excluded.config_id, "
+                "offset = excluded.offset, name = excluded.name",
+                [(key_id,) + self._by_key[key_id] for key_id in assigned]
+            )
+            db.executemany("DELETE FROM assignments WHERE key_id = ?", [(key_id,) for key_id in released])
+        changes.bump(changes.ADDRESSES)
+        # Своё изменение перечитывать не нужно
+        self._loaded = changes.version(changes.ADDRESSES)[0]
+
+    def _pool(self, config_id, subnet=None):
+        """Пул конфига; новый или со сменившейся подсетью — с нуля, без сверки; под self._lock"""
+        pool = self._pools.get(config_id)
+        if subnet is None and pool is not None:
+            return pool
+        if subnet is None:
+            config = get_config_by_id_db(config_id)
+            if config is None:
+                return None
+            subnet = config.subnet
+        network = parse_subnet(subnet)
+        if pool is not None and pool.network == network:
+            return pool
+        self._drop(config_id)
+        pool = self._pools[config_id] = AddressPool(config_id, network)
+        with self._db():
+            self._db().execute("INSERT INTO pools (config_id, network) VALUES (?, ?)", (config_id, str(network)))
+        return pool
+
+    def _assign(self, pool, key, offset=None):
+        current = self._by_key.get(key.id)
+        if current is not None and current[0] == pool.config_id:
+            return False
+        if offset is None:
+            offset = pool.allocate()
+        released = self._release(key.id)
+        self._by_key[key.id] = (pool.config_id, offset, key.name)
+        _write_ccd(pool, key.name, offset)
+        return released
+
+    def _release(self, key_id):
+        current = self._by_key.pop(key_id, None)
+        if current is None:
+            return None
+        config_id, offset, name = current
+        pool = self._pools.get(config_id)
+        if pool is not None:
+            pool.release(offset)
+        # Файл ccd по имени клиента — общий у одноимённых ключей конфига
+        if not any(v[0] == config_id and v[2] == name for v in self._by_key.values()):
+            _remove_ccd(config_id, name)
+        return pool
+
+    def _reconcile(self, pool, index):
+        """Сверка с индексом ключей: адрес у каждого ключа конфига и только у них; под self._lock"""
+        if not is_primary():
+            return
+        keys = {k.id: k for k in index.by_config.get(pool.config_id, ())}
+        touched = {pool}
+        released = [key_id for key_id, (config_id, _, _) in self._by_key.items()
+                    if config_id == pool.config_id and key_id not in keys]
+        for key_id in released:
+            self._release(key_id)
+        self._collect_orphans(pool)
+        assigned = []
+        for key in keys.values():
+            try:
+                other = self._assign(pool, key)
+            except PoolExhausted as e:
+                left = sum(1 for k in keys if self._by_key.get(k, (None,))[0] != pool.config_id)
+                logger.warning("%s, %d keys left without an address", e, left)
+                break
+            if other is not False:
+                assigned.append(key.id)
+                if other is not None:
+                    touched.add(other)
+        if assigned or released or pool.dirty:
+            self._save(touched, assigned, released)
+        self._reconciled[pool.config_id] = time.monotonic()
+
+    def _collect_orphans(self, pool):
+        """Освободить занятые адреса без ключа и без резерва (резерв пережил рестарт)"""
+        held = {offset for config_id, offset, _ in self._by_key.values() if config_id == pool.config_id}
+        for reservation in self._reservations:
+            if reservation.pool is pool:
+                held.update(reservation.offsets)
+        if pool.used == len(held):
+            return
+        reserved = set(pool.reserved)
+        for offset in range(pool.size):
+            if offset not in reserved and offset not in held and pool.taken(offset):
+                pool.release(offset)
+
+    def _drop(self, config_id):
+        self._pools.pop(config_id, None)
+        self._reconciled.pop(config_id, None)
+        for key_id in [k for k, v in self._by_key.items() if v[0] == config_id]:
+            _remove_ccd(config_id, self._by_key.pop(key_id)[2])
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM pools WHERE config_id = ?", (config_id,))
+            db.execute("DELETE FROM pool_chunks WHERE config_id = ?", (config_id,))
+            db.execute("DELETE FROM assignments WHERE config_id = ?", (config_id,))
+
+    def reserve(self, config_id, count=1):
+        """Занять count адресов под ключи до их создания; PoolExhausted — не хватит"""
+        with self._lock:
+            self._sync()
+            pool = self._pool(config_id)
+            if pool is None:
+                return Reservation(self, None, [])
+            if pool.capacity - pool.used < count:
+                raise PoolExhausted("Address pool of config %s (%s) has %d free addresses, %d needed" % (
+                    config_id, pool.network, pool.capacity - pool.used, count))
+            reservation = Reservation(self, pool, [pool.allocate() for _ in range(count)])
+            self._reservations.add(reservation)
+            return reservation
+
+    def _cancel(self, reservation):
+        with self._lock:
+            self._reservations.discard(reservation)
+            pool, offsets = reservation.pool, reservation.offsets
+            reservation.offsets = []
+            # Пул могли пересоздать (смена подсети, удаление конфига) — его адреса уже не наши
+            if pool is None or self._pools.get(pool.config_id) is not pool:
+                return
+            for offset in offsets:
+                pool.release(offset)
+            if pool.dirty:
+                self._save({pool})
+
+    def assign(self, keys, reservation=None):
+        """
+        Закрепить адреса за ключами в их конфигах (создание, перенос): из резерва,
+        а сверх него — свободные. Ключ, которому адреса не хватило, остаётся без
+        адреса (в лог), остальные сохраняются.
+        """
+        with self._lock:
+            self._sync()
+            touched, assigned, missing = set(), [], []
+            for key in keys:
+                pool = self._pool(key.config_id)
+                if pool is None:
+                    continue
+                offset = None
+                if reservation is not None and reservation.pool is pool and reservation.offsets:
+                    offset = reservation.offsets[-1]
+                try:
+                    other = self._assign(pool, key, offset)
+                except PoolExhausted:
+                    missing.append(key.id)
+                    continue
+                if other is not False and offset is not None:
+                    reservation.offsets.pop()
+                if other is not False:
+                    touched.add(pool)
+                    assigned.append(key.id)
+                    if other is not None:
+                        touched.add(other)
+            if assigned:
+                self._save(touched, assigned)
+            if missing:
+                logger.warning("address pools are full, keys %s left without an address", missing)
+
+    def release(self, key_ids):
+        """Вернуть адреса удалённых ключей"""
+        with self._lock:
+            self._sync()
+            touched = {self._release(key_id) for key_id in key_ids} - {None}
+            if touched:
+                self._save(touched, released=key_ids)
+
+    def drop(self, config_id):
+        with self._lock:
+            self._sync()
+            self._drop(config_id)
+            changes.bump(changes.ADDRESSES)
+            self._loaded = changes.version(changes.ADDRESSES)[0]
+
+    def address(self, key_id):
+        with self._lock:
+            self._sync()
+            current = self._by_key.get(key_id)
+            pool = self._pools.get(current[0]) if current is not None else None
+            return pool.address(current[1]) if pool is not None else None
+
+    def _stale(self, config_id):
+        return time.monotonic() - self._reconciled.get(config_id, 0.0) >= RECONCILE_TTL
+
+    def reconcile(self, configs=None):
+        """Создать пулы конфигов (по умолчанию всех) и сверить их с ключами"""
+        if not is_primary():
+            return
+        configs = get_configs_db() if configs is None else configs
+        index = key_index.get()
+        with self._lock:
+            self._sync()
+            for config in configs:
+                self._reconcile(self._pool(config.id, config.subnet), index)
+
+    def start(self):
+        """Сверка всех пулов в фоне при старте — не на пути первого запроса"""
+        if self._thread is not None:
+            return
+
+        def run():
+            try:
+                self.reconcile()
+            except Exception:
+                logger.exception("address pools reconcile failed")
+
+        self._thread = threading.Thread(target=run, name="address-pools", daemon=True)
+        self._thread.start()
+
+    def usage(self, config):
+        """Заполненность пула конфига; устаревший пул сверяется с ключами"""
+        # Индекс — до блокировки: пересборка не держит пулы
+        index = key_index.get() if is_primary() and self._stale(config.id) else None
+        with self._lock:
+            self._sync()
+            if not is_primary() and config.id not in self._pools:
+                # Пул создаёт и сверяет основной воркер; до этого — пустая подсеть
+                return AddressPool(config.id, parse_subnet(config.subnet)).usage()
+            pool = self._pool(config.id, config.subnet)
+            if index is not None and self._stale(config.id):
+                self._reconcile(pool, index)
+            return pool.usage()
+
+    def stats(self):
+        with self._lock:
+            self._sync()
+            return {config_id: (pool.capacity, pool.used) for config_id, pool in self._pools.items()}
+
+
+def _write_ccd(pool, name, offset):
+    path = _ccd_path(pool.config_id, name)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write("ifconfig-push %s %s\n" % (pool.address(offset), pool.network.netmask))
+    except OSError as e:
+        logger.warning("ccd file %s was not written: %s", path, e)
+
+
+def _remove_ccd(config_id, name):
+    path = _ccd_path(config_id, name)
+    if path is None:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("ccd file %s was not removed: %s", path, e)
+
+
+address_pools = AddressPools()
+
+
+def _pool_gauge():
+    values = {}
+    for config_id, (capacity, used) in address_pools.stats().items():
+        values[(config_id, "capacity")] = capacity
+        values[(config_id, "used")] = used
+    return values
+
+
+registry.add(Gauge("openvpn_api_address_pool", "Client addresses per config subnet: capacity and used",
+                   ("config_id", "state"), collect=_pool_gauge))
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""
+Нативный бэкап данных API: сжатый поток NDJSON.
+
+Снимок пишется построчно (заголовок, настройки, конфиги, ключи с
+архивными сессиями и суммами архива, сессии, итог) и сжимается на лету,
+поэтому память не растёт с размером таблиц, а клиент начинает получать
+данные сразу. Настройки бота и флаги почтовых оповещений пишутся всегда
+целиком.
+
+Инкрементальный бэкап (since=ID предыдущего) содержит только конфиги и
+ключи с updated позже того бэкапа, архивные блоки, записанные после
+него, и новые с тех пор сессии; суммы архива пишутся всегда целиком,
+они заменяют прежние. Сессии выбираются запросами к модели peewee
+(session_archive.session_model) по ID, а не обходом сессий каждого
+ключа: в манифесте у бэкапа запоминаются последний ID сессии и ID
+открытых тогда сессий, инкремент берёт сессии с большим ID и закрывшиеся
+из открытых. В итоговой строке — полный список ID ключей и конфигов,
+чтобы при восстановлении увидеть удалённые. Все бэкапы учитываются в
+манифесте.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime
+
+from functions.data.key import get_keys_db
+from functions.data.configs import get_configs_db
+from functions.data.settings import get_settings_db
+
+from api.models.settings import SettingsOut
+from api.services.serialization import config_record, key_serializer, session_record
+from api.services import storage
+from api.services.session_archive import session_archive, session_model
+from api.services.settings_cache import load_mail_settings
+
+FORMAT = "openvpn-api-backup"
+FORMAT_VERSION = 3
+CHUNK_SIZE = 64 * 1024
+# Сессий за один запрос к таблице бота
+SESSION_CHUNK = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id TEXT PRIMARY KEY,
+    parent TEXT,
+    since REAL,
+    created REAL NOT NULL,
+    completed REAL,
+    path TEXT,
+    size INTEGER,
+    counts TEXT,
+    last_session_id INTEGER,
+    open_sessions TEXT
+);
+"""
+
+
+class BackupNotFound(Exception):
+    pass
+
+
+def _line(record):
+    return (json.dumps(record, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _changed(value, since):
+    return since is None or (value is not None and value.timestamp() > since)
+
+
+class BackupManager:
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            conn = storage.connect("backups")
+            conn.executescript(_SCHEMA)
+            # Манифест прежних версий — без меток сессий
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(backups)")}
+            with conn:
+                for column, kind in (("last_session_id", "INTEGER"), ("open_sessions", "TEXT")):
+                    if column not in columns:
+                        conn.execute("ALTER TABLE backups ADD COLUMN %s %s" % (column, kind))
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            db = self._db()
+            with db:
+                return db.execute(sql, args).fetchall()
+
+    def get(self, backup_id):
+        rows = self._execute("SELECT * FROM backups WHERE id = ?", (backup_id,))
+        if not rows:
+            raise BackupNotFound(backup_id)
+        return dict(rows[0])
+
+    def list(self):
+        return [dict(r) for r in self._execute("SELECT * FROM backups ORDER BY created DESC")]
+
+    def begin(self, since_id=None):
+        """Зарегистрировать новый бэкап; since_id — база для инкремента"""
+        since = None
+        if since_id is not None:
+            parent = self.get(since_id)
+            if parent["completed"] is None:
+                raise BackupNotFound(since_id)
+            since = parent["created"]
+        backup_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO backups (id, parent, since, created) VALUES (?, ?, ?, ?)",
+            (backup_id, since_id, since, time.time())
+        )
+        return backup_id, since
+
+    def _sessions(self, parent, since, marks):
+        """
+        Сессии для бэкапа: все, а для инкремента — с ID больше последнего
+        в базовом бэкапе и закрывшиеся из открытых тогда. marks получает
+        метки этого бэкапа: last_session_id и open_sessions.
+        """
+        last = parent["last_session_id"] if parent else None
+        waiting = json.loads(parent["open_sessions"] or "[]") if parent else []
+        # База записана прежней версией без меток — отбор по времени
+        legacy = since is not None and last is None
+        marks.update({"last_session_id": last or 0, "open_sessions": []})
+        model = session_model()
+        if model is None:
+            marks["open_sessions"] = waiting
+            return
+        for start in range(0, len(waiting), SESSION_CHUNK):
+            for s in model.select().where(model.id.in_(waiting[start:start + SESSION_CHUNK])):
+                if s.disconnected is None:
+                    marks["open_sessions"].append(s.id)
+                else:
+                    yield s
+        last = last or 0
+        while True:
+            chunk = list(model.select().where(model.id > last).order_by(model.id).limit(SESSION_CHUNK))
+            if not chunk:
+                break
+            last = chunk[-1].id
+            marks["last_session_id"] = last
+            for s in chunk:
+                if s.disconnected is None:
+                    marks["open_sessions"].append(s.id)
+                if not legacy or _changed(s.disconnected, since) or _changed(s.connected, since):
+                    yield s
+
+    def records(self, backup_id, since, job=None, counts=None, marks=None):
+        """
+        Строки снимка по одной; since — метка времени базового бэкапа,
+        counts — счётчики записей, marks — метки сессий для манифеста
+        """
+        backup = self.get(backup_id)
+        parent = self.get(backup["parent"]) if backup["parent"] else None
+        yield _line({
+            "type": "header", "format": FORMAT, "version": FORMAT_VERSION,
+            "backup_id": backup_id, "since": since, "created": backup["created"],
+        })
+        configs = get_configs_db()
+        keys = get_keys_db()
+        if job is not None:
+            job.total = len(configs) + len(keys)
+        counts = counts if counts is not None else {}
+        marks = marks if marks is not None else {}
+        counts.update({"settings": 1, "config": 0, "key": 0, "session": 0, "archived_session": 0,
+                       "archive_total": 0})
+        settings = get_settings_db()
+        yield _line({"type": "settings", "data": {
+            "settings": {field: getattr(settings, field, None) for field in SettingsOut.__fields__},
+            "mail_notify": dict(load_mail_settings() or {}),
+        }})
+        totals = session_archive.totals()
+        for c in configs:
+            if _changed(c.updated, since):
+                counts["config"] += 1
+                yield _line({"type": "config", "data": config_record.dump(c)})
+            if job is not None:
+                job.advance(1)
+        for k in keys:
+            if _changed(k.updated, since):
+                counts["key"] += 1
+                yield _line({"type": "key", "data": key_serializer.dump(k)})
+            for record in session_archive.records(k.id, since):
+                counts["archived_session"] += 1
+                yield _line({"type": "archived_session", "data": record})
+            total = totals.get(k.id)
+            if total is not None:
+                config_id, total_bytes, seconds, sessions = total
+                counts["archive_total"] += 1
+                yield _line({"type": "archive_total", "data": {
+                    "key_id": k.id, "config_id": config_id,
+                    "bytes": total_bytes, "seconds": seconds, "sessions": sessions,
+                }})
+            if job is not None:
+                job.advance(1)
+        for s in self._sessions(parent, since, marks):
+            counts["session"] += 1
+            yield _line({"type": "session", "data": session_record.dump(s)})
+        yield _line({
+            "type": "footer", "counts": counts,
+            "config_ids": [c.id for c in configs], "key_ids": [k.id for k in keys],
+        })
+
+    def stream(self, backup_id, since, job=None, counts=None, marks=None):
+        """Сжатый gzip-поток снимка кусками по ~CHUNK_SIZE"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        buffer = []
+        size = 0
+        for line in self.records(backup_id, since, job, counts, marks):
+            out = compressor.compress(line)
+            if out:
+                buffer.append(out)
+                size += len(out)
+            if size >= CHUNK_SIZE:
+                yield b"".join(buffer)
+                buffer, size = [], 0
+        buffer.append(compressor.flush())
+        yield b"".join(buffer)
+
+    def complete(self, backup_id, path=None, size=None, counts=None, marks=None):
+        marks = marks or {}
+        self._execute(
+            "UPDATE backups SET completed = ?, path = ?, size = ?, counts = ?, last_session_id = ?, "
+            "open_sessions = ? WHERE id = ?",
+            (time.time(), path, size, json.dumps(counts) if counts else None, marks.get("last_session_id"),
+             json.dumps(marks["open_sessions"]) if "open_sessions" in marks else None, backup_id)
+        )
+
+    def stream_response(self, since_id=None):
+        """Генератор для потоковой отдачи клиенту; бэкап завершается вместе с потоком"""
+        backup_id, since = self.begin(since_id)
+
+        def body():
+            size = 0
+            counts, marks = {}, {}
+            for chunk in self.stream(backup_id, since, counts=counts, marks=marks):
+                size += len(chunk)
+                yield chunk
+            self.complete(backup_id, size=size, counts=counts, marks=marks)
+
+        return backup_id, body()
+
+    def write_file(self, backup_id, since, job=None):
+        """Записать бэкап в data/backups/<id>.ndjson.gz (для фоновой задачи)"""
+        path = storage.data_path("backups", backup_id + ".ndjson.gz")
+        tmp = path + ".part"
+        size = 0
+        counts, marks = {}, {}
+        with open(tmp, "wb") as f:
+            for chunk in self.stream(backup_id, since, job, counts, marks):
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.complete(backup_id, path=path, size=size, counts=counts, marks=marks)
+        return {"backup_id": backup_id, "size": size, "counts": counts}
+
+
+def backup_filename(backup_id):
+    return "openvpn-api-%s-%s.ndjson.gz" % (datetime.now().strftime("%Y%m%d-%H%M%S"), backup_id[:8])
+
+
+backup_manager = BackupManager()
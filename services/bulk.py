@@ -0,0 +1,114 @@
+"""
+Массовые действия над ключами (/keys/bulk/*) как фоновые задачи.
+Рассылки (send_tg, send_mail) идут через очередь уведомлений.
+
+Ключи выбираются один раз на всю задачу: немного — точечными запросами
+по ID, больше — из индекса ключей (key_index), который перед задачей
+пересобирается одним чтением таблицы, чтобы не менять устаревшие объекты.
+Ключи, которых в индексе нет (только что созданы ботом), дочитываются по ID.
+Обрабатываются пачками по CHUNK_SIZE: после каждой пачки
+обновляются прогресс задачи и версии таблиц.
+"""
+from functions.data.key import get_key_by_id, edit_key_db
+from functions.data.session import delete_session_db
+
+from api.services import changes
+from api.services.events import publish_key
+from api.services.jobs import job_manager
+from api.services.key_index import key_index
+from api.services.session_archive import session_archive
+from api.services.lazy import lazy
+
+delete_key, block_key, unblock_key = lazy("functions.client", "delete_key", "block_key", "unblock_key")
+
+CHUNK_SIZE = 200
+# Не больше стольких ID читаются точечными запросами, а не из индекса ключей
+POINT_LOOKUP_LIMIT = 10
+
+
+def _block(key):
+    block_key(key)
+
+
+def _unblock(key):
+    unblock_key(key)
+
+
+def _delete(key):
+    # expiry -> notifications -> bulk: импорт здесь, чтобы не было цикла
+    from api.services.expiry import expiry_scheduler
+    from api.services.address_pool import address_pools
+    delete_key(key.id)
+    expiry_scheduler.forget(key.id)
+    address_pools.release([key.id])
+
+
+def _fix(key):
+    edit_key_db(name=key.name, connected=False)
+
+
+def _clear_traffic(key):
+    from api.services.traffic_limits import traffic_limits
+    from api.services.rollups import traffic_rollups
+    delete_session_db(key.id)
+    session_archive.forget(key.id)
+    traffic_rollups.reset_key(key.id)
+    traffic_limits.reset(key.id)
+
+
+# action: (обработчик ключа, затронутые таблицы, тип события)
+ACTIONS = {
+    "block": (_block, (changes.KEYS,), "key.blocked"),
+    "unblock": (_unblock, (changes.KEYS,), "key.unblocked"),
+    "delete": (_delete, (changes.KEYS, changes.SESSIONS), "key.deleted"),
+    "fix": (_fix, (changes.KEYS,), "key.fixed"),
+    "clear_traffic": (_clear_traffic, (changes.SESSIONS,), "key.traffic_cleared"),
+}
+
+
+def fetch_keys(ids, refresh=False):
+    """Ключи по списку ID: {id: key}; отсутствующих в ответе нет. refresh — пересобрать индекс"""
+    if len(ids) <= POINT_LOOKUP_LIMIT:
+        missing = ids
+        keys = {}
+    else:
+        if refresh:
+            key_index.invalidate()
+        by_id = key_index.get().by_id
+        keys = {key_id: by_id[key_id] for key_id in ids if key_id in by_id}
+        missing = [key_id for key_id in ids if key_id not in keys]
+    for key_id in missing:
+        key = get_key_by_id(key_id)
+        if key is not None:
+            keys[key_id] = key
+    return keys
+
+
+def run_bulk(job, action, ids):
+    handler, tables, event = ACTIONS[action]
+    # Задача меняет ключи — объекты нужны свежие, а не из снимка с TTL
+    keys = fetch_keys(ids, refresh=True)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        failures = {}
+        for key_id in chunk:
+            key = keys.get(key_id)
+            if key is None:
+                failures[key_id] = "Key not found"
+                continue
+            try:
+                handler(key)
+            except Exception as e:
+                failures[key_id] = str(e) or e.__class__.__name__
+            else:
+                publish_key(event, key_id, key.config_id, bulk=job.id)
+        if tables:
+            changes.bump(*tables)
+        job.advance(len(chunk), failures)
+    return {"processed": len(ids) - len(job.failed), "failed": len(job.failed)}
+
+
+def submit_bulk(action, ids):
+    """Поставить массовое действие в очередь задач"""
+    ids = list(dict.fromkeys(ids))
+    return job_manager.submit("keys.bulk." + action, len(ids), lambda job: run_bulk(job, action, ids))
@@ -0,0 +1,155 @@
+"""
+Счётчики изменений таблиц.
+
+Мутирующие роуты вызывают bump() для затронутых таблиц, а кэши сравнивают
+сохранённые версии с текущими и пересобирают данные только при изменении.
+
+Счётчики лежат в разделяемой памяти (mmap файла в DATA_DIR) и общие для
+всех процессов API с этим каталогом данных: изменение, пришедшее в один
+воркер, инвалидирует кэши остальных при их следующем чтении. Чтение
+версии — распаковка из памяти без блокировок, bump() — под flock.
+Файл переживает перезапуск воркеров, а первый слот — метка файла
+(epoch), случайная и записываемая один раз при его создании: по ней
+ETag отличает счётчики нового файла от прежних с теми же номерами.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+from api.services import storage
+
+KEYS = "keys"
+CONFIGS = "configs"
+SESSIONS = "sessions"
+SETTINGS = "settings"
+# Служебные данные самого API
+NODES = "nodes"
+ADDRESSES = "addresses"
+TRAFFIC = "traffic"
+
+TABLES = (KEYS, CONFIGS, SESSIONS, SETTINGS)
+COUNTERS = TABLES + (NODES, ADDRESSES, TRAFFIC)
+
+_SLOT = struct.Struct("q")
+
+
+class SharedCounters:
+    """Счётчики int64 в mmap общего файла; файл открывается заново после fork"""
+
+    def __init__(self, path, names):
+        self.path = path
+        # Слот 0 — метка файла
+        self.offsets = {name: (i + 1) * _SLOT.size for i, name in enumerate(names)}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Блокировка flock общая у копий дескриптора после fork — нужен свой
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    size = (len(self.offsets) + 1) * _SLOT.size
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    try:
+                        if os.fstat(fd).st_size < size:
+                            os.ftruncate(fd, size)
+                        shared = mmap.mmap(fd, size)
+                        if not _SLOT.unpack_from(shared, 0)[0]:
+                            _SLOT.pack_into(shared, 0, int.from_bytes(os.urandom(7), "big") | 1)
+                    finally:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                    self._fd, self._map, self._pid = fd, shared, os.getpid()
+        return self._map
+
+    def epoch(self):
+        return _SLOT.unpack_from(self._open(), 0)[0]
+
+    def add(self, *names):
+        shared = self._open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                for name in names:
+                    offset = self.offsets[name]
+                    _SLOT.pack_into(shared, offset, _SLOT.unpack_from(shared, offset)[0] + 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, *names):
+        shared = self._open()
+        return tuple(_SLOT.unpack_from(shared, self.offsets[name])[0] for name in names)
+
+
+_counters = SharedCounters(storage.data_path("changes.shm"), COUNTERS)
+
+
+def bump(*tables):
+    """Отметить изменение указанных таблиц"""
+    _counters.add(*tables)
+
+
+def epoch():
+    """Метка файла счётчиков: общая у всех воркеров, меняется только с самим файлом"""
+    return _counters.epoch()
+
+
+def version(*tables):
+    """Текущие версии таблиц — кортеж в порядке аргументов"""
+    return _counters.get(*tables)
+
+
+class VersionedCache:
+    """
+    Значение, пересобираемое при изменении указанных таблиц.
+
+    TTL ограничивает устаревание для изменений в обход API
+    (сессии и флаг connected пишет сам OpenVPN, ключи — бот).
+    """
+
+    def __init__(self, build, tables, ttl):
+        self.build = build
+        self.tables = tuple(tables)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._versions = None
+        self._built = 0.0
+
+    def _fresh(self, versions):
+        return (
+            self._value is not None
+            and self._versions == versions
+            and time.monotonic() - self._built < self.ttl
+        )
+
+    def get(self):
+        versions = version(*self.tables)
+        if self._fresh(versions):
+            return self._value
+        with self._lock:
+            # Пока ждали блокировку, значение мог пересобрать другой поток
+            if self._fresh(versions):
+                return self._value
+            value = self.build()
+            # Версии взяты до сборки: изменение во время сборки вызовет пересборку
+            self._value, self._versions, self._built = value, versions, time.monotonic()
+            return value
+
+    def peek(self):
+        """Текущее значение без пересборки (может быть устаревшим или None)"""
+        return self._value
+
+    def set(self, value):
+        """Записать значение напрямую (write-through после своего изменения)"""
+        with self._lock:
+            self._value, self._versions, self._built = value, version(*self.tables), time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
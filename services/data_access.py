@@ -0,0 +1,129 @@
+"""
+Асинхронный доступ к данным бота для горячих роутов чтения.
+
+Слой functions.data.* синхронный (ORM бота), поэтому async-роуты
+выполняют его вызовы в собственных пулах потоков, а не в общем пуле
+FastAPI, где их вытесняли бы тяжёлые синхронные роуты. Пулов два:
+point — выборки по ID (ключ, конфиг, настройки), scan — проходы по
+таблицам и пересборки кэшей (статистика, история сессий, список
+конфигов). Медленные сканы занимают только свои потоки, и точечные
+запросы вроде GET /keys/{id} не ждут их в очереди.
+
+Размер пула — это и число одновременных обращений к БД (соединений)
+с этой стороны. Контекст запроса (метрики) передаётся в поток.
+warm_up() на старте открывает соединение в каждом потоке обоих пулов.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from functions.data.key import get_key_by_id
+from functions.data.configs import get_configs_db, get_config_by_id_db
+from functions.data.settings import get_settings_db
+
+from api.services.address_pool import address_pools
+from api.services.metrics import registry, Gauge
+from api.services.session_archive import session_page
+from api.services.settings_cache import get_settings
+from api.services.statistics import statistics_cache
+
+POINT_WORKERS = int(os.environ.get("OPENVPN_API_DB_POINT_WORKERS", 8))
+SCAN_WORKERS = int(os.environ.get("OPENVPN_API_DB_SCAN_WORKERS", 4))
+WARM_TIMEOUT = 5.0
+
+
+class Lane:
+    """Пул потоков одного вида обращений и счётчики его загрузки"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-" + name)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.running = 0
+
+    def _track(self, fn):
+        with self._lock:
+            self.running += 1
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.submitted -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        call = functools.partial(contextvars.copy_context().run, functools.partial(fn, *args, **kwargs))
+        with self._lock:
+            self.submitted += 1
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._track, call)
+
+    async def warm(self, fn):
+        """Вызвать fn в каждом потоке пула (например, открыть соединение с БД)"""
+        barrier = threading.Barrier(self.workers)
+
+        def touch():
+            # Пока вызовы ждут у барьера, пул создаёт новые потоки — каждый вызов в своём
+            try:
+                barrier.wait(WARM_TIMEOUT)
+            except threading.BrokenBarrierError:
+                pass
+            return fn()
+
+        await asyncio.gather(*(self.run(touch) for _ in range(self.workers)))
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "busy": self.running, "queued": self.submitted - self.running}
+
+
+class DataAccess:
+    def __init__(self, point_workers=POINT_WORKERS, scan_workers=SCAN_WORKERS):
+        self.point = Lane("point", point_workers)
+        self.scan = Lane("scan", scan_workers)
+
+    async def key(self, key_id):
+        return await self.point.run(get_key_by_id, key_id)
+
+    async def config(self, config_id):
+        return await self.point.run(get_config_by_id_db, config_id)
+
+    async def settings(self):
+        return await self.point.run(get_settings)
+
+    async def configs(self):
+        return await self.scan.run(get_configs_db)
+
+    async def statistics(self):
+        return await self.scan.run(statistics_cache.get)
+
+    async def address_usage(self, config):
+        return await self.scan.run(address_pools.usage, config)
+
+    async def session_page(self, key, limit=None, after=None, archive=True):
+        return await self.scan.run(session_page, key, limit, after, archive)
+
+    async def warm_up(self):
+        await asyncio.gather(self.point.warm(get_settings_db), self.scan.warm(get_settings_db))
+
+    def stats(self):
+        return {lane.name: lane.stats() for lane in (self.point, self.scan)}
+
+
+data_access = DataAccess()
+
+
+def _pool_gauge():
+    values = {}
+    for lane, stats in data_access.stats().items():
+        for state in ("workers", "busy", "queued"):
+            values[(lane, state)] = stats[state]
+    return values
+
+
+registry.add(Gauge("openvpn_api_data_pool_threads", "Data access pools: size, busy and queued calls",
+                   ("lane", "state"), collect=_pool_gauge))
\ No newline at end of file
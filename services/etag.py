@@ -0,0 +1,58 @@
+"""
+ETag и условные GET по счётчикам изменений.
+
+Тег складывается из версий таблиц, от которых зависит ответ, метки
+файла счётчиков (changes.epoch(): одна на все воркеры, так что повтор
+запроса, попавший на другой воркер, получает тот же тег) и номера окна
+TTL: изменения в обход API (бот, OpenVPN) счётчики не видят, поэтому
+тег сменяется хотя бы раз за окно — так же, как пересобираются кэши. Совпадение с If-None-Match обрабатывается в
+зависимости до тела роута: 304 без обращения к БД и сериализации.
+"""
+import time
+
+from fastapi import HTTPException, Request, Response
+
+from api.services import changes
+
+
+def etag(tables, ttl):
+    versions = "-".join(str(v) for v in changes.version(*tables))
+    return 'W/"%x-%s-%d"' % (changes.epoch(), versions, int(time.time() // ttl))
+
+
+def _opaque(tag):
+    # Слабое сравнение: префикс W/ не учитывается
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _matches(header, tag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return _opaque(tag) in {_opaque(t) for t in header.split(",")}
+
+
+def etag_headers(tag):
+    return {"ETag": tag, "Cache-Control": "no-cache"}
+
+
+class Conditional:
+    """
+    Зависимость для GET: ответ 304, если клиент прислал актуальный тег.
+    Возвращает тег; роуты, отдающие Response сами, добавляют его в заголовки.
+    """
+
+    def __init__(self, tables, ttl):
+        self.tables = tuple(tables)
+        self.ttl = ttl
+
+    # async: тег считается в цикле событий, без потока из пула FastAPI
+    async def __call__(self, request: Request, response: Response):
+        tag = etag(self.tables, self.ttl)
+        headers = etag_headers(tag)
+        if _matches(request.headers.get("if-none-match"), tag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return tag
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+Шина событий для push-канала (/events/stream — SSE, /events/ws — WebSocket).
+
+Мутирующие роуты, массовые задачи и опрос management-интерфейса
+публикуют типизированные события: key.*, config.*, session.*.
+publish() можно звать из любого потока — раздача идёт в цикле событий.
+Каждое событие кодируется один раз, а подписчики получают готовые
+байты, поэтому сотни вкладок дашборда стоят одной публикации, а не
+сотен опросов.
+
+У подписчика своя очередь на QUEUE_SIZE событий и фильтр (типы,
+config_id, key_id). Если клиент не успевает читать, его очередь
+сбрасывается и он получает одно событие resync — сигнал перечитать
+состояние через REST. Так медленный клиент не держит память и не
+тормозит остальных. Последние HISTORY событий хранятся для повтора
+по Last-Event-ID после переподключения.
+
+При нескольких воркерах события основного воркера раздаются остальным
+(relay, services/workers.py) и принимаются ими через receive().
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+
+from api.services.key_index import key_index
+
+QUEUE_SIZE = 256
+HISTORY = 1000
+MAX_SUBSCRIBERS = 1000
+KEEPALIVE = 15.0
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Event:
+    __slots__ = ("id", "type", "config_id", "key_id", "payload", "frame")
+
+    def __init__(self, event_id, type, config_id, key_id, data, moment=None):
+        self.id = event_id
+        self.type = type
+        self.config_id = config_id
+        self.key_id = key_id
+        self.payload = json.dumps({
+            "id": event_id, "type": type, "time": moment or time.time(),
+            "config_id": config_id, "key_id": key_id, "data": data,
+        }, default=str, ensure_ascii=False)
+        self.frame = ("id: %d\nevent: %s\ndata: %s\n\n" % (event_id, type, self.payload)).encode("utf-8")
+
+
+# Служебное событие для отставшего подписчика: очередь сброшена
+RESYNC = Event(0, "resync", None, None, {"reason": "subscriber queue overflow"})
+
+
+class Subscriber:
+    def __init__(self, types=None, config_id=None, key_id=None, maxsize=QUEUE_SIZE):
+        self.types = tuple(types) if types else None
+        self.config_id = config_id
+        self.key_id = key_id
+        self.queue = asyncio.Queue(maxsize)
+        self.overflows = 0
+
+    def matches(self, event):
+        if self.config_id is not None and event.config_id != self.config_id:
+            return False
+        if self.key_id is not None and event.key_id != self.key_id:
+            return False
+        if self.types is None:
+            return True
+        # "key" подходит для key.blocked, key.deleted и т.д.
+        return any(event.type == t or event.type.startswith(t + ".") for t in self.types)
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflows += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class EventBus:
+    def __init__(self, history=HISTORY, max_subscribers=MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._loop = None
+        self._subscribers = set()
+        self._history = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        # relay(event) — раздать событие другим воркерам
+        self.relay = None
+
+    def attach(self, loop):
+        """Привязать шину к циклу событий приложения (на старте)"""
+        self._loop = loop
+
+    def publish(self, type, config_id=None, key_id=None, **data):
+        """Опубликовать событие; безопасно из любого потока"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        args = (type, config_id, key_id, data, time.time())
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        if current is loop:
+            self._dispatch(*args)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, *args)
+
+    def _dispatch(self, type, config_id, key_id, data, moment):
+        # ID выдаются в цикле событий — порядок в истории совпадает с порядком ID
+        event = Event(next(self._ids), type, config_id, key_id, data, moment)
+        self._deliver(event)
+        if self.relay is not None:
+            self.relay(event)
+
+    def _deliver(self, event):
+        self._history.append(event)
+        for subscriber in self._subscribers:
+            if subscriber.matches(event):
+                subscriber.offer(event)
+
+    def receive(self, message):
+        """Событие от основного воркера (payload события); вызывается в цикле событий"""
+        self._deliver(Event(
+            message["id"], message["type"], message["config_id"], message["key_id"],
+            message["data"], message["time"],
+        ))
+
+    def subscribe(self, types=None, config_id=None, key_id=None):
+        if len(self._subscribers) >= self.max_subscribers:
+            raise TooManySubscribers("Too many event subscribers")
+        subscriber = Subscriber(types, config_id, key_id)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    async def events(self, subscriber, last_id=None, keepalive=KEEPALIVE):
+        """
+        Поток событий подписчика: сначала пропущенные после last_id из
+        истории, затем новые. None — пора отправить keepalive.
+        """
+        last = 0
+        if last_id is not None:
+            for event in list(self._history):
+                if event.id > last_id and subscriber.matches(event):
+                    last = event.id
+                    yield event
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            # Событие могло попасть и в очередь, и в повтор из истории
+            if event is RESYNC or event.id > last:
+                last = event.id or last
+                yield event
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "history": len(self._history),
+            "last_id": self._history[-1].id if self._history else 0,
+        }
+
+
+def key_config_id(key_id):
+    """
+    config_id ключа из индекса ключей как есть, без пересборки —
+    публикация события не должна читать БД.
+    """
+    index = key_index.peek()
+    key = index.by_id.get(key_id) if index is not None else None
+    return key.config_id if key is not None else None
+
+
+def publish_key(type, key_id, config_id=None, **data):
+    """Событие по ключу; config_id по умолчанию — из индекса"""
+    if config_id is None:
+        config_id = key_config_id(key_id)
+    event_bus.publish(type, config_id=config_id, key_id=key_id, **data)
+
+
+def _key_id_by_name(common_name):
+    index = key_index.peek()
+    keys = index.by_name.get(common_name) if index is not None else None
+    return keys[0].id if keys else None
+
+
+def on_sessions_opened(config_id, clients):
+    """Подписчик management_pool: новые подключения"""
+    for c in clients:
+        event_bus.publish(
+            "session.connected", config_id=config_id, key_id=_key_id_by_name(c["common_name"]),
+            common_name=c["common_name"], real_address=c["real_address"],
+            virtual_address=c["virtual_address"], connected_since=c["connected_since"],
+        )
+
+
+def on_sessions_closed(config_id, clients):
+    """Подписчик management_pool: отключения"""
+    for c in clients:
+        event_bus.publish(
+            "session.disconnected", config_id=config_id, key_id=_key_id_by_name(c["common_name"]),
+            common_name=c["common_name"], connected_since=c["connected_since"],
+            bytes=c["bytes_received"] + c["bytes_sent"],
+        )
+
+
+event_bus = EventBus()
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+Планировщик истечения ключей и напоминаний о сроке.
+
+Сроки всех ключей загружаются один раз (из индекса ключей) в min-кучу
+дедлайнов: за неделю, за день и момент истечения. Поток-планировщик
+спит до ближайшего дедлайна, так что каждое событие стоит O(log n), а
+не проход по всей таблице. Роуты, меняющие срок (создание, продление,
+правка, перенос, удаление), обновляют расписание ключа через refresh()
+или forget(); старые записи кучи не удаляются, а отбрасываются при
+извлечении по несовпадению срока.
+
+Перед срабатыванием ключ перечитывается: если бот продлил его в обход
+API, дедлайн просто переносится. Ключи, созданные ботом, подхватываются
+при полной перезагрузке раз в RELOAD_INTERVAL.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from functions.data.key import get_key_by_id
+
+from api.services import changes
+from api.services.events import publish_key
+from api.services.key_index import key_index
+from api.services.notifications import dispatcher, NotificationQueueFull
+from api.services.settings_cache import mail_notify_enabled
+from api.services.lazy import lazy
+
+block_key = lazy("functions.client", "block_key")
+
+logger = logging.getLogger(__name__)
+
+# Дедлайны: (канал уведомлений, смещение от срока, флаг mail_notify)
+REMINDERS = (
+    ("expiry_week", timedelta(days=7), "mail_week_before_expired"),
+    ("expiry_day", timedelta(days=1), "mail_day_before_expired"),
+    ("expired", timedelta(0), "mail_expired_key"),
+)
+# Напоминания, опоздавшие больше чем на GRACE (простой API), не отправляются
+GRACE = 3600.0
+# Ключи, истекшие за время простоя не раньше CATCH_UP назад, блокируются при старте
+CATCH_UP = 86400.0
+RELOAD_INTERVAL = 3600.0
+FIRE_BATCH = 200
+
+
+def _ts(value):
+    return value.timestamp() if value is not None else None
+
+
+class ExpiryScheduler:
+    def __init__(self):
+        self._heap = []
+        self._expiry = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._loaded = None
+        self.fired = {kind: 0 for kind, _, _ in REMINDERS}
+
+    def _push(self, key_id, expired):
+        """Расписание одного ключа; вызывается под self._cond"""
+        expired = _ts(expired)
+        if self._expiry.get(key_id) == expired:
+            return False
+        if expired is None:
+            self._expiry.pop(key_id, None)
+            return False
+        self._expiry[key_id] = expired
+        now = time.time()
+        for kind, offset, _ in REMINDERS:
+            when = expired - offset.total_seconds()
+            # Давно прошедшие дедлайны не планируются
+            if when > now - (CATCH_UP if kind == "expired" else GRACE):
+                heapq.heappush(self._heap, (when, next(self._seq), key_id, kind, expired))
+        return True
+
+    def load(self):
+        """Загрузить сроки всех ключей (старт и периодическая сверка)"""
+        keys = key_index.get().ordered
+        with self._cond:
+            seen = set()
+            for key in keys:
+                seen.add(key.id)
+                self._push(key.id, key.expired)
+            for key_id in set(self._expiry) - seen:
+                del self._expiry[key_id]
+            self._loaded = time.monotonic()
+            self._cond.notify()
+
+    def schedule(self, key):
+        """Обновить расписание по объекту ключа"""
+        with self._cond:
+            if self._push(key.id, key.expired):
+                self._cond.notify()
+
+    def refresh(self, key_id):
+        """Перечитать ключ и обновить его расписание (после изменения через API)"""
+        key = get_key_by_id(key_id)
+        if key is None:
+            self.forget(key_id)
+        else:
+            self.schedule(key)
+
+    def forget(self, key_id):
+        with self._cond:
+            self._expiry.pop(key_id, None)
+
+    def pending(self):
+        with self._cond:
+            return len(self._expiry)
+
+    def _take_due(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._loaded is None or time.monotonic() - self._loaded >= RELOAD_INTERVAL:
+                    return None
+                due = []
+                while self._heap and self._heap[0][0] <= now and len(due) < FIRE_BATCH:
+                    when, _, key_id, kind, expired = heapq.heappop(self._heap)
+                    # Срок с тех пор менялся или ключ удалён — запись устарела
+                    if self._expiry.get(key_id) == expired:
+                        due.append((when, key_id, kind, expired))
+                if due:
+                    return due
+                timeout = RELOAD_INTERVAL - (time.monotonic() - self._loaded)
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - now)
+                self._cond.wait(max(0.0, timeout))
+
+    def _fire(self, due):
+        blocked = False
+        notify = {}
+        for when, key_id, kind, expired in due:
+            key = get_key_by_id(key_id)
+            if key is None:
+                self.forget(key_id)
+                continue
+            if _ts(key.expired) != expired:
+                # Срок поменяли в обход API — переносим расписание
+                self.schedule(key)
+                continue
+            self.fired[kind] += 1
+            if kind == "expired":
+                # Срок остаётся в _expiry: при перезагрузке ключ не истечёт повторно
+                active = bool(key.status)
+                if active:
+                    block_key(key)
+                    blocked = True
+                publish_key("key.expired", key.id, key.config_id, blocked=active)
+            else:
+                publish_key("key.expiring", key.id, key.config_id, expired=key.expired, reminder=kind)
+            if time.time() - when <= GRACE and key.email:
+                notify.setdefault(kind, []).append(key.id)
+        if blocked:
+            changes.bump(changes.KEYS)
+        for kind, _, flag in REMINDERS:
+            if notify.get(kind) and mail_notify_enabled(flag):
+                try:
+                    dispatcher.enqueue(kind, notify[kind])
+                except NotificationQueueFull:
+                    logger.warning("notification queue is full, %d %s reminders dropped", len(notify[kind]), kind)
+
+    def _run(self):
+        while True:
+            try:
+                due = self._take_due()
+                if due is None:
+                    self.load()
+                else:
+                    self._fire(due)
+            except Exception:
+                logger.exception("expiry scheduler failed")
+                time.sleep(5.0)
+
+    def start(self):
+        # Первая загрузка — уже в потоке планировщика
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="expiry", daemon=True)
+            self._thread.start()
+
+
+expiry_scheduler = ExpiryScheduler()
\ No newline at end of file
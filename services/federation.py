@@ -0,0 +1,254 @@
+"""
+Режим федерации: один API опрашивает несколько хостов OpenVPN.
+
+Соседние узлы (их API) регистрируются в SQLite. Чтения /statistics/,
+/keys/, /configs/ и сессий расходятся по всем узлам одновременно через
+общий пул keep-alive соединений httpx, у каждого узла свой таймаут.
+Свой узел опрашивается тем же путём, но через ASGI в процессе, без
+сети. Ответ собирается из того, что успело прийти: по каждому узлу —
+статус, время и ошибка, флаг partial — если кто-то не ответил.
+
+Собранный ответ живёт CACHE_TTL секунд, а одинаковые запросы,
+пришедшие во время опроса, ждут тот же опрос, а не запускают свой.
+"""
+import asyncio
+import os
+import socket
+import threading
+import time
+
+from api.services import changes, storage
+
+NODE_NAME = os.environ.get("OPENVPN_API_NODE_NAME") or socket.gethostname()
+FANOUT_TIMEOUT = 3.0
+CACHE_TTL = 2.0
+MAX_CONNECTIONS = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    name TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    timeout REAL
+);
+"""
+
+
+class NodeNotFound(Exception):
+    pass
+
+
+class Node:
+    __slots__ = ("name", "url", "timeout", "local")
+
+    def __init__(self, name, url, timeout=None, local=False):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.local = local
+
+    def to_dict(self):
+        return {"name": self.name, "url": self.url, "timeout": self.timeout, "local": self.local}
+
+
+class NodeRegistry:
+    """
+    Соседние узлы; список в памяти, запись — сразу в SQLite.
+    Список перечитывается, когда узлы поменял другой воркер (счётчик NODES).
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+        self._nodes = None
+        self._loaded = None
+
+    @property
+    def version(self):
+        return changes.version(changes.NODES)[0]
+
+    def _db(self):
+        if self._conn is None:
+            conn = storage.connect("federation")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _load(self):
+        version = self.version
+        if self._nodes is None or self._loaded != version:
+            rows = self._db().execute("SELECT name, url, timeout FROM nodes ORDER BY name").fetchall()
+            self._nodes = {r["name"]: Node(r["name"], r["url"], r["timeout"]) for r in rows}
+            self._loaded = version
+        return self._nodes
+
+    def list(self):
+        with self._lock:
+            return list(self._load().values())
+
+    def add(self, name, url, timeout=None):
+        node = Node(name, url, timeout)
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT INTO nodes (name, url, timeout) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET url = excluded.url, timeout = excluded.timeout",
+                    (node.name, node.url, node.timeout)
+                )
+            changes.bump(changes.NODES)
+            self._load()
+        return node
+
+    def remove(self, name):
+        with self._lock:
+            if name not in self._load():
+                raise NodeNotFound(name)
+            db = self._db()
+            with db:
+                db.execute("DELETE FROM nodes WHERE name = ?", (name,))
+            changes.bump(changes.NODES)
+            self._load()
+
+
+class NodeResult:
+    __slots__ = ("node", "ok", "status", "elapsed", "error", "data")
+
+    def __init__(self, node, ok, status=None, elapsed=0.0, error=None, data=None):
+        self.node = node
+        self.ok = ok
+        self.status = status
+        self.elapsed = elapsed
+        self.error = error
+        self.data = data
+
+    def to_dict(self):
+        return {
+            "node": self.node, "ok": self.ok, "status": self.status,
+            "elapsed": round(self.elapsed, 4), "error": self.error,
+        }
+
+
+class Federation:
+    def __init__(self, registry, timeout=FANOUT_TIMEOUT, cache_ttl=CACHE_TTL):
+        self.registry = registry
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self._client = None
+        self._local_client = None
+        self._cache = {}
+        self._inflight = {}
+
+    def nodes(self, app, names=None):
+        """Свой узел и соседние; names — оставить только эти"""
+        nodes = [Node(NODE_NAME, "http://local", local=True)] + self.registry.list()
+        if names:
+            wanted = set(names)
+            nodes = [n for n in nodes if n.name in wanted]
+        return nodes
+
+    def _http(self, node, app):
+        # httpx импортируется при первом опросе: это заметная часть времени импорта API
+        import httpx
+        if node.local:
+            if self._local_client is None:
+                self._local_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=node.url)
+            return self._local_client
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS,
+            ))
+        return self._client
+
+    async def _fetch(self, node, app, path, params):
+        import httpx
+        started = time.monotonic()
+        timeout = node.timeout or self.timeout
+        try:
+            response = await asyncio.wait_for(
+                self._http(node, app).get(node.url + path, params=params, timeout=timeout), timeout
+            )
+        except asyncio.TimeoutError:
+            return NodeResult(node.name, False, elapsed=time.monotonic() - started,
+                              error="timeout after %gs" % timeout)
+        except httpx.HTTPError as e:
+            return NodeResult(node.name, False, elapsed=time.monotonic() - started,
+                              error=str(e) or e.__class__.__name__)
+        elapsed = time.monotonic() - started
+        if response.status_code != 200:
+            return NodeResult(node.name, False, response.status_code, elapsed, response.text[:200])
+        try:
+            data = response.json()
+        except ValueError:
+            return NodeResult(node.name, False, response.status_code, elapsed, "invalid JSON")
+        return NodeResult(node.name, True, response.status_code, elapsed, data=data)
+
+    async def _collect(self, nodes, app, path, params):
+        return await asyncio.gather(*(self._fetch(n, app, path, params) for n in nodes))
+
+    async def gather(self, app, path, params=None, names=None):
+        """
+        GET path со всех узлов одновременно: список NodeResult.
+        Повтор в пределах CACHE_TTL и одновременные одинаковые запросы
+        получают один и тот же результат.
+        """
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        key = (path, tuple(sorted(params.items())), tuple(sorted(names or ())), self.registry.version)
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._collect(self.nodes(app, names), app, path, params))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _, k=key: self._inflight.pop(k, None))
+        results = await asyncio.shield(task)
+        self._cache[key] = (time.monotonic() + self.cache_ttl, results)
+        if len(self._cache) > 256:
+            self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+        return results
+
+    async def close(self):
+        for client in (self._client, self._local_client):
+            if client is not None:
+                await client.aclose()
+        self._client = self._local_client = None
+
+
+def _envelope(results):
+    return {"nodes": [r.to_dict() for r in results], "partial": not all(r.ok for r in results)}
+
+
+def merge_items(results):
+    """Списки узлов в один; у каждого элемента — поле node"""
+    merged = _envelope(results)
+    items = []
+    for r in results:
+        if r.ok and isinstance(r.data, list):
+            for item in r.data:
+                if isinstance(item, dict):
+                    item["node"] = r.node
+                items.append(item)
+    merged["items"] = items
+    return merged
+
+
+def merge_statistics(results):
+    """Счётчики верхнего уровня суммируются, полная статистика — по узлам"""
+    merged = _envelope(results)
+    totals = {}
+    by_node = {}
+    for r in results:
+        if not r.ok or not isinstance(r.data, dict):
+            continue
+        by_node[r.node] = r.data
+        for name, value in r.data.items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                totals[name] = totals.get(name, 0) + value
+    merged["totals"] = totals
+    merged["by_node"] = by_node
+    return merged
+
+
+node_registry = NodeRegistry()
+federation = Federation(node_registry)
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Фоновые задачи с отслеживанием прогресса.
+
+Задача получает ID сразу при постановке в очередь, выполняется в
+ограниченном пуле потоков и сообщает прогресс через Job.advance().
+Состояние хранится в памяти процесса; завершённые задачи вытесняются
+после MAX_FINISHED.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+JOB_WORKERS = 4
+MAX_PENDING = 64
+MAX_FINISHED = 500
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, action, total):
+        self.id = uuid.uuid4().hex
+        self.action = action
+        self.total = total
+        self.done = 0
+        self.failed = {}
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.created = datetime.now()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+        self._t0 = None
+        self._t1 = None
+
+    def advance(self, count, failures=None):
+        """Отметить обработку count элементов, failures — {id: ошибка}"""
+        with self._lock:
+            self.done += count
+            if failures:
+                self.failed.update(failures)
+
+    def to_dict(self):
+        with self._lock:
+            elapsed = None
+            if self._t0 is not None:
+                elapsed = (time.monotonic() if self.finished is None else self._t1) - self._t0
+            return {
+                "id": self.id,
+                "action": self.action,
+                "status": self.status,
+                "total": self.total,
+                "done": self.done,
+                "failed": {str(k): v for k, v in self.failed.items()},
+                "progress": round(self.done / self.total, 4) if self.total else 1.0,
+                "throughput": round(self.done / elapsed, 2) if elapsed else None,
+                "error": self.error,
+                "result": self.result,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+            }
+
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS, max_pending=MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pending(self):
+        return sum(1 for j in self._jobs.values() if j.finished is None)
+
+    def submit(self, action, total, fn):
+        """Поставить fn(job) в очередь; вернуть Job сразу"""
+        job = Job(action, total)
+        with self._lock:
+            if self._pending() >= self.max_pending:
+                raise JobQueueFull("Too many jobs in progress")
+            self._jobs[job.id] = job
+            self._evict()
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        job.status = "running"
+        job.started = datetime.now()
+        job._t0 = time.monotonic()
+        try:
+            job.result = fn(job)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e) or e.__class__.__name__
+        finally:
+            job._t1 = time.monotonic()
+            job.finished = datetime.now()
+
+    def _evict(self):
+        finished = [i for i, j in self._jobs.items() if j.finished is not None]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return list(self._jobs.values())
+
+
+job_manager = JobManager()
@@ -0,0 +1,94 @@
+"""
+Пакетное создание ключей.
+
+Генерация сертификата и .ovpn — чистая нагрузка на CPU, поэтому ключи
+пакета создаются параллельно в пуле процессов (по одному ключу на вызов
+create_key), а не последовательно в одном потоке. Большие пакеты уходят
+в фоновую задачу.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from functions.data.key import get_keys_by_name_db
+
+from api.services import changes
+from api.services.address_pool import address_pools
+from api.services.events import publish_key
+from api.services.expiry import expiry_scheduler
+from api.services.jobs import job_manager
+from api.services.lazy import lazy
+
+create_key = lazy("functions.client", "create_key")
+KeysList = lazy("functions.list", "KeysList")
+
+BATCH_WORKERS = os.cpu_count() or 1
+# Пакеты больше этого размера создаются в фоне (задача /jobs/{id})
+SYNC_LIMIT = 20
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: дочерние процессы не наследуют открытые соединения с БД
+            _pool = ProcessPoolExecutor(
+                max_workers=BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def batch_names(name, amount):
+    if amount == 1:
+        return [name]
+    return ["%s_%d" % (name, i) for i in range(1, amount + 1)]
+
+
+def _create_one(name, days, config_id, email):
+    create_key(name, days, 1, config_id, email)
+    return name
+
+
+def create_keys(names, days, config_id, email, job=None, reservation=None):
+    """Создать ключи параллельно; вернуть (созданные ключи, {имя: ошибка})"""
+    reservation = reservation or address_pools.reserve(config_id, 0)
+    with reservation:
+        # Ключи с теми же именами могли существовать и до пакета
+        existing = {k.id for n in names for k in get_keys_by_name_db(n)}
+        pool = _get_pool()
+        futures = {pool.submit(_create_one, n, days, config_id, email): n for n in names}
+        failures = {}
+        try:
+            for future in as_completed(futures):
+                name = futures[future]
+                error = future.exception()
+                if error is not None:
+                    failures[name] = str(error) or error.__class__.__name__
+                if job is not None:
+                    job.advance(1, {name: failures[name]} if name in failures else None)
+        finally:
+            changes.bump(changes.KEYS)
+        created = sorted((
+            k for n in names if n not in failures for k in get_keys_by_name_db(n)
+            if k.id not in existing and k.config_id == config_id
+        ), key=lambda k: k.id)
+        reservation.assign(created)
+    for k in created:
+        expiry_scheduler.schedule(k)
+        publish_key("key.created", k.id, k.config_id, name=k.name)
+    return created, failures
+
+
+def submit_batch(names, days, config_id, email, reservation=None):
+    def run(job):
+        created, failures = create_keys(names, days, config_id, email, job, reservation)
+        return {"ids": [k.id for k in created], "failed": len(failures)}
+    return job_manager.submit("keys.batch", len(names), run)
+
+
+def key_rows(keys):
+    return [KeysList.default_json(i + 1, k) for i, k in enumerate(keys)]
@@ -0,0 +1,188 @@
+"""
+Индексы по ключам для GET /keys/.
+
+Таблица ключей читается одним запросом, после чего каждый критерий by=
+отвечает поиском по готовому индексу (name, email, config_id, status,
+days, free_key, expired, created/updated), а не полным проходом с
+сортировкой в Python. Трафик, число сессий и время в сети по каждому
+ключу берутся из итогов роллапов (services/rollups.py) одним запросом
+и тоже кэшируются.
+
+query() возвращает список ключей в порядке выдачи и функцию ключа
+сортировки — по ней работает курсорная пагинация.
+"""
+import heapq
+from collections import defaultdict
+from datetime import datetime, date
+
+from functions.data.key import get_keys_db
+from functions.data.configs import get_configs_db
+
+from api.services import changes
+
+# Индекс обновляется при изменениях через API; TTL — для ключей,
+# созданных ботом, и флага connected, который пишет OpenVPN.
+INDEX_TTL = 10.0
+# Итоги ключей меняет запись роллапов (счётчик TRAFFIC); TTL — страховка
+AGGREGATES_TTL = 60.0
+
+METRICS = ("traffic", "sessions", "connected_time")
+
+_NEVER = float("inf")
+
+
+def _key_id(key):
+    return (key.id,)
+
+
+def _by_expiry(key):
+    return (_ts(key.expired), key.id)
+
+
+def _ts(value):
+    return value.timestamp() if value is not None else _NEVER
+
+
+def _day(value):
+    if value is None:
+        return None
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _parse_day(value):
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+class KeyIndex:
+    """Снимок таблицы ключей со вторичными индексами"""
+
+    def __init__(self, keys, configs):
+        self.ordered = sorted(keys, key=lambda k: k.id)
+        self.by_id = {k.id: k for k in self.ordered}
+        self.by_name = defaultdict(list)
+        self.by_email = defaultdict(list)
+        self.by_config = defaultdict(list)
+        self.by_status = defaultdict(list)
+        self.by_days = defaultdict(list)
+        self.by_created = defaultdict(list)
+        self.by_updated = defaultdict(list)
+        self.free = []
+        for key in self.ordered:
+            self.by_name[key.name].append(key)
+            if key.email:
+                self.by_email[key.email.lower()].append(key)
+            self.by_config[key.config_id].append(key)
+            self.by_status[bool(key.status)].append(key)
+            self.by_days[key.days].append(key)
+            self.by_created[_day(key.created)].append(key)
+            self.by_updated[_day(key.updated)].append(key)
+            if key.free_key:
+                self.free.append(key)
+        # Отсортированы по дате истечения: истекшие — префикс списка
+        self.by_expired = sorted(self.ordered, key=lambda k: (_ts(k.expired), k.id))
+
+        self.configs_by_port = defaultdict(list)
+        self.configs_by_protocol = defaultdict(list)
+        for config in configs:
+            self.configs_by_port[config.port].append(config.id)
+            self.configs_by_protocol[str(config.protocol).lower()].append(config.id)
+
+    def _by_configs(self, config_ids):
+        return list(heapq.merge(*(self.by_config.get(i, []) for i in config_ids), key=lambda k: k.id))
+
+    def _expired(self, now):
+        ts = now.timestamp()
+        lo, hi = 0, len(self.by_expired)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _ts(self.by_expired[mid].expired) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self.by_expired[:lo]
+
+    def query(self, by, value, aggregates=None):
+        """
+        Ключи по критерию by=.
+        Возвращает (ключи, функция ключа сортировки) или None для неизвестного критерия.
+        """
+        if by in (None, "all"):
+            return self.ordered, _key_id
+        if by == "name":
+            return self.by_name.get(value, []), _key_id
+        if by == "email":
+            return self.by_email.get(str(value or "").lower(), []), _key_id
+        if by == "status":
+            return self.by_status.get(bool(value), []), _key_id
+        if by == "config":
+            return self.by_config.get(value, []), _key_id
+        if by == "days":
+            return self.by_days.get(value, []), _key_id
+        if by == "port":
+            return self._by_configs(self.configs_by_port.get(value, [])), _key_id
+        if by == "protocol":
+            return self._by_configs(self.configs_by_protocol.get(str(value or "").lower(), [])), _key_id
+        if by in ("created", "updated", "date"):
+            day = _parse_day(value)
+            if by == "created":
+                return self.by_created.get(day, []), _key_id
+            if by == "updated":
+                return self.by_updated.get(day, []), _key_id
+            merged = {k.id: k for k in self.by_created.get(day, []) + self.by_updated.get(day, [])}
+            return [merged[i] for i in sorted(merged)], _key_id
+        if by == "free_keys":
+            return self.free, _key_id
+        if by == "expired":
+            return self._expired(datetime.now()), _by_expiry
+        if by == "expired_days":
+            return self.by_expired, _by_expiry
+        if by in METRICS:
+            aggregates = aggregates if aggregates is not None else key_aggregates.get()
+            column = METRICS.index(by)
+            keys = [self.by_id[i] for i in aggregates.order(column) if i in self.by_id]
+
+            def metric(k):
+                return (-aggregates.value(k.id, column), k.id)
+            return keys, metric
+        return None
+
+
+class KeyAggregates:
+    """Трафик, число сессий и время в сети по каждому ключу"""
+
+    def __init__(self, values, complete=True):
+        self.values = values
+        # False — база итогов ещё не посчитана (первый старт), значения неполные
+        self.complete = complete
+        # Порядок по убыванию каждой метрики считается один раз на снимок
+        self.orders = [
+            sorted(values, key=lambda i, c=column: (-values[i][c], i))
+            for column in range(len(METRICS))
+        ]
+
+    def value(self, key_id, column):
+        row = self.values.get(key_id)
+        return row[column] if row else 0
+
+    def order(self, column):
+        return self.orders[column]
+
+
+def collect_aggregates():
+    """Итоги ключей из роллапов: {key_id: (bytes, sessions, seconds)}"""
+    # rollups -> key_index: импорт здесь, чтобы не было цикла
+    from api.services.rollups import traffic_rollups
+    return KeyAggregates(*traffic_rollups.key_totals())
+
+
+def _build_index():
+    return KeyIndex(get_keys_db(), get_configs_db())
+
+
+key_index = changes.VersionedCache(_build_index, (changes.KEYS, changes.CONFIGS), INDEX_TTL)
+key_aggregates = changes.VersionedCache(collect_aggregates, (changes.KEYS, changes.TRAFFIC), AGGREGATES_TTL)
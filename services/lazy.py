@@ -0,0 +1,54 @@
+"""
+Отложенный импорт тяжёлых подсистем бота.
+
+functions.client (выпуск сертификатов), functions.server_control
+(systemctl), functions.other (SMTP, Telegram) и functions.list тянут за
+собой много модулей, а нужны не каждому запросу. lazy() возвращает
+заместителей объектов модуля: модуль импортируется при первом вызове
+или обращении к атрибуту, дальше заместитель только передаёт вызов.
+Импорт api.app и старт воркера их не ждут; preload() импортирует всё
+отложенное заранее (фоновый прогрев после старта, services/warmup.py).
+"""
+import importlib
+
+_registered = []
+
+
+class Lazy:
+    """Объект name модуля module, импортируемого по первому требованию"""
+
+    __slots__ = ("_module", "_name", "_target")
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+        self._target = None
+
+    def resolve(self):
+        target = self._target
+        if target is None:
+            target = self._target = getattr(importlib.import_module(self._module), self._name)
+        return target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __repr__(self):
+        return "<lazy %s.%s>" % (self._module, self._name)
+
+
+def lazy(module, *names):
+    """Заместители names из module: один объект или кортеж в порядке names"""
+    proxies = tuple(Lazy(module, name) for name in names)
+    _registered.extend(proxies)
+    return proxies[0] if len(proxies) == 1 else proxies
+
+
+def preload():
+    """Импортировать все отложенные модули; число разрешённых объектов"""
+    for proxy in _registered:
+        proxy.resolve()
+    return len(_registered)
\ No newline at end of file
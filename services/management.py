@@ -0,0 +1,307 @@
+"""
+Асинхронный клиент management-интерфейса OpenVPN.
+
+На каждый конфиг держится одно постоянное соединение с его telnet_port.
+Команды (status, kill, ...) сериализуются блокировкой соединения —
+протокол строго «запрос-ответ», — а строки уведомлений (">...")
+раздаются подписчикам. Фоновый опрос держит в памяти актуальный список
+подключённых клиентов, поэтому /sessions/live отвечает без обращения
+к OpenVPN и без переподключений на каждый запрос.
+"""
+import asyncio
+import logging
+import re
+import time
+from datetime import datetime
+
+from fastapi.concurrency import run_in_threadpool
+
+from functions.data.configs import get_configs_db
+
+from api.services import changes
+
+logger = logging.getLogger(__name__)
+
+MANAGEMENT_HOST = "127.0.0.1"
+COMMAND_TIMEOUT = 5.0
+POLL_INTERVAL = 5.0
+RECONNECT_DELAY_MAX = 30.0
+# Имя клиента уходит в строку команды: пробел или перевод строки её расщепят
+_UNSAFE_NAME = re.compile(r"[\s\x00-\x1f\x7f]")
+
+
+class ManagementError(Exception):
+    pass
+
+
+def parse_status(lines):
+    """Разобрать вывод `status 3` в список клиентов"""
+    columns = None
+    clients = []
+    for line in lines:
+        parts = line.split("\t")
+        if parts[0] == "HEADER" and len(parts) > 1 and parts[1] == "CLIENT_LIST":
+            columns = {name: i for i, name in enumerate(parts[1:])}
+        elif parts[0] == "CLIENT_LIST":
+            columns = columns or _DEFAULT_COLUMNS
+
+            def field(name, default=None):
+                i = columns.get(name)
+                return parts[i] if i is not None and i < len(parts) else default
+
+            since = field("Connected Since (time_t)")
+            clients.append({
+                "common_name": field("Common Name"),
+                "real_address": field("Real Address"),
+                "virtual_address": field("Virtual Address") or None,
+                "bytes_received": int(field("Bytes Received", 0) or 0),
+                "bytes_sent": int(field("Bytes Sent", 0) or 0),
+                "connected_since": datetime.fromtimestamp(int(since)) if since else None,
+                "client_id": int(field("Client ID")) if field("Client ID") else None,
+            })
+    return clients
+
+
+# Колонки `status 3` OpenVPN 2.4+ на случай, если HEADER не пришёл
+_DEFAULT_COLUMNS = {name: i for i, name in enumerate([
+    "CLIENT_LIST", "Common Name", "Real Address", "Virtual Address", "Virtual IPv6 Address",
+    "Bytes Received", "Bytes Sent", "Connected Since", "Connected Since (time_t)",
+    "Username", "Client ID", "Peer ID",
+])}
+
+
+class ManagementClient:
+    """Одно постоянное соединение с management-интерфейсом конфига"""
+
+    def __init__(self, config_id, port, host=MANAGEMENT_HOST, on_notification=None, on_closed=None, on_opened=None):
+        self.config_id = config_id
+        self.host = host
+        self.port = port
+        self.on_notification = on_notification
+        self.on_closed = on_closed
+        self.on_opened = on_opened
+        self.bytecount = 0
+        self.clients = []
+        self.by_client_id = {}
+        self.updated = None
+        self.error = None
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._responses = asyncio.Queue()
+        self._read_task = None
+        self._bytecount_on = False
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), COMMAND_TIMEOUT
+        )
+        self._responses = asyncio.Queue()
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    async def close(self):
+        self._bytecount_on = False
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _read_loop(self):
+        try:
+            while True:
+                raw = await self._reader.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                if line.startswith(">"):
+                    if self.on_notification is not None:
+                        try:
+                            self.on_notification(self, line[1:])
+                        except Exception:
+                            logger.exception("management notification handler failed")
+                else:
+                    self._responses.put_nowait(line)
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+            self._responses.put_nowait(None)
+
+    async def command(self, cmd, multiline=False):
+        """Выполнить команду; multiline — ответ до строки END"""
+        async with self._lock:
+            if not self.connected:
+                await self.connect()
+            try:
+                self._writer.write((cmd + "\n").encode("utf-8"))
+                await self._writer.drain()
+                lines = []
+                while True:
+                    line = await asyncio.wait_for(self._responses.get(), COMMAND_TIMEOUT)
+                    if line is None:
+                        raise ManagementError("connection closed")
+                    if multiline:
+                        if line == "END":
+                            return lines
+                        lines.append(line)
+                    elif line.startswith("SUCCESS:"):
+                        return line[len("SUCCESS:"):].strip()
+                    elif line.startswith("ERROR:"):
+                        raise ManagementError(line[len("ERROR:"):].strip())
+            except ManagementError:
+                raise
+            except BaseException:
+                # Таймаут или отмена: недочитанный ответ достался бы следующей
+                # команде, поэтому соединение закрывается, а не переиспользуется
+                await self.close()
+                raise
+
+    async def status(self):
+        return parse_status(await self.command("status 3", multiline=True))
+
+    async def kill(self, common_name):
+        """ValueError — имя с пробелами или управляющими символами"""
+        if not common_name or _UNSAFE_NAME.search(common_name):
+            raise ValueError("Invalid common name")
+        return await self.command("kill %s" % common_name)
+
+    async def poll(self):
+        """Обновить снимок подключённых клиентов"""
+        try:
+            previous = self.clients
+            first = self.updated is None
+            if self.bytecount and not self._bytecount_on:
+                # Включается на соединение: после переподключения — заново
+                await self.command("bytecount %d" % self.bytecount)
+                self._bytecount_on = True
+            self.clients = await self.status()
+            self.by_client_id = {c["client_id"]: c for c in self.clients if c["client_id"] is not None}
+            self.updated = datetime.now()
+            self.error = None
+            current = {(c["common_name"], c["connected_since"]) for c in self.clients}
+            closed = [c for c in previous if (c["common_name"], c["connected_since"]) not in current]
+            if closed and self.on_closed is not None:
+                self.on_closed(self, closed)
+            # Первый снимок — уже подключённые клиенты, а не новые подключения
+            if not first and self.on_opened is not None:
+                known = {(c["common_name"], c["connected_since"]) for c in previous}
+                opened = [c for c in self.clients if (c["common_name"], c["connected_since"]) not in known]
+                if opened:
+                    self.on_opened(self, opened)
+        except (OSError, asyncio.TimeoutError, ManagementError) as e:
+            self.error = str(e) or e.__class__.__name__
+            await self.close()
+
+
+class ManagementPool:
+    """Соединения со всеми конфигами и фоновый опрос их статуса"""
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.clients = {}
+        self._subscribers = []
+        self._closed_subscribers = []
+        self._opened_subscribers = []
+        self._task = None
+        self._configs_version = None
+        self.bytecount = 0
+
+    def subscribe(self, callback):
+        """callback(config_id, line) на каждое уведомление management-интерфейса"""
+        self._subscribers.append(callback)
+
+    def subscribe_closed(self, callback):
+        """callback(config_id, clients) для клиентов, пропавших из status с прошлого опроса"""
+        self._closed_subscribers.append(callback)
+
+    def enable_bytecount(self, interval):
+        """Уведомления >BYTECOUNT_CLI раз в interval секунд на всех соединениях"""
+        self.bytecount = interval
+        for client in self.clients.values():
+            client.bytecount = interval
+
+    def subscribe_opened(self, callback):
+        """callback(config_id, clients) для клиентов, появившихся в status с прошлого опроса"""
+        self._opened_subscribers.append(callback)
+
+    def _notify(self, client, line):
+        for callback in self._subscribers:
+            callback(client.config_id, line)
+
+    def _closed(self, client, closed):
+        for callback in self._closed_subscribers:
+            try:
+                callback(client.config_id, closed)
+            except Exception:
+                logger.exception("closed sessions handler failed")
+
+    def _opened(self, client, opened):
+        for callback in self._opened_subscribers:
+            try:
+                callback(client.config_id, opened)
+            except Exception:
+                logger.exception("opened sessions handler failed")
+
+    async def sync(self):
+        """Привести набор соединений к текущему списку конфигов"""
+        configs = await run_in_threadpool(get_configs_db)
+        wanted = {c.id: c.telnet_port for c in configs if c.telnet_port}
+        for config_id in list(self.clients):
+            client = self.clients[config_id]
+            if wanted.get(config_id) != client.port:
+                await client.close()
+                del self.clients[config_id]
+        for config_id, port in wanted.items():
+            if config_id not in self.clients:
+                self.clients[config_id] = ManagementClient(
+                    config_id, port, on_notification=self._notify, on_closed=self._closed, on_opened=self._opened
+                )
+                self.clients[config_id].bytecount = self.bytecount
+
+    async def _run(self):
+        delay = self.poll_interval
+        while True:
+            started = time.monotonic()
+            try:
+                version = changes.version(changes.CONFIGS)
+                if version != self._configs_version:
+                    await self.sync()
+                    self._configs_version = version
+                await asyncio.gather(*(c.poll() for c in self.clients.values()))
+                failed = any(c.error for c in self.clients.values())
+                # При недоступных конфигах переподключаемся с нарастающей паузой
+                delay = min(delay * 2, RECONNECT_DELAY_MAX) if failed else self.poll_interval
+            except Exception:
+                logger.exception("management poll failed")
+            await asyncio.sleep(max(0.0, delay - (time.monotonic() - started)))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for client in self.clients.values():
+            await client.close()
+
+    def live(self, config_id=None):
+        """Снимок подключённых клиентов из памяти"""
+        clients = self.clients.values() if config_id is None else [self.clients[config_id]]
+        return [
+            dict(item, config_id=client.config_id)
+            for client in clients
+            for item in client.clients
+        ]
+
+    async def kill(self, config_id, common_name):
+        return await self.clients[config_id].kill(common_name)
+
+
+management_pool = ManagementPool()
@@ -0,0 +1,332 @@
+"""
+Метрики API в формате Prometheus (GET /metrics).
+
+MetricsMiddleware меряет каждый HTTP-запрос: гистограмма задержки по
+шаблону роута (/keys/{key_id}, а не /keys/42), число запросов по коду
+ответа и запросы в обработке. instrument_data_layer() оборачивает
+функции functions.data.*: каждый вызов учитывается в общих счётчиках и
+в статистике текущего запроса (contextvar, доходит и до потоков
+run_in_threadpool), поэтому гистограммы числа и времени обращений к БД
+на запрос показывают N+1 по роутам. Длительность systemctl и служебных
+скриптов пишет service_control.
+
+С OPENVPN_API_SERVER_TIMING=1 те же данные по запросу уходят в
+заголовке Server-Timing (db — обращения к БД, app — весь обработчик).
+
+При запуске несколькими воркерами у каждого ряда есть метка worker, а
+/metrics любого воркера отдаёт ряды всех (services/workers.py,
+MetricsExport): счётчик перезапущенного воркера обнуляется только в
+своём ряду, и rate() это учитывает.
+
+Для ленивых запросов ORM время вызова не включает выборку строк —
+число обращений при этом точное.
+"""
+import contextvars
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+
+SERVER_TIMING = os.environ.get("OPENVPN_API_SERVER_TIMING", "").lower() in ("1", "true", "yes", "on")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 10000)
+SUBPROCESS_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+# Не сопоставленные с роутом пути (404) не плодят отдельных рядов
+UNMATCHED = "<unmatched>"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None, const=()):
+    pairs = ['%s="%s"' % (n, _escape(v)) for n, v in const]
+    pairs.extend('%s="%s"' % (n, _escape(v)) for n, v in zip(names, values))
+    if extra:
+        pairs.append('%s="%s"' % extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.type)]
+
+    def samples(self, const=()):
+        """Строки значений; const — метки всех рядов, например (("worker", "1"),)"""
+        lines = []
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            lines.extend(self._samples(values, value, const))
+        return lines
+
+    def render(self):
+        return self.header() + self.samples()
+
+    def _samples(self, values, value, const=()):
+        return ["%s%s %s" % (self.name, _labels(self.labels, values, const=const), _number(value))]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, values=(), amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        # collect() -> {значения меток: число}, считается при каждом снятии метрик
+        self.collect = collect
+
+    def inc(self, values=(), amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def dec(self, values=(), amount=1):
+        self.inc(values, -amount)
+
+    def samples(self, const=()):
+        if self.collect is not None:
+            try:
+                collected = self.collect()
+            except Exception:
+                collected = {}
+            with self._lock:
+                self._values = dict(collected)
+        return super().samples(const)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, values, amount):
+        with self._lock:
+            row = self._values.get(values)
+            if row is None:
+                row = self._values[values] = [[0] * len(self.buckets), 0.0, 0]
+            counts = row[0]
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    counts[i] += 1
+                    break
+            row[1] += amount
+            row[2] += 1
+
+    def _samples(self, values, row, const=()):
+        counts, total, count = row
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append("%s_bucket%s %d" % (
+                self.name, _labels(self.labels, values, ("le", _number(bound)), const), cumulative))
+        lines.append("%s_sum%s %s" % (self.name, _labels(self.labels, values, const=const), repr(float(total))))
+        lines.append("%s_count%s %d" % (self.name, _labels(self.labels, values, const=const), count))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def families(self, const=()):
+        """[(имя, строки HELP/TYPE, строки значений)] — для объединения рядов воркеров"""
+        return [(metric.name, metric.header(), metric.samples(const)) for metric in self.metrics]
+
+    def render(self, const=(), others=()):
+        """Текст для /metrics; others — families() других воркеров: ряды семейства идут вместе"""
+        merged = {}
+        for families in (self.families(const),) + tuple(others):
+            for name, header, samples in families:
+                if name not in merged:
+                    merged[name] = (header, [])
+                merged[name][1].extend(samples)
+        lines = []
+        for header, samples in merged.values():
+            lines.extend(header)
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def _threadpool():
+    """Занятые и все потоки пула run_in_threadpool (лимитер anyio)"""
+    try:
+        from anyio.to_thread import current_default_thread_limiter
+        limiter = current_default_thread_limiter()
+    except Exception:
+        return {}
+    return {("busy",): limiter.borrowed_tokens, ("size",): limiter.total_tokens}
+
+
+registry = Registry()
+
+REQUESTS = registry.add(Counter(
+    "openvpn_api_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+REQUEST_SECONDS = registry.add(Histogram(
+    "openvpn_api_request_duration_seconds", "HTTP request latency", ("method", "route")))
+IN_FLIGHT = registry.add(Gauge(
+    "openvpn_api_requests_in_flight", "HTTP requests being handled"))
+REQUEST_DB_CALLS = registry.add(Histogram(
+    "openvpn_api_request_db_calls", "Data layer calls per HTTP request", ("method", "route"), DB_CALL_BUCKETS))
+REQUEST_DB_SECONDS = registry.add(Histogram(
+    "openvpn_api_request_db_seconds", "Time in data layer calls per HTTP request", ("method", "route")))
+DB_CALLS = registry.add(Counter(
+    "openvpn_api_db_calls_total", "Data layer calls by function", ("function",)))
+DB_SECONDS = registry.add(Counter(
+    "openvpn_api_db_seconds_total", "Time in data layer calls by function", ("function",)))
+SUBPROCESS_SECONDS = registry.add(Histogram(
+    "openvpn_api_subprocess_duration_seconds", "systemctl and service script durations",
+    ("unit", "action", "outcome"), SUBPROCESS_BUCKETS))
+THREADPOOL = registry.add(Gauge(
+    "openvpn_api_threadpool_threads", "Worker threads of the sync route pool", ("state",), collect=_threadpool))
+
+
+class RequestStats:
+    __slots__ = ("db_calls", "db_seconds")
+
+    def __init__(self):
+        self.db_calls = 0
+        self.db_seconds = 0.0
+
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+def current_stats():
+    """Статистика текущего запроса или None вне запроса (фоновые задачи)"""
+    return _current.get()
+
+
+def observe_subprocess(unit, action, outcome, seconds):
+    SUBPROCESS_SECONDS.observe((unit, action, outcome), seconds)
+
+
+def _wrap(fn, label):
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_CALLS.inc((label,))
+            DB_SECONDS.inc((label,), elapsed)
+            stats = _current.get()
+            if stats is not None:
+                stats.db_calls += 1
+                stats.db_seconds += elapsed
+    call.__instrumented__ = True
+    return call
+
+
+def instrument_data_layer(package="functions.data", importers=("api",)):
+    """
+    Обернуть функции модулей package.* и заменить ссылки на них в уже
+    загруженных модулях importers.* (там они импортированы через from ... import).
+    Повторный вызов ничего не меняет.
+    """
+    wrapped = {}
+    for name, module in list(sys.modules.items()):
+        if module is None or not name.startswith(package + "."):
+            continue
+        short = name[len(package) + 1:]
+        for attr, value in list(vars(module).items()):
+            if attr.startswith("_") or not inspect.isfunction(value) or getattr(value, "__instrumented__", False):
+                continue
+            if value.__module__ != name:
+                continue
+            replacement = _wrap(value, "%s.%s" % (short, attr))
+            setattr(module, attr, replacement)
+            wrapped[id(value)] = (value, replacement)
+    if not wrapped:
+        return 0
+    for name, module in list(sys.modules.items()):
+        if module is None or not any(name == p or name.startswith(p + ".") for p in importers):
+            continue
+        for attr, value in list(vars(module).items()):
+            hit = wrapped.get(id(value))
+            if hit is not None and hit[0] is value:
+                setattr(module, attr, hit[1])
+    return len(wrapped)
+
+
+def _route(scope):
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED
+
+
+def _server_timing(stats, elapsed):
+    return ('db;dur=%.1f;desc="%d calls", app;dur=%.1f' % (
+        stats.db_seconds * 1000, stats.db_calls, elapsed * 1000)).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: задержка, коды ответов и обращения к БД по роутам"""
+
+    def __init__(self, app, server_timing=SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+        IN_FLIGHT.inc()
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    headers = list(message.get("headers", ()))
+                    headers.append((b"server-timing", _server_timing(stats, time.perf_counter() - started)))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            _current.reset(token)
+            labels = (scope["method"], _route(scope))
+            REQUESTS.inc(labels + (str(status),))
+            REQUEST_SECONDS.observe(labels, elapsed)
+            REQUEST_DB_CALLS.observe(labels, stats.db_calls)
+            REQUEST_DB_SECONDS.observe(labels, stats.db_seconds)
\ No newline at end of file
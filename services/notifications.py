@@ -0,0 +1,404 @@
+"""
+Очередь исходящих уведомлений (Telegram, почта).
+
+Роуты только ставят отправку в очередь и сразу возвращают ID заявки.
+У каждого канала свой поток-отправитель: он забирает готовые элементы
+пачками, берёт настройки из кэша один раз на пачку, соблюдает лимит скорости
+канала и повторяет неудачные отправки с экспоненциальной паузой.
+Статус заявки — GET /notifications/{id}.
+
+Соединения общие на весь процесс: письма (ключи и служебные) идут через
+одно SMTP-соединение, Telegram — через keep-alive HTTP-сессию. Ключ
+отправляется сам, если его файл <OPENVPN_API_KEYS_DIR>/<имя>.ovpn есть
+на диске; иначе — функциями бота key_to_tg/key_to_email, как раньше.
+Заглушки SMTP и Telegram для проверок — benchmarks/fake_endpoints.py.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+
+from api.services.bulk import fetch_keys
+from api.services.settings_cache import get_settings
+from api.services.lazy import lazy
+
+key_to_tg, key_to_email = lazy("functions.other", "key_to_tg", "key_to_email")
+
+BATCH_SIZE = 50
+MAX_QUEUE = 100000
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+MAX_TICKETS = 1000
+# Простаивающее дольше SMTP-соединение открывается заново
+SMTP_IDLE = 60.0
+# Без STARTTLS допускается только локальный SMTP (ретранслятор или заглушка)
+LOCAL_SMTP_HOSTS = ("127.0.0.1", "::1", "localhost")
+TELEGRAM_URL = os.environ.get("OPENVPN_API_TELEGRAM_URL", "https://api.telegram.org")
+TELEGRAM_TIMEOUT = 30.0
+KEYS_DIR = os.environ.get("OPENVPN_API_KEYS_DIR", "/lib/openvpn/keys")
+
+
+class NotificationQueueFull(Exception):
+    pass
+
+
+class Ticket:
+    """Заявка на отправку одного или нескольких ключей"""
+
+    def __init__(self, channel, total):
+        self.id = uuid.uuid4().hex
+        self.channel = channel
+        self.total = total
+        self.sent = 0
+        self.failed = {}
+        self.attempts = 0
+        self.created = datetime.now()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def _settle(self, key_id, error=None):
+        with self._lock:
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed[key_id] = error
+            if self.sent + len(self.failed) >= self.total:
+                self.finished = datetime.now()
+
+    def to_dict(self):
+        with self._lock:
+            if self.finished is None:
+                status = "queued"
+            else:
+                status = "failed" if self.failed and not self.sent else "done"
+            return {
+                "id": self.id,
+                "channel": self.channel,
+                "status": status,
+                "total": self.total,
+                "sent": self.sent,
+                "failed": {str(k): v for k, v in self.failed.items()},
+                "attempts": self.attempts,
+                "created": self.created,
+                "finished": self.finished,
+            }
+
+
+class RateLimiter:
+    """Token bucket: rate отправок в секунду, всплеск до burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        # Лимитер может быть общим для нескольких каналов (потоков)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Служебные письма владельцу ключа: канал -> (тема, текст)
+NOTICE_MESSAGES = {
+    "expiry_week": ("Ключ VPN истекает через неделю", "Срок действия ключа {name} истекает {expired}."),
+    "expiry_day": ("Ключ VPN истекает завтра", "Срок действия ключа {name} истекает {expired}."),
+    "expired": ("Ключ VPN истёк", "Срок действия ключа {name} истёк {expired}, ключ заблокирован."),
+    "traffic_limit": ("Лимит трафика VPN исчерпан", "Ключ {name} израсходовал лимит трафика и заблокирован."),
+}
+
+
+class SmtpSession:
+    """
+    Общее SMTP-соединение для писем: открывается при первой
+    отправке и переиспользуется, пока не сменятся настройки почты или
+    не пройдёт SMTP_IDLE секунд простоя (сервер к тому времени обычно
+    сам закрывает соединение). Оборванное соединение открывается заново
+    один раз на письмо.
+    """
+
+    def __init__(self):
+        self._smtp = None
+        self._params = None
+        self._used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self, settings):
+        # Почтовые модули нужны только отправителю — не при импорте API
+        import smtplib
+
+        port = settings.mail_port or 465
+        smtp_class = smtplib.SMTP_SSL if port == 465 else smtplib.SMTP
+        smtp = smtp_class(settings.mail_host, port, timeout=30)
+        try:
+            if smtp_class is smtplib.SMTP:
+                smtp.ehlo()
+                if smtp.has_extn("starttls"):
+                    smtp.starttls()
+                    smtp.ehlo()
+                elif settings.mail_host not in LOCAL_SMTP_HOSTS:
+                    raise smtplib.SMTPNotSupportedError("SMTP server does not offer STARTTLS")
+            if settings.mail_login:
+                smtp.login(settings.mail_login, settings.mail_password)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    def _close(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+
+    def send(self, settings, message):
+        import smtplib
+
+        params = (settings.mail_host, settings.mail_port, settings.mail_login, settings.mail_password)
+        with self._lock:
+            if self._smtp is not None and (self._params != params or time.monotonic() - self._used > SMTP_IDLE):
+                self._close()
+            for attempt in (0, 1):
+                if self._smtp is None:
+                    self._smtp = self._connect(settings)
+                    self._params = params
+                try:
+                    self._smtp.send_message(message)
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    self._close()
+                    if attempt:
+                        raise
+                else:
+                    self._used = time.monotonic()
+                    return
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class TelegramSession:
+    """Keep-alive HTTP-сессия с Bot API: одно соединение на все отправки канала"""
+
+    def __init__(self, url=None):
+        self.url = url
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _http(self):
+        # httpx нужен только отправителю — не при импорте API
+        import httpx
+
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(base_url=self.url or TELEGRAM_URL, timeout=TELEGRAM_TIMEOUT)
+            return self._client
+
+    def call(self, token, method, data=None, files=None):
+        """Вызов метода Bot API; RuntimeError с описанием, если Telegram ответил ok=false"""
+        response = self._http().post("/bot%s/%s" % (token, method), data=data, files=files)
+        try:
+            body = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise RuntimeError("Telegram returned a non-JSON response")
+        if not body.get("ok"):
+            raise RuntimeError(body.get("description") or "Telegram error %d" % response.status_code)
+        return body.get("result")
+
+    def close(self):
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+
+def _key_document(key):
+    """Файл ключа (.ovpn) с диска или None, если его там нет"""
+    path = os.path.join(KEYS_DIR, "%s.ovpn" % key.name)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def send_key_tg(key, settings, session):
+    """Ключ в чат бота через общую сессию; без файла ключа — функцией бота"""
+    document = _key_document(key)
+    if document is None:
+        return key_to_tg(key, settings)
+    if not settings.bot_token or not settings.bot_chat_id:
+        raise RuntimeError("Telegram bot is not configured")
+    session.call(
+        settings.bot_token, "sendDocument", data={"chat_id": settings.bot_chat_id, "caption": key.name},
+        files={"document": ("%s.ovpn" % key.name, document)},
+    )
+
+
+def send_key_mail(key, settings, session):
+    """Ключ на email владельца через общее SMTP-соединение; без файла ключа — функцией бота"""
+    from email.message import EmailMessage
+
+    document = _key_document(key)
+    if document is None:
+        return key_to_email(key, settings)
+    if not settings.use_mail or not settings.mail_host:
+        raise RuntimeError("Mail is disabled in settings")
+    if not key.email:
+        raise RuntimeError("Key has no email")
+    message = EmailMessage()
+    message["Subject"] = settings.subject or ""
+    message["From"] = settings.mail_login
+    message["To"] = key.email
+    message.set_content(settings.text or "")
+    message.add_attachment(document, maintype="application", subtype="x-openvpn-profile",
+                           filename="%s.ovpn" % key.name)
+    session.send(settings, message)
+
+
+def send_notice_mail(key, settings, kind, session):
+    """Служебное письмо (срок действия, лимит трафика) на email владельца ключа через общее соединение"""
+    from email.message import EmailMessage
+
+    if not settings.use_mail or not settings.mail_host:
+        raise RuntimeError("Mail is disabled in settings")
+    if not key.email:
+        raise RuntimeError("Key has no email")
+    subject, text = NOTICE_MESSAGES[kind]
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = settings.mail_login
+    message["To"] = key.email
+    message.set_content(text.format(name=key.name, expired=key.expired))
+    session.send(settings, message)
+
+
+class Channel:
+    """Канал доставки с отложенной очередью и своим потоком-отправителем"""
+
+    def __init__(self, name, send, rate=None, burst=None, limiter=None):
+        self.name = name
+        self.send = send
+        self.limiter = limiter or RateLimiter(rate, burst)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def put(self, ticket, key_id, attempt=0, delay=0.0):
+        with self._cond:
+            if len(self._heap) >= MAX_QUEUE:
+                raise NotificationQueueFull("Notification queue is full")
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), ticket, key_id, attempt))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="notify-" + self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    batch = []
+                    while self._heap and self._heap[0][0] <= now and len(batch) < BATCH_SIZE:
+                        batch.append(heapq.heappop(self._heap))
+                    return batch
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _deliver(self, batch):
+        settings = get_settings()
+        keys = fetch_keys(list({item[3] for item in batch}))
+        for _, _, ticket, key_id, attempt in batch:
+            key = keys.get(key_id)
+            if key is None:
+                ticket._settle(key_id, "Key not found")
+                continue
+            self.limiter.acquire()
+            ticket.attempts += 1
+            try:
+                self.send(key, settings)
+            except Exception as e:
+                if attempt + 1 < MAX_ATTEMPTS:
+                    self.put(ticket, key_id, attempt + 1, min(BACKOFF_MAX, BACKOFF_BASE ** (attempt + 1)))
+                else:
+                    ticket._settle(key_id, str(e) or e.__class__.__name__)
+            else:
+                ticket._settle(key_id)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._deliver(batch)
+            except Exception as e:
+                # Не удалось даже прочитать настройки/ключи — вся пачка на повтор
+                for _, _, ticket, key_id, attempt in batch:
+                    if attempt + 1 < MAX_ATTEMPTS:
+                        self.put(ticket, key_id, attempt + 1, min(BACKOFF_MAX, BACKOFF_BASE ** (attempt + 1)))
+                    else:
+                        ticket._settle(key_id, str(e) or e.__class__.__name__)
+
+
+class Dispatcher:
+    def __init__(self):
+        self.smtp = SmtpSession()
+        self.telegram = TelegramSession()
+        # Telegram ограничивает сообщения в один чат ~1/сек
+        self.channels = {
+            "tg": Channel("tg", partial(send_key_tg, session=self.telegram), rate=1.0, burst=3),
+            "mail": Channel("mail", partial(send_key_mail, session=self.smtp), rate=5.0, burst=10),
+        }
+        # Служебные письма идут через тот же SMTP, делят лимит почты и одно соединение
+        mail_limiter = self.channels["mail"].limiter
+        for kind in NOTICE_MESSAGES:
+            self.channels[kind] = Channel(
+                kind, partial(send_notice_mail, kind=kind, session=self.smtp), limiter=mail_limiter
+            )
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enqueue(self, channel, key_ids):
+        """Поставить отправку ключей в очередь канала; вернуть заявку"""
+        key_ids = list(dict.fromkeys(key_ids))
+        target = self.channels[channel]
+        if target.pending() + len(key_ids) > MAX_QUEUE:
+            raise NotificationQueueFull("Notification queue is full")
+        ticket = Ticket(channel, len(key_ids))
+        if not key_ids:
+            ticket.finished = datetime.now()
+        with self._lock:
+            self._tickets[ticket.id] = ticket
+            while len(self._tickets) > MAX_TICKETS:
+                self._tickets.popitem(last=False)
+        for key_id in key_ids:
+            target.put(ticket, key_id)
+        return ticket
+
+    def get(self, ticket_id):
+        return self._tickets.get(ticket_id)
+
+
+dispatcher = Dispatcher()
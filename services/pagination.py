@@ -0,0 +1,82 @@
+"""
+Курсорная (keyset) пагинация.
+
+Курсор непрозрачен для клиента: base64 от JSON с областью запроса
+(критерий и значение фильтра) и ключом сортировки последней выданной
+записи. Следующая страница ищется бинарным поиском сразу после этого
+ключа, поэтому вставки и удаления до него не дают пропусков и повторов,
+как при offset. Если ключ сортировки неизвестен, якорем служит ID записи.
+"""
+import base64
+import json
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Разобрать курсор; ValueError при мусоре на входе"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(data, dict):
+        raise ValueError("Invalid cursor")
+    return data
+
+
+def row_id(row):
+    return row["id"] if isinstance(row, dict) else row.id
+
+
+def _resume(rows, pos, last_id):
+    # Быстрый путь: порядок до курсора не сдвинулся
+    if 0 < pos <= len(rows) and row_id(rows[pos - 1]) == last_id:
+        return pos
+    for i, row in enumerate(rows):
+        if row_id(row) == last_id:
+            return i + 1
+    # Ключ-якорь удалён — продолжаем с прежней позиции
+    return min(pos, len(rows))
+
+
+def _seek(rows, sort_key, after_key):
+    # Первая запись с ключом сортировки строго больше курсора
+    lo, hi = 0, len(rows)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if list(sort_key(rows[mid])) <= after_key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def keyset_page(rows, scope, after=None, limit=None, sort_key=None):
+    """
+    Вырезать страницу из упорядоченного списка.
+    sort_key — функция ключа, по которому rows отсортированы (если известна).
+    Возвращает (страница, курсор следующей страницы или None).
+    """
+    start = 0
+    if after is not None:
+        cursor = decode_cursor(after)
+        if cursor.get("scope") != scope:
+            raise ValueError("Cursor belongs to another query")
+        if sort_key is not None and "key" in cursor:
+            start = _seek(rows, sort_key, cursor["key"])
+        else:
+            start = _resume(rows, int(cursor.get("pos", 0)), cursor.get("id"))
+    end = len(rows) if limit is None else min(start + limit, len(rows))
+    page = rows[start:end]
+    next_cursor = None
+    if limit is not None and end < len(rows):
+        last = rows[end - 1]
+        data = {"scope": scope, "pos": end, "id": row_id(last)}
+        if sort_key is not None:
+            data["key"] = list(sort_key(last))
+        next_cursor = encode_cursor(data)
+    return page, next_cursor
\ No newline at end of file
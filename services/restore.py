@@ -0,0 +1,166 @@
+"""
+Потоковое восстановление из загруженного бэкапа.
+
+Загрузка принимается кусками и сразу проверяется, не накапливаясь
+в памяти: архив скрипта openvpn.sh пишется во временный файл с проверкой
+целостности gzip-потока, затем атомарно переименовывается и передаётся
+в openvpn.sh --restore через service_control (под той же блокировкой
+юнита, что и остальные вызовы скрипта).
+
+Нативный бэкап API (gzip NDJSON, см. services/backup.py) распознаётся
+по JSON-заголовку в первой строке и отклоняется сразу: в слое данных
+бота нет записи ключей, конфигов и сессий с исходными ID, поэтому
+применить его к рабочей базе нельзя.
+
+Маршрут только перекачивает куски в ограниченную очередь, а разбор
+идёт в фоновой задаче, так что в памяти не больше QUEUE_CHUNKS кусков,
+и медленный разбор притормаживает загрузку, а не копит её.
+"""
+import asyncio
+import json
+import os
+import queue
+import zlib
+
+from api.services import changes, storage
+from api.services.backup import FORMAT
+from api.services.jobs import job_manager
+from api.services.service_control import service_control, ServiceError
+
+QUEUE_CHUNKS = 16
+SNIFF_SIZE = 1024
+SCRIPT_TIMEOUT = 1800
+
+
+class RestoreError(Exception):
+    pass
+
+
+class ScriptArchiveLoader:
+    """Архив openvpn.sh: на диск с проверкой целостности gzip"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._check = zlib.decompressobj(31)
+        self._open = False
+
+    def feed(self, chunk):
+        self._file.write(chunk)
+        # Несколько gzip-членов подряд тоже допустимы
+        data = chunk
+        while data:
+            self._check.decompress(data)
+            self._open = True
+            data = self._check.unused_data
+            if self._check.eof:
+                self._check = zlib.decompressobj(31)
+                self._open = False
+
+    def finish(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if self._open:
+            raise RestoreError("Truncated archive")
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _is_native(head):
+    try:
+        data = zlib.decompressobj(31).decompress(head, 4096)
+    except zlib.error:
+        raise RestoreError("Upload is not a gzip stream")
+    try:
+        first = json.loads(data.split(b"\n", 1)[0])
+    except ValueError:
+        return False
+    return isinstance(first, dict) and first.get("type") == "header" and first.get("format") == FORMAT
+
+
+def _sniff(chunks):
+    """Собрать первые SNIFF_SIZE байт для определения формата, не теряя кусков"""
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= SNIFF_SIZE:
+            break
+    return b"".join(head)
+
+
+def restore_stream(job, chunks, loop):
+    """
+    Фоновая задача восстановления; chunks — итератор кусков загрузки,
+    loop — цикл событий приложения (в нём работает service_control).
+    Прогресс — в принятых байтах.
+    """
+    chunks = iter(chunks)
+    head = _sniff(chunks)
+    if not head:
+        raise RestoreError("Empty upload")
+    if head[:2] != b"\x1f\x8b":
+        raise RestoreError("Upload is not a gzip stream")
+    if _is_native(head):
+        raise RestoreError(
+            "Native API backups cannot be applied: the data layer has no import for keys, configs and sessions. "
+            "Restore an openvpn.sh archive (POST /system/export_db) instead"
+        )
+    staging = storage.data_path("restore", "%s.part" % job.id)
+    loader = ScriptArchiveLoader(staging)
+    try:
+        loader.feed(head)
+        job.advance(len(head))
+        for chunk in chunks:
+            loader.feed(chunk)
+            job.advance(len(chunk))
+        loader.finish()
+    except zlib.error as e:
+        loader.abort()
+        raise RestoreError("Corrupted gzip stream: %s" % e)
+    except Exception:
+        loader.abort()
+        raise
+
+    target = storage.data_path("restore", "%s.backup" % job.id)
+    os.replace(staging, target)
+    command = service_control.run(
+        ["bash", "bash/openvpn.sh", "--restore", target], unit="openvpn.sh", timeout=SCRIPT_TIMEOUT
+    )
+    try:
+        asyncio.run_coroutine_threadsafe(command, loop).result()
+    except ServiceError as e:
+        raise RestoreError(str(e))
+    finally:
+        changes.bump(*changes.TABLES)
+    return {"format": "openvpn.sh", "status": "restored", "restored": target}
+
+
+class RestoreUpload:
+    """Связка маршрута и фоновой задачи: ограниченная очередь кусков"""
+
+    def __init__(self, total=0):
+        self._queue = queue.Queue(maxsize=QUEUE_CHUNKS)
+        # Создаётся в маршруте, то есть в цикле событий приложения
+        loop = asyncio.get_event_loop()
+        self.job = job_manager.submit(
+            "system.restore", total, lambda job: restore_stream(job, iter(self._queue.get, None), loop)
+        )
+
+    def put(self, chunk):
+        """Блокирующая передача куска; False — задача уже завершилась и больше не читает"""
+        while True:
+            try:
+                self._queue.put(chunk, timeout=1.0)
+                return True
+            except queue.Full:
+                if self.job.finished is not None:
+                    return False
+
+    def close(self):
+        self.put(None)
\ No newline at end of file
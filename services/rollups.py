@@ -0,0 +1,447 @@
+"""
+Почасовые и посуточные роллапы трафика по ключам и конфигам.
+
+Каждая закрытая сессия добавляет свои байты, время и +1 сессию в
+корзину часа и суток, в которые она завершилась. Запросы за период
+читают только корзины — O(число корзин), а не O(число сессий).
+
+Источник истины — таблица сессий бота. Основной воркер при первом
+старте засевает корзины и итоги целиком (архив плюс живые сессии) и
+дальше раз в SYNC_INTERVAL дочитывает только сессии с ID больше
+последнего учтённого — одним запросом через модель peewee
+(session_archive.session_model), без обхода всех ключей. Открытые на
+момент чтения сессии запоминаются и учитываются, когда закроются.
+
+Между проходами закрытия из management-интерфейса (клиент пропал из
+status между опросами) попадают в корзины сразу. Такая сессия
+запоминается в recent по ключу и времени подключения; когда та же
+сессия приходит из таблицы, вклад management-записи заменяется точными
+цифрами, а не складывается с ними (и наоборот — уже учтённая из таблицы
+сессия management-записью не дублируется).
+
+Та же запись пополняет итоги по ключам (key_totals: трафик, сессии,
+время за всё время) — из них читаются агрегаты для сортировки ключей
+(key_index.key_aggregates) одним запросом. rebuild() засевает всё
+заново.
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from api.services import changes, storage
+from api.services.key_index import key_index
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {"hour": 3600, "day": 86400}
+FLUSH_BATCH = 500
+SYNC_INTERVAL = 60.0
+# Сессий за один запрос к таблице бота
+SYNC_CHUNK = 1000
+# Расхождение времени подключения у management и таблицы бота, секунд
+MATCH_SLACK = 5
+# Сколько держать сессии для сверки источников, секунд
+RECENT_KEEP = 86400
+WRITE_RETRY = 1.0
+WRITE_RETRY_MAX = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS traffic_{name} (
+    bucket INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    config_id INTEGER NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    seconds INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, key_id)
+);
+CREATE INDEX IF NOT EXISTS traffic_{name}_key ON traffic_{name} (key_id, bucket);
+CREATE INDEX IF NOT EXISTS traffic_{name}_config ON traffic_{name} (config_id, bucket);
+"""
+
+_TOTALS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS key_totals (
+    key_id INTEGER PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    seconds INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0
+);
+DROP TABLE IF EXISTS key_totals_seeded;
+CREATE TABLE IF NOT EXISTS seed_state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    last_id INTEGER NOT NULL,
+    seeded INTEGER
+);
+CREATE TABLE IF NOT EXISTS open_sessions (
+    id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS recent (
+    key_id INTEGER NOT NULL,
+    connected INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    config_id INTEGER NOT NULL,
+    ended INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    seconds INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recent_key ON recent (key_id, connected);
+"""
+
+_TOTALS_UPSERT = """
+INSERT INTO key_totals (key_id, bytes, seconds, sessions)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (key_id) DO UPDATE SET
+    bytes = bytes + excluded.bytes,
+    seconds = seconds + excluded.seconds,
+    sessions = sessions + excluded.sessions
+"""
+
+_UPSERT = """
+INSERT INTO traffic_{name} (bucket, key_id, config_id, bytes, seconds, sessions)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (bucket, key_id) DO UPDATE SET
+    bytes = bytes + excluded.bytes,
+    seconds = seconds + excluded.seconds,
+    sessions = sessions + excluded.sessions,
+    config_id = excluded.config_id
+"""
+
+
+def _bucket(moment, size):
+    ts = int(moment.timestamp())
+    # Сутки считаются по локальному времени сервера, как и даты сессий
+    offset = int((datetime.fromtimestamp(ts) - datetime.utcfromtimestamp(ts)).total_seconds())
+    return ts - (ts + offset) % size
+
+
+def _add(db, rows):
+    """rows: (key_id, config_id, disconnected, bytes, seconds, sessions); отрицательные — снять вклад"""
+    for name, size in GRANULARITIES.items():
+        db.executemany(_UPSERT.format(name=name), [
+            (_bucket(ended, size), key_id, config_id, total, seconds, sessions)
+            for key_id, config_id, ended, total, seconds, sessions in rows
+        ])
+    db.executemany(_TOTALS_UPSERT, [
+        (key_id, total, seconds, sessions) for key_id, _, _, total, seconds, sessions in rows
+    ])
+
+
+def _reconcile(db, source, closed):
+    """
+    Строки для корзин из закрытых сессий source ("live" — management,
+    "db" — таблица бота) с учётом уже записанного другим источником.
+    closed: (key_id, config_id, connected, disconnected, bytes, seconds).
+    """
+    other = "db" if source == "live" else "live"
+    rows = []
+    for key_id, config_id, connected, ended, total, seconds in closed:
+        if connected is None:
+            # Без времени подключения сессию не сверить: её учтёт таблица бота
+            if source == "db":
+                rows.append((key_id, config_id, ended, total, seconds, 1))
+            continue
+        moment = int(connected.timestamp())
+        match = db.execute(
+            "SELECT rowid, config_id, ended, bytes, seconds FROM recent "
+            "WHERE key_id = ? AND connected BETWEEN ? AND ? AND source = ? LIMIT 1",
+            (key_id, moment - MATCH_SLACK, moment + MATCH_SLACK, other)
+        ).fetchone()
+        if match is not None:
+            db.execute("DELETE FROM recent WHERE rowid = ?", (match["rowid"],))
+            if source == "live":
+                # Уже учтена из таблицы бота — точнее
+                continue
+            rows.append((key_id, match["config_id"], datetime.fromtimestamp(match["ended"]),
+                         -match["bytes"], -match["seconds"], -1))
+        else:
+            db.execute(
+                "INSERT INTO recent (key_id, connected, source, config_id, ended, bytes, seconds) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key_id, moment, source, config_id, int(ended.timestamp()), total, seconds)
+            )
+        rows.append((key_id, config_id, ended, total, seconds, 1))
+    return rows
+
+
+def _closed(index, sessions):
+    """Закрытые сессии таблицы бота для _reconcile и ID ещё открытых"""
+    closed, still_open = [], []
+    for s in sessions:
+        if s.disconnected is None:
+            still_open.append(s.id)
+            continue
+        key = index.by_id.get(s.key_id)
+        if key is None:
+            continue
+        closed.append((key.id, key.config_id, s.connected, s.disconnected,
+                       s.total_bytes or 0, s.total_connected_time or 0))
+    return closed, still_open
+
+
+class TrafficRollups:
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+        # Один проход по таблице сессий за раз
+        self._sync_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._seeder = None
+
+    def _db(self):
+        if self._conn is None:
+            conn = storage.connect("traffic")
+            for name in GRANULARITIES:
+                conn.executescript(_SCHEMA.format(name=name))
+            conn.executescript(_TOTALS_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _state(self):
+        with self._lock:
+            row = self._db().execute("SELECT last_id, seeded FROM seed_state").fetchone()
+        return (row["last_id"], row["seeded"]) if row else (0, None)
+
+    def record(self, common_name, config_id, connected, disconnected, total_bytes):
+        """Поставить закрытую сессию в очередь на запись"""
+        self._queue.put((common_name, config_id, connected, disconnected, total_bytes))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rollups", daemon=True)
+            self._thread.start()
+
+    def on_closed(self, config_id, clients):
+        """Подписчик management_pool: клиенты, отключившиеся с прошлого опроса"""
+        now = datetime.now()
+        for c in clients:
+            self.record(c["common_name"], config_id, c["connected_since"], now,
+                        c["bytes_received"] + c["bytes_sent"])
+
+    def _run(self):
+        retry, delay = [], WRITE_RETRY
+        while True:
+            items = retry or [self._queue.get()]
+            while len(items) < FLUSH_BATCH:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._flush(items)
+                retry, delay = [], WRITE_RETRY
+            except Exception:
+                # БД заблокирована, диск полон: пачка пишется заново, поток живёт дальше
+                logger.exception("traffic rollups write failed, %d sessions kept for retry", len(items))
+                retry = items
+                time.sleep(delay)
+                delay = min(delay * 2, WRITE_RETRY_MAX)
+
+    def _flush(self, items):
+        index = key_index.get()
+        closed = []
+        for common_name, config_id, connected, disconnected, total_bytes in items:
+            keys = index.by_name.get(common_name)
+            if not keys:
+                continue
+            seconds = int((disconnected - connected).total_seconds()) if connected else 0
+            closed.append((keys[0].id, config_id, connected, disconnected, total_bytes, max(0, seconds)))
+        if not closed:
+            return
+        with self._lock:
+            db = self._db()
+            with db:
+                rows = _reconcile(db, "live", closed)
+                _add(db, rows)
+        if rows:
+            changes.bump(changes.TRAFFIC)
+
+    def sync(self):
+        """Засеять роллапы, если ещё не засеяны, иначе дочитать новые сессии"""
+        if self._state()[1] is None:
+            from api.services.session_archive import session_archive
+
+            # Засев читает архив и живую таблицу — компакция между ними потеряла бы сессии
+            with session_archive.exclusive(), self._sync_lock:
+                if self._state()[1] is None:
+                    return self._seed()
+        return self.catch_up()
+
+    def catch_up(self):
+        """Дочитать сессии после последнего учтённого ID; до засева — ничего"""
+        with self._sync_lock:
+            last_id, seeded = self._state()
+            if seeded is None:
+                return 0
+            return self._ingest(last_id)
+
+    def _seed(self, job=None):
+        from api.services.session_archive import session_archive
+
+        with self._lock:
+            db = self._db()
+            with db:
+                for name in GRANULARITIES:
+                    db.execute("DELETE FROM traffic_%s" % name)
+                for table in ("key_totals", "seed_state", "open_sessions", "recent"):
+                    db.execute("DELETE FROM %s" % table)
+        index = key_index.get()
+        rows = []
+        for record in session_archive.all_records():
+            key = index.by_id.get(record["key_id"])
+            moment = record["disconnected"] or record["connected"]
+            if key is None or moment is None:
+                continue
+            rows.append((key.id, key.config_id, datetime.fromisoformat(moment),
+                         record["total_bytes"], record["total_connected_time"], 1))
+            if len(rows) >= SYNC_CHUNK:
+                self._apply(rows)
+                rows = []
+        if rows:
+            self._apply(rows)
+        count = self._ingest(0, job)
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("UPDATE seed_state SET seeded = ?", (int(time.time()),))
+                db.execute("INSERT OR IGNORE INTO seed_state (id, last_id, seeded) VALUES (0, 0, ?)",
+                           (int(time.time()),))
+        changes.bump(changes.TRAFFIC)
+        return count
+
+    def _apply(self, rows):
+        with self._lock:
+            db = self._db()
+            with db:
+                _add(db, rows)
+
+    def _ingest(self, last_id, job=None):
+        """Сессии с ID больше last_id и закрывшиеся из запомненных открытых"""
+        from api.services.session_archive import session_model
+
+        model = session_model()
+        if model is None:
+            return 0
+        index = key_index.get()
+        count = 0
+        while True:
+            chunk = list(model.select().where(model.id > last_id).order_by(model.id).limit(SYNC_CHUNK))
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            closed, still_open = _closed(index, chunk)
+            with self._lock:
+                db = self._db()
+                with db:
+                    _add(db, _reconcile(db, "db", closed))
+                    db.executemany("INSERT OR IGNORE INTO open_sessions (id) VALUES (?)",
+                                   [(i,) for i in still_open])
+                    db.execute("INSERT INTO seed_state (id, last_id) VALUES (0, ?) "
+                               "ON CONFLICT (id) DO UPDATE SET last_id = excluded.last_id", (last_id,))
+            count += len(closed)
+            if job is not None:
+                job.advance(len(chunk))
+        with self._lock:
+            waiting = [r["id"] for r in self._db().execute("SELECT id FROM open_sessions")]
+        for start in range(0, len(waiting), SYNC_CHUNK):
+            ids = waiting[start:start + SYNC_CHUNK]
+            found = list(model.select().where(model.id.in_(ids)))
+            closed, still_open = _closed(index, found)
+            # Удалённые из таблицы и закрывшиеся больше не ждут
+            done = set(ids) - set(still_open)
+            with self._lock:
+                db = self._db()
+                with db:
+                    _add(db, _reconcile(db, "db", closed))
+                    db.executemany("DELETE FROM open_sessions WHERE id = ?", [(i,) for i in done])
+            count += len(closed)
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("DELETE FROM recent WHERE ended < ?", (int(time.time()) - RECENT_KEEP,))
+        if count:
+            changes.bump(changes.TRAFFIC)
+        return count
+
+    def rebuild(self, job=None):
+        """Засеять роллапы заново: архив и вся таблица сессий"""
+        from api.services.session_archive import session_archive
+
+        with session_archive.exclusive(), self._sync_lock:
+            return {"sessions": self._seed(job)}
+
+    def total_bytes(self):
+        """Трафик всех ключей за всё время — из итогов; None, пока роллапы не засеяны"""
+        with self._lock:
+            db = self._db()
+            if db.execute("SELECT seeded FROM seed_state WHERE seeded IS NOT NULL").fetchone() is None:
+                return None
+            return db.execute("SELECT COALESCE(SUM(bytes), 0) FROM key_totals").fetchone()[0]
+
+    def key_totals(self):
+        """Итоги по ключам: ({key_id: (bytes, sessions, seconds)}, роллапы уже засеяны)"""
+        with self._lock:
+            db = self._db()
+            rows = db.execute("SELECT key_id, bytes, seconds, sessions FROM key_totals").fetchall()
+            seeded = db.execute("SELECT seeded FROM seed_state WHERE seeded IS NOT NULL").fetchone() is not None
+        return {r["key_id"]: (r["bytes"], r["sessions"], r["seconds"]) for r in rows}, seeded
+
+    def reset_key(self, key_id):
+        """Обнулить итоги ключа (очистка трафика, удаление)"""
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("DELETE FROM key_totals WHERE key_id = ?", (key_id,))
+                db.execute("DELETE FROM recent WHERE key_id = ?", (key_id,))
+        changes.bump(changes.TRAFFIC)
+
+    def start(self, interval=SYNC_INTERVAL):
+        """Фоновый засев при старте и дочитывание новых сессий раз в interval"""
+        if self._seeder is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except Exception:
+                    logger.exception("traffic rollups sync failed")
+                time.sleep(interval)
+
+        self._seeder = threading.Thread(target=run, name="rollups-seed", daemon=True)
+        self._seeder.start()
+
+    def series(self, start, end, granularity="day", config_id=None, key_id=None):
+        """Трафик по корзинам за [start, end)"""
+        size = GRANULARITIES[granularity]
+        where = ["bucket >= ?", "bucket < ?"]
+        args = [_bucket(start, size), int(end.timestamp())]
+        if config_id is not None:
+            where.append("config_id = ?")
+            args.append(config_id)
+        if key_id is not None:
+            where.append("key_id = ?")
+            args.append(key_id)
+        sql = (
+            "SELECT bucket, SUM(bytes) AS bytes, SUM(seconds) AS seconds, SUM(sessions) AS sessions "
+            "FROM traffic_%s WHERE %s GROUP BY bucket ORDER BY bucket" % (granularity, " AND ".join(where))
+        )
+        with self._lock:
+            rows = self._db().execute(sql, args).fetchall()
+        return [
+            {
+                "bucket": datetime.fromtimestamp(r["bucket"]),
+                "bytes": r["bytes"],
+                "seconds": r["seconds"],
+                "sessions": r["sessions"],
+            }
+            for r in rows
+        ]
+
+
+def default_range(granularity):
+    end = datetime.now()
+    return end - timedelta(days=2 if granularity == "hour" else 30), end
+
+
+traffic_rollups = TrafficRollups()
@@ -0,0 +1,122 @@
+"""
+Быстрая сериализация ответов.
+
+Для модели ответа один раз собирается функция, которая переносит поля
+из ORM-объекта (или dict) в словарь одним выражением — без from_orm,
+проверки pydantic и jsonable_encoder на каждую строку. Типы полей
+берутся из данных бота как есть, модель задаёт только набор полей.
+Готовый ответ кодируется сразу в bytes: orjson, если он установлен,
+иначе стандартный json.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi import Response
+
+from api.models import ConfigOut, KeyOut, SessionOut
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_BATCH = 500
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError("Type is not JSON serializable: %s" % value.__class__.__name__)
+
+
+if orjson is not None:
+    def dumps(data):
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(data):
+        return json.dumps(data, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON-ответ, закодированный dumps() прямо в bytes"""
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+
+def _compile(fields, text_fields, by_item):
+    parts = []
+    for name in fields:
+        value = "o[%r]" % name if by_item else "o.%s" % name
+        if name in text_fields:
+            value = "_text(%s)" % value
+        parts.append("%r: %s" % (name, value))
+    namespace = {"_text": str}
+    exec("def dump(o):\n    return {%s}\n" % ", ".join(parts), namespace)
+    return namespace["dump"]
+
+
+class Serializer:
+    """
+    Сериализатор модели ответа.
+    fields — подмножество полей модели (по умолчанию все),
+    text_datetimes — даты строкой через str(), как в старых ответах API.
+    """
+
+    def __init__(self, model, fields=None, text_datetimes=False):
+        self.model = model
+        self.fields = tuple(fields or model.__fields__)
+        text_fields = set()
+        if text_datetimes:
+            text_fields = {
+                name for name in self.fields
+                if model.__fields__[name].type_ in (datetime, date)
+            }
+        self._by_attr = _compile(self.fields, text_fields, by_item=False)
+        self._by_item = _compile(self.fields, text_fields, by_item=True)
+
+    def dump(self, obj):
+        return self._by_item(obj) if type(obj) is dict else self._by_attr(obj)
+
+    def dump_many(self, rows):
+        by_attr, by_item = self._by_attr, self._by_item
+        return [by_item(o) if type(o) is dict else by_attr(o) for o in rows]
+
+    def response(self, rows, **kwargs):
+        return FastJSONResponse(self.dump_many(rows), **kwargs)
+
+    def response_one(self, obj, **kwargs):
+        return FastJSONResponse(self.dump(obj), **kwargs)
+
+    def ndjson(self, rows):
+        """Строки NDJSON пачками по NDJSON_BATCH записей"""
+        batch = []
+        for row in rows:
+            batch.append(dumps(self.dump(row)))
+            if len(batch) >= NDJSON_BATCH:
+                yield b"\n".join(batch) + b"\n"
+                batch = []
+        if batch:
+            yield b"\n".join(batch) + b"\n"
+
+
+config_serializer = Serializer(
+    ConfigOut,
+    fields=("id", "port", "protocol", "telnet_port", "address", "subnet", "status", "created", "updated"),
+    text_datetimes=True,
+)
+SESSION_FIELDS = ("id", "ip", "connected", "disconnected", "total_bytes", "total_connected_time")
+session_serializer = Serializer(SessionOut, fields=SESSION_FIELDS, text_datetimes=True)
+# Для /keys/{id}/sessions — даты в ISO, как отдавал FastAPI
+session_row_serializer = Serializer(SessionOut, fields=SESSION_FIELDS)
+key_serializer = Serializer(KeyOut)
+
+# Полные записи для бэкапа (с key_id у сессий, даты — объектами)
+config_record = Serializer(ConfigOut)
+session_record = Serializer(SessionOut)
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+Неблокирующее управление сервисами (systemctl, служебные скрипты).
+
+Команды выполняются асинхронно с таймаутом, не занимая потоки FastAPI.
+На каждый юнит — своя блокировка (две команды одному юниту не идут
+одновременно), общее число одновременных команд ограничено.
+Обёртки server_control для конфигов синхронные и знают имена юнитов,
+поэтому они выполняются в отдельном ограниченном пуле потоков.
+
+Таймаут не освобождает юнит раньше, чем команда действительно
+завершится: процесс убивается, а поток пула прервать нельзя — юнит и
+слот остаются занятыми до конца вызова, ответ сообщает "still running",
+а следующая команда тому же юниту ждёт не дольше своего таймаута.
+Свободного слота команда ждёт в общей очереди до QUEUE_TIMEOUT: этот срок
+не входит в таймаут самой команды, поэтому пакет больше MAX_CONCURRENCY
+выполняется волнами, а не отваливается по таймауту.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api.services.metrics import observe_subprocess
+from api.services.lazy import lazy
+
+disable_config_db, enable_config_db, restart_config_db = lazy(
+    "functions.server_control", "disable_config_db", "enable_config_db", "restart_config_db"
+)
+
+UNIT_TIMEOUT = 60.0
+QUEUE_TIMEOUT = 600.0
+CANCEL_GRACE = 1.0
+MAX_CONCURRENCY = 8
+
+CONFIG_ACTIONS = {
+    "enable": enable_config_db,
+    "disable": disable_config_db,
+    "restart": restart_config_db,
+}
+
+
+class ServiceError(Exception):
+    def __init__(self, result):
+        super().__init__(result["error"])
+        self.result = result
+
+
+class ServiceController:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="svc")
+        self._locks = {}
+        self._semaphore = None
+
+    def _lock(self, unit):
+        lock = self._locks.get(unit)
+        if lock is None:
+            lock = self._locks[unit] = asyncio.Lock()
+        return lock
+
+    def _slots(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _acquire(self, unit, timeout):
+        """Блокировка юнита (ждём не дольше timeout) и слот (очередь до QUEUE_TIMEOUT)"""
+        lock, slots = self._lock(unit), self._slots()
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError("timeout after %gs: unit is busy" % timeout)
+        try:
+            await asyncio.wait_for(slots.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            lock.release()
+            raise asyncio.TimeoutError("timeout after %gs: no free slot" % QUEUE_TIMEOUT)
+        except BaseException:
+            lock.release()
+            raise
+        return lock, slots
+
+    async def _guarded(self, unit, action, work, timeout):
+        started = time.monotonic()
+        result = {"unit": unit, "action": action, "ok": False, "timeout": False, "error": None, "output": None}
+        try:
+            lock, slots = await self._acquire(unit, timeout)
+        except asyncio.TimeoutError as e:
+            result["timeout"] = True
+            result["error"] = str(e)
+            return self._finish(result, started)
+
+        def release(_=None):
+            slots.release()
+            lock.release()
+
+        task = asyncio.ensure_future(work())
+        stopping = False
+        try:
+            result["output"] = await asyncio.wait_for(asyncio.shield(task), timeout)
+            result["ok"] = True
+        except asyncio.TimeoutError:
+            stopping = task.cancel()
+            # Убитый процесс завершается сразу, поток пула — только сам
+            await asyncio.wait([task], timeout=CANCEL_GRACE)
+            result["timeout"] = True
+            result["error"] = "timeout after %gs" % timeout
+            if not task.done():
+                result["error"] += ", still running"
+        except Exception as e:
+            result["error"] = str(e) or e.__class__.__name__
+        finally:
+            if task.done():
+                release()
+            else:
+                # Юнит и слот заняты, пока работа действительно не закончится
+                if not stopping:
+                    task.cancel()
+                task.add_done_callback(release)
+        return self._finish(result, started)
+
+    def _finish(self, result, started):
+        result["duration"] = round(time.monotonic() - started, 3)
+        outcome = "ok" if result["ok"] else "timeout" if result["timeout"] else "error"
+        observe_subprocess(result["unit"], result["action"], outcome, result["duration"])
+        return result
+
+    async def run(self, args, unit=None, timeout=UNIT_TIMEOUT):
+        """Выполнить команду без shell; ServiceError при ошибке или таймауте"""
+        async def work():
+            proc = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                out, err = await proc.communicate()
+            except asyncio.CancelledError:
+                # Таймаут: зависший процесс не должен пережить запрос
+                proc.kill()
+                await proc.wait()
+                raise
+            if proc.returncode != 0:
+                raise RuntimeError(
+                    (err or out).decode("utf-8", "replace").strip()
+                    or "%s exited with code %d" % (args[0], proc.returncode)
+                )
+            return out.decode("utf-8", "replace")
+
+        result = await self._guarded(unit or " ".join(args), args[0], work, timeout)
+        if not result["ok"]:
+            raise ServiceError(result)
+        return result
+
+    async def systemctl(self, action, unit, timeout=UNIT_TIMEOUT):
+        return await self.run(["systemctl", action, unit], unit=unit, timeout=timeout)
+
+    async def config(self, config_id, action, timeout=UNIT_TIMEOUT):
+        """enable/disable/restart конфига; результат с ok/error/duration"""
+        fn = CONFIG_ACTIONS[action]
+        loop = asyncio.get_event_loop()
+
+        async def work():
+            future = loop.run_in_executor(self._executor, fn, config_id)
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Поток не прервать: задача завершится (и отпустит юнит) вместе с ним
+                await asyncio.wait([future])
+                raise
+
+        result = await self._guarded("config:%d" % config_id, action, work, timeout)
+        result["config_id"] = config_id
+        return result
+
+    async def configs(self, config_ids, action, timeout=UNIT_TIMEOUT):
+        """Выполнить действие над несколькими конфигами параллельно"""
+        return await asyncio.gather(*(self.config(i, action, timeout) for i in dict.fromkeys(config_ids)))
+
+
+service_control = ServiceController()
@@ -0,0 +1,378 @@
+"""
+Архив истории сессий.
+
+Сессии старше RETENTION_DAYS переносятся из живой таблицы в сжатые
+сегменты, которые только дописываются (data/archive/sessions-*.gz).
+Внутри сегмента сессии каждого ключа — отдельный gzip-блок, его
+смещение и длина лежат в индексе, поэтому история одного ключа читается
+без распаковки всего сегмента. Суммы по архивированным сессиям
+(трафик, время, количество) хранятся по ключам и конфигам отдельно,
+так что итоги по ключу не меняются после компакции.
+
+Компакция повторяема: у каждого ключа архивируется непрерывный по ID
+префикс старых сессий, и в той же транзакции, что и индекс блока,
+запоминается последний архивированный ID. Живые строки удаляются
+после этого одним запросом в одной транзакции, поэтому прерванная
+компакция при следующем запуске только дочищает уже архивированное,
+не записывая его повторно. Удаление идёт через модель peewee, экземпляры
+которой возвращает get_session_db (Model.delete().where(...) и
+Model._meta.database.atomic()): в слое данных бота нет вызова,
+удаляющего выбранные сессии одной транзакцией. Та же модель
+(session_model) нужна роллапам трафика — выбрать сессии с ID больше
+последнего учтённого одним запросом, а не обходом всех ключей. Перед
+компакцией роллапы дочитывают новые сессии, чтобы архивируемые строки
+не миновали их.
+
+Страница истории (session_page) не собирает её целиком: из живых сессий
+берутся только идущие после курсора, а у каждого блока архива в индексе
+лежат метки самой свежей и самой старой сессии, так что блоки целиком
+до курсора не читаются, а чтение останавливается, как только следующий
+блок уже не может попасть на страницу.
+"""
+import gzip
+import heapq
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from functions.data.session import get_session_db
+
+from api.services import changes, storage
+from api.services.key_index import key_index
+from api.services.pagination import decode_cursor, encode_cursor
+
+RETENTION_DAYS = int(os.environ.get("OPENVPN_API_SESSION_RETENTION_DAYS", "90"))
+COMPACT_INTERVAL = 24 * 3600
+# Первая компакция — вскоре после старта, а не через COMPACT_INTERVAL
+COMPACT_STARTUP_DELAY = 60.0
+# Размер списка ID в одном DELETE (предел параметров SQLite)
+DELETE_CHUNK = 500
+# Пока сессий нет, модель ищется заново не чаще раза в MODEL_PROBE_INTERVAL
+MODEL_PROBE_INTERVAL = 600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    key_id INTEGER NOT NULL,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    sessions INTEGER NOT NULL,
+    created INTEGER NOT NULL,
+    newest REAL,
+    oldest REAL
+);
+CREATE INDEX IF NOT EXISTS segments_key ON segments (key_id, created);
+CREATE TABLE IF NOT EXISTS archived (
+    key_id INTEGER PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS totals (
+    key_id INTEGER PRIMARY KEY,
+    config_id INTEGER NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    seconds INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def _dt(value):
+    return value.isoformat() if value is not None else None
+
+
+def _record(key, s):
+    return {
+        "id": s.id,
+        "key_id": key.id,
+        "ip": s.ip,
+        "connected": _dt(s.connected),
+        "disconnected": _dt(s.disconnected),
+        "total_bytes": s.total_bytes or 0,
+        "total_connected_time": s.total_connected_time or 0,
+    }
+
+
+def _row(record):
+    row = dict(record)
+    row.pop("key_id", None)
+    for field in ("connected", "disconnected"):
+        if row[field] is not None:
+            row[field] = datetime.fromisoformat(row[field])
+    return row
+
+
+def _delete(sessions):
+    """
+    Удалить сессии одной транзакцией: DELETE ... WHERE id IN (...) пачками.
+    Полагается на то, что get_session_db возвращает экземпляры модели peewee.
+    """
+    model = type(sessions[0])
+    ids = [s.id for s in sessions]
+    with model._meta.database.atomic():
+        for start in range(0, len(ids), DELETE_CHUNK):
+            model.delete().where(model.id.in_(ids[start:start + DELETE_CHUNK])).execute()
+
+
+_model = None
+_probed = None
+
+
+def session_model():
+    """
+    Модель peewee таблицы сессий — тип экземпляров get_session_db; None,
+    пока ни у одного ключа нет сессий. Обход ключей останавливается на
+    первом ключе с сессиями.
+    """
+    global _model, _probed
+    if _model is None and (_probed is None or time.monotonic() - _probed >= MODEL_PROBE_INTERVAL):
+        _probed = time.monotonic()
+        for key in key_index.get().ordered:
+            rows = get_session_db(key)
+            if rows:
+                _model = type(rows[0])
+                break
+    return _model
+
+
+def session_sort_key(row):
+    """Сначала свежие: (−время подключения, −id)"""
+    connected = row["connected"]
+    return (-(connected.timestamp() if connected else 0), -row["id"])
+
+
+def _moment(value):
+    return value.timestamp() if value is not None else 0
+
+
+def live_row(s):
+    return {
+        "id": s.id,
+        "ip": s.ip,
+        "connected": s.connected,
+        "disconnected": s.disconnected,
+        "total_bytes": s.total_bytes,
+        "total_connected_time": s.total_connected_time,
+    }
+
+
+class SessionArchive:
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self._timer = None
+
+    def _db(self):
+        if self._conn is None:
+            conn = storage.connect("archive")
+            conn.executescript(_SCHEMA)
+            # Индекс архива прежних версий — без меток свежести блоков
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(segments)")}
+            with conn:
+                for column in ("newest", "oldest"):
+                    if column not in columns:
+                        conn.execute("ALTER TABLE segments ADD COLUMN %s REAL" % column)
+            self._conn = conn
+        return self._conn
+
+    def exclusive(self):
+        """Блокировка компакции: архив и живая таблица не меняются, пока она взята"""
+        return self._compacting
+
+    def compact(self, job=None, days=None):
+        """Перенести сессии старше days дней в новый сегмент архива"""
+        from api.services.rollups import traffic_rollups
+
+        with self._compacting:
+            traffic_rollups.catch_up()
+            return self._compact(job, RETENTION_DAYS if days is None else days)
+
+    def _compact(self, job, days):
+        cutoff = datetime.now() - timedelta(days=days)
+        keys = key_index.get().ordered
+        if job is not None:
+            job.total = len(keys)
+        with self._lock:
+            marks = {r["key_id"]: r["last_id"] for r in self._db().execute("SELECT key_id, last_id FROM archived")}
+        name = "sessions-%s.gz" % datetime.now().strftime("%Y%m%d%H%M%S%f")
+        path = storage.data_path("archive", name)
+        archived = removed = 0
+        with open(path, "ab") as segment:
+            for key in keys:
+                last = marks.get(key.id, 0)
+                rows = sorted(get_session_db(key), key=lambda s: s.id)
+                # Уже в архиве: прошлая компакция прервалась до удаления строк
+                done = [s for s in rows if s.id <= last]
+                old = []
+                for s in rows[len(done):]:
+                    moment = s.disconnected or s.connected
+                    if moment is None or moment >= cutoff:
+                        break
+                    old.append(s)
+                if old:
+                    self._append(segment, name, key, old)
+                    archived += len(old)
+                if done or old:
+                    _delete(done + old)
+                    removed += len(done) + len(old)
+                if job is not None:
+                    job.advance(1)
+        if not archived:
+            os.remove(path)
+        if removed:
+            changes.bump(changes.SESSIONS)
+        return {"archived": archived, "segment": name if archived else None}
+
+    def _append(self, segment, name, key, sessions):
+        payload = "".join(json.dumps(_record(key, s)) + "\n" for s in sessions).encode("utf-8")
+        block = gzip.compress(payload)
+        offset = segment.tell()
+        segment.write(block)
+        segment.flush()
+        os.fsync(segment.fileno())
+        # Строки из живой таблицы удаляются только после записи блока и индекса
+        with self._lock:
+            db = self._db()
+            with db:
+                moments = [_moment(s.connected) for s in sessions]
+                db.execute(
+                    "INSERT INTO segments (key_id, segment, offset, length, sessions, created, newest, oldest) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key.id, name, offset, len(block), len(sessions), int(time.time()), max(moments), min(moments))
+                )
+                db.execute(
+                    "INSERT INTO totals (key_id, config_id, bytes, seconds, sessions) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (key_id) DO UPDATE SET bytes = bytes + excluded.bytes, "
+                    "seconds = seconds + excluded.seconds, sessions = sessions + excluded.sessions, "
+                    "config_id = excluded.config_id",
+                    (key.id, key.config_id, sum(s.total_bytes or 0 for s in sessions),
+                     sum(s.total_connected_time or 0 for s in sessions), len(sessions))
+                )
+                db.execute(
+                    "INSERT INTO archived (key_id, last_id) VALUES (?, ?) "
+                    "ON CONFLICT (key_id) DO UPDATE SET last_id = excluded.last_id",
+                    (key.id, sessions[-1].id)
+                )
+
+    def records(self, key_id, since=None):
+        """Архивные записи ключа как есть; since — только блоки, записанные не раньше этой метки"""
+        with self._lock:
+            blocks = self._db().execute(
+                "SELECT segment, offset, length FROM segments WHERE key_id = ? AND created >= ? ORDER BY created DESC",
+                (key_id, int(since) if since is not None else 0)
+            ).fetchall()
+        for block in blocks:
+            yield from self._read(block)
+
+    def _read(self, block):
+        with open(storage.data_path("archive", block["segment"]), "rb") as f:
+            f.seek(block["offset"])
+            data = gzip.decompress(f.read(block["length"]))
+        return [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
+
+    def all_records(self):
+        """Все архивные записи всех ключей"""
+        with self._lock:
+            blocks = self._db().execute("SELECT segment, offset, length FROM segments").fetchall()
+        for block in blocks:
+            yield from self._read(block)
+
+    def blocks(self, key_id):
+        """Блоки ключа, начиная с самой свежей сессии (блоки без меток — первыми)"""
+        with self._lock:
+            return self._db().execute(
+                "SELECT segment, offset, length, newest, oldest FROM segments WHERE key_id = ? "
+                "ORDER BY newest IS NOT NULL, newest DESC", (key_id,)
+            ).fetchall()
+
+    def block_rows(self, block):
+        return [_row(record) for record in self._read(block)]
+
+    def totals(self):
+        """Суммы по архиву: {key_id: (config_id, bytes, seconds, sessions)}"""
+        with self._lock:
+            rows = self._db().execute("SELECT key_id, config_id, bytes, seconds, sessions FROM totals").fetchall()
+        return {r["key_id"]: (r["config_id"], r["bytes"], r["seconds"], r["sessions"]) for r in rows}
+
+    def key_total(self, key_id):
+        """Суммы по архиву одного ключа: (bytes, seconds, sessions)"""
+        with self._lock:
+            row = self._db().execute("SELECT bytes, seconds, sessions FROM totals WHERE key_id = ?", (key_id,)).fetchone()
+        return (row["bytes"], row["seconds"], row["sessions"]) if row else (0, 0, 0)
+
+    def forget(self, key_id):
+        """Забыть архив ключа (очистка трафика); сегменты не переписываются"""
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("DELETE FROM segments WHERE key_id = ?", (key_id,))
+                db.execute("DELETE FROM totals WHERE key_id = ?", (key_id,))
+                db.execute("DELETE FROM archived WHERE key_id = ?", (key_id,))
+
+    def start(self, interval=COMPACT_INTERVAL):
+        """Периодическая компакция по политике хранения"""
+        if RETENTION_DAYS <= 0 or self._timer is not None:
+            return
+
+        def tick():
+            try:
+                self.compact()
+            finally:
+                self._timer = threading.Timer(interval, tick)
+                self._timer.daemon = True
+                self._timer.start()
+
+        self._timer = threading.Timer(COMPACT_STARTUP_DELAY, tick)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+def session_page(key, limit=None, after=None, include_archive=True):
+    """
+    Страница истории сессий ключа, свежие первыми.
+    Берутся только сессии после курсора; блоки архива читаются, пока
+    они могут попасть на страницу.
+    """
+    scope = ["sessions", key.id]
+    after_key = None
+    if after is not None:
+        cursor = decode_cursor(after)
+        if cursor.get("scope") != scope:
+            raise ValueError("Cursor belongs to another query")
+        if not isinstance(cursor.get("key"), list):
+            raise ValueError("Invalid cursor")
+        after_key = cursor["key"]
+
+    def fresh(rows):
+        return [r for r in rows if after_key is None or list(session_sort_key(r)) > after_key]
+
+    # Строкой больше страницы — чтобы знать, есть ли следующая
+    want = None if limit is None else limit + 1
+
+    def top(rows):
+        if want is None:
+            return sorted(rows, key=session_sort_key)
+        return heapq.nsmallest(want, rows, key=session_sort_key)
+
+    rows = top(fresh(live_row(s) for s in get_session_db(key)))
+    if include_archive:
+        for block in session_archive.blocks(key.id):
+            newest, oldest = block["newest"], block["oldest"]
+            # Все сессии блока позже последней строки страницы — дальше только старее
+            if want is not None and len(rows) >= want and newest is not None \
+                    and -newest > session_sort_key(rows[-1])[0]:
+                break
+            # Все сессии блока до курсора
+            if after_key is not None and oldest is not None and -oldest < after_key[0]:
+                continue
+            rows = top(rows + fresh(session_archive.block_rows(block)))
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor({"scope": scope, "id": last["id"], "key": list(session_sort_key(last))})
+
+
+session_archive = SessionArchive()
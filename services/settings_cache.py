@@ -0,0 +1,73 @@
+"""
+Кэш настроек бота/почты и флагов почтовых оповещений.
+
+Загружается один раз, обновляется write-through при изменении через API
+и помечается версией таблицы settings. Бот может менять настройки
+напрямую в БД, поэтому без изменений через API кэш живёт не дольше TTL.
+"""
+from functions.data.settings import get_settings_db
+
+from api.models.settings import SettingsOut
+from api.services import changes
+from api.services.lazy import lazy
+
+load_mail_settings, save_mail_settings = lazy("functions.other", "load_mail_settings", "save_mail_settings")
+
+SETTINGS_TTL = 30.0
+
+
+class SettingsSnapshot:
+    def __init__(self, settings, mail_notify):
+        self.settings = settings
+        self.mail_notify = mail_notify
+
+
+def _snapshot(s):
+    # Без валидации: на свежей установке bot_token и bot_chat_id ещё пустые
+    return SettingsOut.construct(**{field: getattr(s, field, None) for field in SettingsOut.__fields__})
+
+
+def _load():
+    return SettingsSnapshot(_snapshot(get_settings_db()), dict(load_mail_settings() or {}))
+
+
+_cache = changes.VersionedCache(_load, (changes.SETTINGS,), SETTINGS_TTL)
+
+
+def get_settings():
+    """Настройки бота и почты (SettingsOut)"""
+    return _cache.get().settings
+
+
+def get_mail_notify():
+    """Флаги почтовых оповещений (mail_create_key, mail_expired_key, ...)"""
+    return _cache.get().mail_notify
+
+
+def mail_notify_enabled(flag):
+    return bool(get_mail_notify().get(flag))
+
+
+def update_settings(**fields):
+    """Записать поля настроек в БД и сразу обновить кэш"""
+    current = _cache.get()
+    s = get_settings_db()
+    for field, value in fields.items():
+        setattr(s, field, value)
+    s.save()
+    changes.bump(changes.SETTINGS)
+    settings = _snapshot(s)
+    _cache.set(SettingsSnapshot(settings, current.mail_notify))
+    return settings
+
+
+def update_mail_notify(values):
+    """Обновить флаги оповещений в файле настроек и в кэше"""
+    current = _cache.get()
+    # Бот мог изменить файл после загрузки кэша — сливаем со свежей копией
+    mail_settings = dict(load_mail_settings() or {})
+    mail_settings.update(values)
+    save_mail_settings(mail_settings)
+    changes.bump(changes.SETTINGS)
+    _cache.set(SettingsSnapshot(current.settings, mail_settings))
+    return mail_settings
@@ -0,0 +1,111 @@
+"""
+Агрегированная статистика по ключам и конфигам.
+
+Все счётчики считаются за один проход по таблице ключей, а готовый снимок
+кэшируется до изменения ключей/конфигов/сессий. Трафик берётся из итогов
+роллапов (services/rollups.py): общий — одной суммой, по конфигам — из
+итогов ключей (key_aggregates) в том же проходе, без запроса на каждый
+конфиг. Пока итоги не посчитаны (первый старт), — из таблицы сессий и
+архива.
+"""
+from datetime import datetime
+
+from functions.data.key import get_keys_db
+from functions.data.configs import get_configs_db
+from functions.data.session import (
+    get_total_keys_bytes_db, get_total_key_bytes_by_config_db
+)
+
+from api.services import changes
+from api.services.key_index import key_aggregates
+from api.services.rollups import traffic_rollups
+from api.services.session_archive import session_archive
+from api.services.lazy import lazy
+
+math_bytes = lazy("functions.other", "math_bytes")
+
+# Сессии и флаг connected пишет сам OpenVPN в обход API,
+# поэтому даже без изменений через API снимок живёт не дольше TTL (сек).
+SNAPSHOT_TTL = 10.0
+
+_TRACKED = (changes.KEYS, changes.CONFIGS, changes.SESSIONS, changes.TRAFFIC)
+
+
+def _counters():
+    return {"total": 0, "active": 0, "blocked": 0, "connected": 0, "expired": 0, "not_expired": 0}
+
+
+def _count(counters, key, now):
+    counters["total"] += 1
+    counters["active" if key.status else "blocked"] += 1
+    if key.connected:
+        counters["connected"] += 1
+    if key.expired is not None and key.expired < now:
+        counters["expired"] += 1
+    else:
+        counters["not_expired"] += 1
+
+
+def _total_traffic(archived_total):
+    total = traffic_rollups.total_bytes()
+    return total if total is not None else get_total_keys_bytes_db() + archived_total
+
+
+def collect_statistics():
+    """Посчитать статистику за один проход по ключам"""
+    now = datetime.now()
+    configs = get_configs_db()
+    totals = _counters()
+    by_config = {c.id: _counters() for c in configs}
+    aggregates = key_aggregates.get()
+    traffic_by_config = {}
+
+    for key in get_keys_db():
+        _count(totals, key, now)
+        counters = by_config.get(key.config_id)
+        if counters is not None:
+            _count(counters, key, now)
+            traffic_by_config[key.config_id] = traffic_by_config.get(key.config_id, 0) + aggregates.value(key.id, 0)
+
+    # Без итогов роллапов: трафик сессий, перенесённых в архив, тоже входит в итоги
+    archived_total = 0
+    archived_by_config = {}
+    if not aggregates.complete:
+        for config_id, traffic, _, _ in session_archive.totals().values():
+            archived_total += traffic
+            archived_by_config[config_id] = archived_by_config.get(config_id, 0) + traffic
+
+    configs_stats = []
+    for config in configs:
+        counters = by_config[config.id]
+        configs_stats.append({
+            "id": config.id,
+            "port": config.port,
+            "protocol": config.protocol,
+            "address": config.address,
+            "keys_total": counters["total"],
+            "keys_active": counters["active"],
+            "keys_blocked": counters["blocked"],
+            "keys_connected": counters["connected"],
+            "keys_expired": counters["expired"],
+            "keys_not_expired": counters["not_expired"],
+            "traffic": math_bytes(
+                traffic_by_config.get(config.id, 0) if aggregates.complete
+                else get_total_key_bytes_by_config_db(config.id) + archived_by_config.get(config.id, 0)
+            ),
+        })
+
+    return {
+        "total_keys": totals["total"],
+        "active_keys": totals["active"],
+        "blocked_keys": totals["blocked"],
+        "connected_keys": totals["connected"],
+        "expired_keys": totals["expired"],
+        "not_expired_keys": totals["not_expired"],
+        "total_configs": len(configs),
+        "total_traffic": math_bytes(_total_traffic(archived_total)),
+        "configs": configs_stats
+    }
+
+
+statistics_cache = changes.VersionedCache(collect_statistics, _TRACKED, SNAPSHOT_TTL)
@@ -0,0 +1,28 @@
+"""
+Собственное хранилище API (роллапы, архивы, служебные таблицы).
+
+Данные бота живут в его БД, а то, что ведёт сам API, хранится в
+отдельных SQLite-файлах в DATA_DIR (переменная OPENVPN_API_DATA).
+"""
+import os
+import sqlite3
+
+DATA_DIR = os.environ.get(
+    "OPENVPN_API_DATA",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+)
+
+
+def data_path(*parts):
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def connect(name):
+    """Соединение с SQLite-файлом name.sqlite3 в DATA_DIR"""
+    conn = sqlite3.connect(data_path(name + ".sqlite3"), check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,348 @@
+"""
+Лимиты трафика по ключам и конфигам.
+
+Источник — уведомления >BYTECOUNT_CLI management-интерфейса (включаются
+командой bytecount): в них накопленные байты текущей сессии клиента.
+Движок переводит их в приращения и складывает в компактные массивы
+array('q'), индексированные ID ключа, поэтому тик стоит O(изменившихся
+ключей), а не пересчёт всех сессий. Лимит ключа задаётся явно, иначе
+действует лимит его конфига (как лимит по умолчанию для каждого ключа
+конфига); 0 — без лимита.
+
+При превышении ключ сразу блокируется, клиент отключается командой
+kill, публикуется событие key.traffic_limit и, если включён флаг
+mail_traffic_limit, уходит письмо. Счётчики и учтённые байты живых
+сессий сбрасываются в SQLite пачками раз в FLUSH_INTERVAL, так что
+рестарт API не считает трафик повторно. Начальное значение счётчика
+ключа — его трафик из истории сессий: в тике — из кэша агрегатов, а в
+GET /keys/{id}/traffic — из сессий и архива самого ключа.
+"""
+import asyncio
+import logging
+import threading
+import time
+from array import array
+
+from fastapi.concurrency import run_in_threadpool
+
+from functions.data.key import get_key_by_id
+from functions.data.session import get_session_db
+
+from api.services import changes, storage
+from api.services.events import publish_key
+from api.services.key_index import key_index, key_aggregates
+from api.services.notifications import dispatcher, NotificationQueueFull
+from api.services.session_archive import session_archive
+from api.services.settings_cache import mail_notify_enabled
+from api.services.lazy import lazy
+
+block_key = lazy("functions.client", "block_key")
+
+logger = logging.getLogger(__name__)
+
+BYTECOUNT_INTERVAL = 5
+FLUSH_INTERVAL = 10.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS traffic_limits (
+    scope TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (scope, id)
+);
+CREATE TABLE IF NOT EXISTS traffic_usage (
+    key_id INTEGER PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    history INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS traffic_marks (
+    config_id INTEGER NOT NULL,
+    common_name TEXT NOT NULL,
+    since INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (config_id, common_name, since)
+);
+"""
+
+
+def _grow(values, index):
+    if index >= len(values):
+        grow = max(index + 1, 2 * len(values)) - len(values)
+        values.frombytes(bytes(values.itemsize * grow))
+
+
+def _history(key_id):
+    """Трафик одного ключа по истории: живые сессии плюс архив"""
+    key = get_key_by_id(key_id)
+    if key is None:
+        return 0
+    return session_archive.key_total(key_id)[0] + sum(s.total_bytes or 0 for s in get_session_db(key))
+
+
+def _since(client):
+    since = client["connected_since"]
+    return int(since.timestamp()) if since is not None else 0
+
+
+class TrafficLimits:
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.used = array("q")
+        self.key_limits = array("q")
+        self.config_limits = {}
+        self.loaded = array("b")
+        self._marks = {}
+        self._dirty_keys = set()
+        self._dirty_marks = set()
+        self._closed_marks = set()
+        self._enforced = set()
+        self._pool = None
+        self._thread = None
+
+    def _db(self):
+        if self._conn is None:
+            conn = storage.connect("traffic_limits")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _query(self, sql, args=()):
+        with self._db_lock:
+            return self._db().execute(sql, args).fetchall()
+
+    def load(self):
+        """Лимиты, счётчики и отметки живых сессий из SQLite"""
+        with self._lock:
+            for row in self._query("SELECT scope, id, bytes FROM traffic_limits"):
+                if row["scope"] == "key":
+                    _grow(self.key_limits, row["id"])
+                    self.key_limits[row["id"]] = row["bytes"]
+                else:
+                    self.config_limits[row["id"]] = row["bytes"]
+            for row in self._query("SELECT key_id, bytes, history FROM traffic_usage"):
+                self._set_used(row["key_id"], row["bytes"], row["history"])
+            for row in self._query("SELECT config_id, common_name, since, bytes FROM traffic_marks"):
+                self._marks[(row["config_id"], row["common_name"], row["since"])] = row["bytes"]
+
+    def _set_used(self, key_id, value, history=1):
+        _grow(self.used, key_id)
+        _grow(self.loaded, key_id)
+        self.used[key_id] = value
+        self.loaded[key_id] = history
+
+    def _baseline(self, key_id):
+        # Первый учёт ключа: добавить трафик из истории сессий (кэш агрегатов).
+        # Пока агрегаты не посчитаны, приращения копятся и история добавится позже.
+        _grow(self.used, key_id)
+        _grow(self.loaded, key_id)
+        if self.loaded[key_id]:
+            return
+        aggregates = key_aggregates.peek()
+        if aggregates is None or not aggregates.complete:
+            return
+        self._seed(key_id, aggregates.value(key_id, 0))
+
+    def _seed(self, key_id, history):
+        if self.loaded[key_id]:
+            return
+        self.used[key_id] += history
+        self.loaded[key_id] = 1
+        self._dirty_keys.add(key_id)
+
+    def start(self, pool):
+        """Загрузить состояние, подписаться на management_pool и включить bytecount"""
+        self.load()
+        self._pool = pool
+        pool.subscribe(self.on_notification)
+        pool.subscribe_closed(self.on_closed)
+        pool.enable_bytecount(BYTECOUNT_INTERVAL)
+        self._start_flusher()
+
+    def limit_for(self, key_id, config_id):
+        limit = self.key_limits[key_id] if key_id < len(self.key_limits) else 0
+        return limit or self.config_limits.get(config_id, 0)
+
+    def used_by(self, key_id):
+        with self._lock:
+            return self.used[key_id] if key_id < len(self.used) else 0
+
+    def on_notification(self, config_id, line):
+        if not line.startswith("BYTECOUNT_CLI:"):
+            return
+        try:
+            cid, rx, tx = (int(v) for v in line[len("BYTECOUNT_CLI:"):].split(","))
+        except ValueError:
+            return
+        client = self._pool.clients.get(config_id) if self._pool is not None else None
+        if client is None:
+            return
+        # cid -> клиент из последнего опроса status; неизвестный пока не учитывается
+        session = client.by_client_id.get(cid)
+        index = key_index.peek()
+        if session is None or index is None:
+            return
+        keys = index.by_name.get(session["common_name"])
+        if not keys:
+            return
+        key = keys[0]
+        over = self.account(key.id, key.config_id, (config_id, session["common_name"], _since(session)), rx + tx)
+        if over:
+            asyncio.ensure_future(self._enforce(key.id, config_id, session["common_name"]))
+
+    def account(self, key_id, config_id, mark, total):
+        """Учесть накопленные байты сессии; True — ключ только что превысил лимит"""
+        with self._lock:
+            self._baseline(key_id)
+            delta = total - self._marks.get(mark, 0)
+            if delta <= 0:
+                return False
+            self._marks[mark] = total
+            self._dirty_marks.add(mark)
+            self.used[key_id] += delta
+            self._dirty_keys.add(key_id)
+            limit = self.limit_for(key_id, config_id)
+            if limit and self.used[key_id] > limit and key_id not in self._enforced:
+                self._enforced.add(key_id)
+                return True
+            return False
+
+    def on_closed(self, config_id, clients):
+        with self._lock:
+            for c in clients:
+                mark = (config_id, c["common_name"], _since(c))
+                if self._marks.pop(mark, None) is not None:
+                    self._closed_marks.add(mark)
+                    self._dirty_marks.discard(mark)
+
+    async def _enforce(self, key_id, config_id, common_name):
+        key = await run_in_threadpool(get_key_by_id, key_id)
+        if key is None:
+            return
+        if key.status:
+            await run_in_threadpool(block_key, key)
+            changes.bump(changes.KEYS)
+        try:
+            await self._pool.kill(config_id, common_name)
+        except Exception as e:
+            logger.warning("kill %s on config %s failed: %s", common_name, config_id, e)
+        publish_key("key.traffic_limit", key_id, key.config_id,
+                    used=self.used_by(key_id), limit=self.limit_for(key_id, key.config_id))
+        if key.email and mail_notify_enabled("mail_traffic_limit"):
+            try:
+                dispatcher.enqueue("traffic_limit", [key_id])
+            except NotificationQueueFull:
+                logger.warning("notification queue is full, traffic limit mail for key %s dropped", key_id)
+
+    def set_limit(self, scope, target_id, limit):
+        """Задать лимит (байты) ключу или конфигу; None или 0 — снять"""
+        limit = limit or 0
+        with self._db_lock:
+            db = self._db()
+            with db:
+                if limit:
+                    db.execute(
+                        "INSERT INTO traffic_limits (scope, id, bytes) VALUES (?, ?, ?) "
+                        "ON CONFLICT (scope, id) DO UPDATE SET bytes = excluded.bytes",
+                        (scope, target_id, limit)
+                    )
+                else:
+                    db.execute("DELETE FROM traffic_limits WHERE scope = ? AND id = ?", (scope, target_id))
+        with self._lock:
+            if scope == "key":
+                _grow(self.key_limits, target_id)
+                self.key_limits[target_id] = limit
+                affected = [target_id]
+            else:
+                self.config_limits[target_id] = limit
+                index = key_index.peek()
+                affected = [k.id for k in index.by_config.get(target_id, [])] if index is not None else []
+            # Новый лимит может снова разрешить ключ или, наоборот, уже быть превышен
+            self._enforced.difference_update(affected)
+        return limit
+
+    def reset(self, key_id):
+        """Обнулить счётчик ключа (очистка трафика)"""
+        with self._lock:
+            self._set_used(key_id, 0)
+            self._dirty_keys.add(key_id)
+            self._enforced.discard(key_id)
+
+    def usage(self, key_id, config_id):
+        with self._lock:
+            self._baseline(key_id)
+            seeded = self.loaded[key_id]
+        if not seeded:
+            # Агрегатов ещё нет: история только этого ключа, без прохода по всем
+            history = _history(key_id)
+            with self._lock:
+                self._seed(key_id, history)
+        with self._lock:
+            used = self.used[key_id]
+        limit = self.limit_for(key_id, config_id)
+        return {
+            "key_id": key_id,
+            "used": used,
+            "limit": limit or None,
+            "remaining": max(0, limit - used) if limit else None,
+            "exceeded": bool(limit) and used > limit,
+        }
+
+    def flush(self):
+        """Сбросить изменившиеся счётчики и отметки сессий одной транзакцией"""
+        with self._lock:
+            # history = 0: история сессий ещё не добавлена, добавится после рестарта
+            usage = [(key_id, self.used[key_id], self.loaded[key_id]) for key_id in self._dirty_keys]
+            marks = [mark + (self._marks[mark],) for mark in self._dirty_marks]
+            closed = list(self._closed_marks)
+            self._dirty_keys, self._dirty_marks, self._closed_marks = set(), set(), set()
+        if not (usage or marks or closed):
+            return 0
+        try:
+            self._write(usage, marks, closed)
+        except Exception:
+            # Не записалось — вернуть в очередь на следующий сброс
+            with self._lock:
+                self._dirty_keys.update(row[0] for row in usage)
+                self._dirty_marks.update(m[:3] for m in marks if m[:3] in self._marks)
+                self._closed_marks.update(closed)
+            raise
+        return len(usage)
+
+    def _write(self, usage, marks, closed):
+        with self._db_lock:
+            db = self._db()
+            with db:
+                db.executemany(
+                    "INSERT INTO traffic_usage (key_id, bytes, history) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key_id) DO UPDATE SET bytes = excluded.bytes, history = excluded.history", usage
+                )
+                db.executemany(
+                    "INSERT INTO traffic_marks (config_id, common_name, since, bytes) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (config_id, common_name, since) DO UPDATE SET bytes = excluded.bytes", marks
+                )
+                db.executemany(
+                    "DELETE FROM traffic_marks WHERE config_id = ? AND common_name = ? AND since = ?", closed
+                )
+
+    def _start_flusher(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="traffic-limits", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            # Агрегаты по истории сессий — база для счётчиков ключей
+            key_aggregates.get()
+        except Exception:
+            logger.exception("traffic history aggregation failed")
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("traffic counters flush failed")
+
+
+traffic_limits = TrafficLimits()
\ No newline at end of file
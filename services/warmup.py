@@ -0,0 +1,54 @@
+"""
+Прогрев воркера при старте.
+
+До готовности (/health/ready) каждый поток пулов data_access открывает
+соединение с БД бота, чтобы первые запросы не платили за подключение.
+После готовности в фоне импортируются отложенные подсистемы бота
+(services/lazy.py) и строится индекс ключей — первые запросы к ним не
+ждут. Длительность этапов — метрика openvpn_api_startup_seconds.
+"""
+import asyncio
+import logging
+import time
+
+from api.services import lazy
+from api.services.data_access import data_access
+from api.services.key_index import key_index
+from api.services.metrics import registry, Gauge
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TIMEOUT = 10.0
+
+phases = {}
+
+
+def record(phase, seconds):
+    phases[(phase,)] = round(seconds, 4)
+
+
+async def warm_up():
+    """Открыть соединения с БД (ждём) и запустить фоновый прогрев (не ждём)"""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(data_access.warm_up(), WARMUP_TIMEOUT)
+    except Exception as e:
+        # Готовность всё равно проверит БД; воркер не должен зависнуть на старте
+        logger.warning("database warm-up failed: %s", str(e) or e.__class__.__name__)
+    record("connections", time.perf_counter() - started)
+    asyncio.ensure_future(_background())
+
+
+async def _background():
+    started = time.perf_counter()
+    try:
+        await data_access.scan.run(lazy.preload)
+        record("lazy_imports", time.perf_counter() - started)
+        started = time.perf_counter()
+        await data_access.scan.run(key_index.get)
+        record("key_index", time.perf_counter() - started)
+    except Exception:
+        logger.exception("background warm-up failed")
+
+
+registry.add(Gauge("openvpn_api_startup_seconds", "Worker startup phases", ("phase",), collect=lambda: dict(phases)))
\ No newline at end of file
@@ -0,0 +1,317 @@
+"""
+Роль процесса при запуске несколькими воркерами (python -m api.server).
+
+Воркеры делят один слушающий сокет. Воркер 0 — основной: только в нём
+работают фоновые службы (опрос management-интерфейса, планировщик
+сроков, лимиты трафика, архив сессий), очередь задач и рассылка писем.
+Остальные воркеры отвечают на чтения сами, а изменения и чтения
+состояния основного (живые сессии, задачи, уведомления, трафик ключа)
+передают ему через его Unix-сокет — PrimaryForwardMiddleware. Кэши
+воркеров согласованы общими счётчиками изменений (changes), а события
+основной раздаёт остальным датаграммами (EventRelay), поэтому SSE и
+WebSocket работают в любом воркере. Метрики каждый воркер раз в
+METRICS_INTERVAL сбрасывает в файл (MetricsExport), и /metrics любого
+воркера отдаёт ряды всех с меткой worker.
+
+Без OPENVPN_API_WORKER (uvicorn api.app:app, python main.py --reload)
+процесс один и сам себе основной.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import socket
+import time
+
+from api.services import storage
+
+logger = logging.getLogger(__name__)
+
+# Чтения, которые знает только основной воркер (состояние в его памяти)
+PRIMARY_READS = re.compile(r"^/(sessions/live|jobs|notifications)(/|$)|^/keys/\d+/traffic$")
+LOCAL_METHODS = ("GET", "HEAD", "OPTIONS")
+LOCAL_PATHS = ("/health/", "/metrics")
+# Заголовки одного соединения — не передаются дальше
+HOP_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"upgrade", b"host", b"te", b"trailer"}
+
+MAX_DATAGRAM = 1 << 18
+PEERS_REFRESH = 1.0
+METRICS_INTERVAL = 5.0
+# Файл метрик старше — воркера уже нет (уменьшили --workers)
+METRICS_STALE = 3 * METRICS_INTERVAL
+
+
+def worker_id():
+    """Номер воркера или None при запуске одним процессом (читается после fork)"""
+    return os.environ.get("OPENVPN_API_WORKER")
+
+
+def is_primary():
+    return worker_id() in (None, "0")
+
+
+def run_path(name):
+    """Путь в каталоге сокетов воркеров (DATA_DIR/run)"""
+    return storage.data_path("run", name)
+
+
+def primary_socket():
+    return run_path("primary.sock")
+
+
+class WorkerState:
+    """Готовность воркера для /health и супервизора"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.ready = False
+        self.draining = False
+
+    def mark_ready(self):
+        self.ready = True
+        # Супервизор ждёт байт в канале, прежде чем гасить заменяемый воркер
+        ready_fd = os.environ.pop("OPENVPN_API_READY_FD", None)
+        if ready_fd is not None:
+            try:
+                os.write(int(ready_fd), b"1")
+                os.close(int(ready_fd))
+            except OSError:
+                pass
+
+    def to_dict(self):
+        return {
+            "worker": worker_id(), "primary": is_primary(), "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "ready": self.ready, "draining": self.draining,
+        }
+
+
+def forwarded(method, path):
+    """Передать ли запрос основному воркеру"""
+    if path.startswith(LOCAL_PATHS):
+        return False
+    if method in LOCAL_METHODS:
+        return PRIMARY_READS.match(path) is not None
+    return True
+
+
+async def _error(send, status, detail):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1")),
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class PrimaryForwardMiddleware:
+    """ASGI-middleware второстепенного воркера: изменения — основному воркеру"""
+
+    def __init__(self, app, socket_path=None):
+        self.app = app
+        self.socket_path = socket_path or primary_socket()
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+            # Без таймаута: импорт и восстановление БД идут до получаса
+            self._client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=self.socket_path), base_url="http://primary", timeout=None
+            )
+        return self._client
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or is_primary() or not forwarded(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        await self._forward(scope, receive, send)
+
+    async def _forward(self, scope, receive, send):
+        async def body():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                if message.get("body"):
+                    yield message["body"]
+                if not message.get("more_body"):
+                    return
+
+        import httpx
+        headers = [(k, v) for k, v in scope["headers"] if k not in HOP_HEADERS]
+        if scope.get("client"):
+            headers.append((b"x-forwarded-for", scope["client"][0].encode("latin-1")))
+        url = scope.get("raw_path") or scope["path"].encode("utf-8")
+        if scope.get("query_string"):
+            url += b"?" + scope["query_string"]
+        client = self._http()
+        request = client.build_request(scope["method"], url.decode("latin-1"), headers=headers, content=body())
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TransportError as e:
+            logger.warning("primary worker is unavailable: %s", e)
+            await _error(send, 503, "Primary worker is unavailable")
+            return
+        try:
+            await send({
+                "type": "http.response.start", "status": response.status_code,
+                "headers": [(k, v) for k, v in response.headers.raw if k.lower() not in HOP_HEADERS],
+            })
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await response.aclose()
+
+
+class EventRelay:
+    """
+    События основного воркера — остальным: датаграмма в Unix-сокет
+    каждого воркера. Не успевающий читать воркер теряет события, а не
+    тормозит основной. ID событий выдаёт основной, поэтому Last-Event-ID
+    работает при переподключении к другому воркеру.
+    """
+
+    def __init__(self):
+        self._sock = None
+        self._path = None
+        self._loop = None
+        self._peers = []
+        self._scanned = 0.0
+        self.dropped = 0
+
+    def start(self, bus, loop):
+        if worker_id() is None:
+            return
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        if is_primary():
+            bus.relay = self.send
+            return
+        # Имя по pid: при замене воркера старый и новый живут одновременно
+        self._path = run_path("events-%d.sock" % os.getpid())
+        self._sock.bind(self._path)
+        self._loop = loop
+        loop.add_reader(self._sock.fileno(), self._receive, bus)
+
+    def _peer_paths(self):
+        now = time.monotonic()
+        if now - self._scanned >= PEERS_REFRESH:
+            self._peers = glob.glob(run_path("events-*.sock"))
+            self._scanned = now
+        return self._peers
+
+    def send(self, event):
+        data = event.payload.encode("utf-8")
+        for path in self._peer_paths():
+            try:
+                self._sock.sendto(data, path)
+            except BlockingIOError:
+                self.dropped += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Воркер завершился, не убрав сокет
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                self._scanned = 0.0
+            except OSError as e:
+                self.dropped += 1
+                logger.warning("event relay to %s failed: %s", path, e)
+
+    def _receive(self, bus):
+        while True:
+            try:
+                data = self._sock.recv(MAX_DATAGRAM)
+            except BlockingIOError:
+                return
+            except OSError:
+                return
+            try:
+                bus.receive(json.loads(data))
+            except Exception:
+                logger.exception("relayed event is invalid")
+
+    def stop(self):
+        if self._sock is None:
+            return
+        if self._loop is not None:
+            self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        if self._path is not None:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+
+
+class MetricsExport:
+    """
+    Ряды метрик воркера — в run/metrics-<номер>.json раз в interval.
+    Файл по номеру, а не pid: сменщик воркера продолжает те же ряды.
+    Снимается в цикле событий, как и сам /metrics (лимитер пула потоков).
+    """
+
+    def __init__(self, interval=METRICS_INTERVAL):
+        self.interval = interval
+        self._registry = None
+        self._task = None
+
+    def _const(self):
+        return (("worker", worker_id()),)
+
+    def _path(self, worker):
+        return run_path("metrics-%s.json" % worker)
+
+    def start(self, registry):
+        if worker_id() is None or self._task is not None:
+            return
+        self._registry = registry
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while not worker_state.draining:
+            try:
+                self.write()
+            except Exception:
+                logger.exception("metrics export failed")
+            await asyncio.sleep(self.interval)
+
+    def write(self):
+        path = self._path(worker_id())
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self._registry.families(self._const()), f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def _others(self):
+        own = self._path(worker_id())
+        now = time.time()
+        for path in glob.glob(self._path("*")):
+            if path == own:
+                continue
+            try:
+                if now - os.stat(path).st_mtime > METRICS_STALE:
+                    continue
+                with open(path) as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def render(self, registry):
+        """Текст /metrics: один процесс — свои ряды, несколько воркеров — ряды всех"""
+        if worker_id() is None:
+            return registry.render()
+        return registry.render(self._const(), list(self._others()))
+
+
+worker_state = WorkerState()
+event_relay = EventRelay()
+metrics_export = MetricsExport()
\ No newline at end of file